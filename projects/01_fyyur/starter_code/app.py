@@ -3,6 +3,8 @@
 #----------------------------------------------------------------------------#
 
 import json
+import time
+import click
 import dateutil.parser
 import babel
 from flask import (Flask, 
@@ -11,7 +13,10 @@ from flask import (Flask,
                   Response, 
                   flash, 
                   redirect, 
-                  url_for)
+                  url_for,
+                  abort,
+                  jsonify,
+                  stream_with_context)
 from flask_moment import Moment
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy.orm import load_only
@@ -21,9 +26,12 @@ from flask_wtf import Form, FlaskForm
 from forms import *
 from flask_migrate import Migrate
 from sqlalchemy.exc import SQLAlchemyError
-from sqlalchemy import distinct
+from sqlalchemy import func, tuple_
 import datetime
-from models import app, db, Venue, Artist, Show
+from itertools import groupby
+from models import app, db, Venue, Artist, Show, MusicGenre, venue_genres, artist_genres
+import search
+import scheduling
 
 #----------------------------------------------------------------------------#
 # App Config.
@@ -69,126 +77,77 @@ def index():
 #  Venues
 #  ----------------------------------------------------------------
 
+# Areas of the /venues page, [{"city", "state", "venues": [{"id", "name"}]}],
+# built from one ordered query and kept until this process creates, edits or
+# deletes a venue (VENUE_AREA_CACHE = False in config.py rebuilds them per
+# request, e.g. when several processes write venues).
+venue_area_index = None
+
+def venue_areas():
+  global venue_area_index
+  if venue_area_index is not None:
+    return venue_area_index
+
+  areas = group_areas(db.session.query(Venue.id, Venue.name, Venue.city, Venue.state))
+
+  if app.config.get("VENUE_AREA_CACHE", True):
+    venue_area_index = areas
+  return areas
+
+def invalidate_venue_areas():
+  global venue_area_index
+  venue_area_index = None
+
+def group_areas(query):
+  """Groups a query of (id, name, city, state) venue rows by area, in one
+  pass over the rows ordered by area."""
+  rows = query.order_by(Venue.state, Venue.city, Venue.id).all()
+  areas = []
+  for (city, state), venues in groupby(rows, key=lambda row: (row.city, row.state)):
+    areas.append({
+      "city": city,
+      "state": state,
+      "venues": [{"id": venue.id, "name": venue.name} for venue in venues]
+    })
+  return areas
+
 @app.route('/venues')
 def venues():
-
-    result = []
-
     try:
-        locations = db.session.query(distinct(Venue.city), Venue.state).all()
-
-        for location in locations:
-            city = location[0]
-            state = location[1]
-
-            location_info = {"city": city, "state": state, "venues": []}
-
-            venues = Venue.query.filter_by(city=city, state=state).all()
-
-            for venue in venues:
-                venue_name = venue.name
-                venue_id = venue.id
-
-                venue_data = {
-                    "id": venue_id,
-                    "name": venue_name
-                }
-
-                location_info["venues"].append(venue_data)
-
-            result.append(location_info)
-    
-    except:
+        areas = venue_areas()
+    except SQLAlchemyError:
         db.session.rollback()
         flash("Something went wrong. Please try again.")
         return render_template("pages/home.html")
 
-    finally:
-        return render_template("pages/venues.html", areas=result)
+    return render_template("pages/venues.html", areas=areas)
 
-@app.route('/venues/search', methods=['POST'])
+@app.route('/venues/search', methods=['GET', 'POST'])
 def search_venues():
-    
-    search = request.form.get("search_term", "")
-    search_result = {"count": 0, "data": []}
-
-    venue_id_name = ["id", "name"]
-    venue_search_results = (db.session.query(Venue).filter(Venue.name.ilike(f"%{search}%")).options(load_only(*venue_id_name)).all())
-
-    search_result["count"] = len(venue_search_results)
-
-    for result in venue_search_results:
-        venue_id_name = {
-            "id": result.id,
-            "name": result.name,
-        }
-        search_result["data"].append(venue_id_name)
-
-    return render_template("pages/search_venues.html", results=search_result, search_term=request.form.get("search_term", ""))
+    return render_kind_search("venues", "pages/search_venues.html")
 
 @app.route('/venues/<int:venue_id>')
 def show_venue(venue_id):
-  profile_data = []
-  query = db.session.query(   Show, Venue,
-                              Artist.id.label("artist_id"),
-                              Artist.name.label("artist_name"),
-                              Artist.image_link.label("artist_image_link")
-                              ).join(Venue).filter(Venue.id==venue_id).join(Artist).group_by(Show.id, Artist.id,Venue.id,).all()  
-  if query:
-        genres = split_genres((query[0].Venue.genres))
-        profile_data = {
-                  "id": venue_id ,
-                  "name": query[0].Venue.name ,
-                  "genres": genres ,
-                  "city": query[0].Venue.city ,
-                  "state":query[0].Venue.state ,
-                  "phone":query[0].Venue.phone ,
-                  "facebook_link": query[0].Venue.facebook_link ,
-                  "image_link":query[0].Venue.image_link ,
-                  }
+  venue = Venue.query.get(venue_id)
+  if venue is None:
+    abort(404)
 
-        upcoming_shows = []
-        past_shows = []
-        for d in query:
-            if datetime.datetime.today() > d.Show.start_time:
-                    show = {
-                                "artist_id": d.artist_id ,
-                                "artist_name": d.artist_name ,
-                                "artist_image_link": d.artist_image_link ,
-                                "start_time": str(d.Show.start_time)
-                                }
-                    past_shows.append(show)             
-                        
-            elif  datetime.datetime.today() <= d.Show.start_time:
-                    show = {
-                                "artist_id": d.artist_id ,
-                                "artist_name": d.artist_name ,
-                                "artist_image_link": d.artist_image_link ,
-                                "start_time": str(d.Show.start_time)
-                                }
-                    upcoming_shows.append(show) 
-                    
-        profile_data["past_shows_count"] = len(past_shows)
-        profile_data["upcoming_shows_count"] = len(upcoming_shows)                
-        profile_data["past_shows"] = past_shows
-        profile_data["upcoming_shows"] = upcoming_shows
-        return render_template('pages/show_venue.html', venue=profile_data)
-  else:
-     query = db.session.query(Venue).filter(Venue.id == venue_id).all()
-     genres = split_genres((query[0].genres))
-     profile_data = {
+  profile_data = {
                   "id": venue_id,
-                  "name": query[0].name,
-                  "genres": genres,
-                  "city": query[0].city,
-                  "state":query[0].state,
-                  "phone":query[0].phone,
-                  "address" :query[0].address,
-                  "facebook_link": query[0].facebook_link,
-                  "image_link":query[0].image_link ,
-                  "upcoming_shows_count" : 0 ,
-                  "past_shows_count" : 0   
-                  }  
+                  "name": venue.name,
+                  "genres": [genre.name for genre in venue.genres],
+                  "city": venue.city,
+                  "state": venue.state,
+                  "phone": venue.phone,
+                  "address": venue.address,
+                  "facebook_link": venue.facebook_link,
+                  "image_link": venue.image_link,
+                  }
+  profile_data.update(profile_shows(Show.venue_id, venue_id, Artist, [
+                                    Artist.id.label("artist_id"),
+                                    Artist.name.label("artist_name"),
+                                    Artist.image_link.label("artist_image_link")
+                                    ]))
   return render_template('pages/show_venue.html', venue=profile_data)
 
 #  Create Venue
@@ -214,12 +173,13 @@ def create_venue_submission():
                    state= request.form[ "state"],
                    phone=request.form["phone"],
                    address=request.form["address"],
-                   genres =request.form.getlist("genres"),
+                   genres =genres_named(request.form.getlist("genres")),
                    image_link= request.form["image_link"],
                    facebook_link= request.form["facebook_link"]
                   )
     db.session.add(new_venue)
     db.session.commit()
+    invalidate_venue_areas()
   except :
     error = True
     db.session.rollback()
@@ -243,6 +203,7 @@ def delete_venue(venue_id):
         venue = db.session.query(Venue).filter(Venue.id == venue_id).first()
         db.session.delete(venue)
         db.session.commit()
+        invalidate_venue_areas()
         flash("Venue " + name + " was deleted successfully")
     except:
         db.session.rollback()
@@ -261,99 +222,150 @@ def artists():
   artists_info = db.session.query(Artist).options(load_only(*artist_id_name)).all()
   return render_template('pages/artists.html', artists=artists_info)
 
-@app.route('/artists/search', methods=['POST'])
+@app.route('/artists/search', methods=['GET', 'POST'])
 def search_artists():
+    return render_kind_search("artists", "pages/search_artists.html")
 
-  search= request.form.get("search_term", "")
-  search_result = {"count": 0, "data": []}
-  artist_id_name = ["id", "name"]
+@app.route('/artists/<int:artist_id>')
+def show_artist(artist_id):
+  artist = Artist.query.get(artist_id)
+  if artist is None:
+    abort(404)
 
-  artist_search = (db.session.query(Artist).filter(Artist.name.ilike(f"%{search}%")).options(load_only(*artist_id_name)).all())
-  search_result["count"] = len(artist_search)
+  profile_data = {
+                  "id": artist_id,
+                  "name": artist.name,
+                  "genres": [genre.name for genre in artist.genres],
+                  "city": artist.city,
+                  "state": artist.state,
+                  "phone": artist.phone,
+                  "facebook_link": artist.facebook_link,
+                  "image_link": artist.image_link,
+                  }
+  profile_data.update(profile_shows(Show.artist_id, artist_id, Venue, [
+                                    Venue.id.label("venue_id"),
+                                    Venue.name.label("venue_name"),
+                                    Venue.image_link.label("venue_image_link")
+                                    ]))
+  return render_template('pages/show_artist.html', artist=profile_data)
+
+# Past shows are listed newest first, PAST_SHOWS_PER_PAGE at a time
+# (?past_page=2 for the next ones); upcoming shows are all listed.
+PAST_SHOWS_PER_PAGE = 12
+
+def profile_shows(owner_column, owner_id, other, columns):
+  """The shows of one venue or artist, split into past and upcoming in the
+  database at a single "now". owner_column is Show.venue_id or
+  Show.artist_id, other the model shown with each show and columns its
+  labelled columns. Every query is served by the (owner, start_time) index."""
+  now = datetime.datetime.today()
+  past_page = max(request.args.get("past_page", 1, type=int), 1)
+
+  # two index range counts, which beat one CASE over every show of the owner
+  owner_shows = db.session.query(func.count(Show.id)).filter(owner_column == owner_id)
+  counts = db.session.query(
+                            owner_shows.filter(Show.start_time < now).as_scalar(),
+                            owner_shows.filter(Show.start_time >= now).as_scalar()
+                            ).one()
+
+  shows = db.session.query(Show.start_time, *columns).join(other) \
+    .filter(owner_column == owner_id)
+  upcoming = shows.filter(Show.start_time >= now) \
+    .order_by(Show.start_time, Show.id).all()
+  past = shows.filter(Show.start_time < now) \
+    .order_by(Show.start_time.desc(), Show.id.desc()) \
+    .limit(PAST_SHOWS_PER_PAGE).offset((past_page - 1) * PAST_SHOWS_PER_PAGE).all()
+
+  def show_data(row):
+    show = row._asdict()
+    show["start_time"] = str(row.start_time)
+    return show
+
+  return {
+          "past_shows_count": counts[0],
+          "upcoming_shows_count": counts[1],
+          "past_shows": [show_data(row) for row in past],
+          "upcoming_shows": [show_data(row) for row in upcoming],
+          "past_page": past_page,
+          "past_pages": max((counts[0] + PAST_SHOWS_PER_PAGE - 1) // PAST_SHOWS_PER_PAGE, 1),
+          }
 
-  for result in artist_search:
-    artist_info = {
-      "id": result.id,
-      "name": result.name,
-      }
-    search_result["data"].append(artist_info)
+def genres_named(names):
+  """The MusicGenre rows of the given names, adding the ones that are not in
+  the Genre table yet."""
+  names = set(names)
+  genres = db.session.query(MusicGenre).filter(MusicGenre.name.in_(names)).all() if names else []
+  known = {genre.name for genre in genres}
+  for name in sorted(names - known):
+    genre = MusicGenre(name=name)
+    db.session.add(genre)
+    genres.append(genre)
+  return genres
+
+#  Browse by genre
+#  ----------------------------------------------------------------
 
+@app.route('/genres/<genre_name>/venues')
+def genre_venues(genre_name):
+  genre = db.session.query(MusicGenre).filter_by(name=genre_name).first_or_404()
+  areas = group_areas(db.session.query(Venue.id, Venue.name, Venue.city, Venue.state)
+                      .join(venue_genres, venue_genres.c.venue_id == Venue.id)
+                      .filter(venue_genres.c.genre_id == genre.id))
+  return render_template("pages/venues.html", areas=areas, genre=genre.name)
 
-  return render_template('pages/search_artists.html', results=search_result, search_term=request.form.get('search_term', ''))
+@app.route('/genres/<genre_name>/artists')
+def genre_artists(genre_name):
+  genre = db.session.query(MusicGenre).filter_by(name=genre_name).first_or_404()
+  artists_info = db.session.query(Artist.id, Artist.name) \
+    .join(artist_genres, artist_genres.c.artist_id == Artist.id) \
+    .filter(artist_genres.c.genre_id == genre.id).order_by(Artist.name, Artist.id).all()
+  return render_template('pages/artists.html', artists=artists_info, genre=genre.name)
 
-@app.route('/artists/<int:artist_id>')
-def show_artist(artist_id):
-  profile_data = []
-  query = db.session.query(   Show, Artist,
-                              Venue.id.label("venue_id"),
-                              Venue.name.label("venue_name"),
-                              Venue.image_link.label("venue_image_link")
-                              ).join(Artist).filter(Artist.id==artist_id).join(Venue).group_by(Show.id, Artist.id,Venue.id,).all()  
-  if query:
-        genres = split_genres((query[0].Artist.genres))
-        profile_data = {
-                  "id": artist_id ,
-                  "name": query[0].Artist.name ,
-                  "genres": genres ,
-                  "city": query[0].Artist.city ,
-                  "state": query[0].Artist.state ,
-                  "phone": query[0].Artist.phone ,
-                  "facebook_link": query[0].Artist.facebook_link ,
-                  "image_link": query[0].Artist.image_link , 
-                  }
-  
-        upcoming_shows = []
-        past_shows = []
-        for d in query:
-            if datetime.datetime.today() > d.Show.start_time:
-                    show = {
-                                "venue_id": d.venue_id ,
-                                "venue_name": d.venue_name ,
-                                "venue_image_link": d.venue_image_link ,
-                                "start_time": str(d.Show.start_time)
-                                }
-                    past_shows.append(show)             
-        
-            elif  datetime.datetime.today() <= d.Show.start_time:
-                    show = {
-                                "venue_id": d.venue_id ,
-                                "venue_name": d.venue_name ,
-                                "venue_image_link": d.venue_image_link ,
-                                "start_time": str(d.Show.start_time)
-                                }
-                    upcoming_shows.append(show) 
-
-        profile_data["past_shows_count"] = len(past_shows)
-        profile_data["upcoming_shows_count"] = len(upcoming_shows)                  
-        profile_data["past_shows"] = past_shows
-        profile_data["upcoming_shows"] = upcoming_shows  
-        return render_template('pages/show_artist.html', artist=profile_data)
-  else:
-     query = db.session.query(Artist).filter(Artist.id==artist_id).all()
-     genres = split_genres((query[0].genres))
-     data = {
-                  "id": artist_id,
-                  "name": query[0].name ,
-                  "genres": genres ,
-                  "city": query[0].city ,
-                  "state": query[0].state ,
-                  "phone": query[0].phone ,
-                  "facebook_link": query[0].facebook_link,
-                  "image_link": query[0].image_link ,
-                  "upcoming_shows_count" : 0 ,
-                  "past_shows_count" : 0   
-                  }  
-     return render_template('pages/show_artist.html', artist=data) 
 
-def split_genres(genres_list):
-   genres_list = (genres_list).split(",")
-   genres=[]
-   for genre in genres_list:
-              genre =''.join((filter(lambda i: i not in ['{', '"', '\'' , "}" ], genre)))
-              genres.append(genre)
-   return  genres 
+#  Search
+#  ----------------------------------------------------------------
 
+def search_args():
+  search_term = request.values.get("search_term", "")
+  page = max(request.values.get("page", 1, type=int), 1)
+  return search_term, page
+
+def render_kind_search(kind, template):
+  search_term, page = search_args()
+  data, count = search.search(kind, search_term, page)
+  search_result = {"count": count, "data": data, "page": page,
+                   "pages": (count + search.SEARCH_PER_PAGE - 1) // search.SEARCH_PER_PAGE}
+  return render_template(template, results=search_result, search_term=search_term)
+
+@app.route('/search', methods=['GET', 'POST'])
+def search_all():
+  """Venues, artists and locations matching search_term. ?kind=venues,
+  artists or locations pages through one of them."""
+  search_term, page = search_args()
+  kind = request.values.get("kind", "all")
+  if kind not in ("all", "venues", "artists", "locations"):
+    abort(400)
+
+  sections = {}
+  for section in ("venues", "artists", "locations"):
+    if kind not in ("all", section):
+      continue
+    if section == "locations":
+      data, count = search.search_locations(search_term, page)
+    else:
+      data, count = search.search(section, search_term, page)
+    sections[section] = {"count": count, "data": data}
+  pages = max([(section["count"] + search.SEARCH_PER_PAGE - 1) // search.SEARCH_PER_PAGE
+               for section in sections.values()])
+  return render_template("pages/search.html", sections=sections, search_term=search_term,
+                         kind=kind, page=page, pages=pages)
 
+@app.route('/search/autocomplete')
+def search_autocomplete():
+  """JSON prefix suggestions: ?q=<prefix>&limit=<n>."""
+  limit = min(max(request.args.get("limit", search.AUTOCOMPLETE_LIMIT, type=int), 1),
+              search.MAX_AUTOCOMPLETE_LIMIT)
+  return jsonify({"results": search.autocomplete(request.args.get("q", ""), limit)})
 
 
 #  Update
@@ -365,8 +377,7 @@ def edit_artist(artist_id):
     try:
       artist = db.session.query(Artist).filter(Artist.id == artist_id).first()
 
-      genres = {}
-      genres = split_genres(artist.genres)
+      genres = [genre.name for genre in artist.genres]
       
       form.name.data = artist.name
       form.genres.data = genres
@@ -402,7 +413,7 @@ def edit_artist_submission(artist_id):
     artist.city = request.form['city']
     artist.state = request.form['state']
     artist.phone = request.form['phone']
-    artist.genres = request.form.getlist("genres")
+    artist.genres = genres_named(request.form.getlist("genres"))
     artist.image_link = request.form['image_link']
     artist.facebook_link = request.form['facebook_link']
     
@@ -424,8 +435,7 @@ def edit_venue(venue_id):
     try:
       venue = db.session.query(Venue).filter(Venue.id == venue_id).first()
 
-      genres = {}
-      genres = split_genres(venue.genres)
+      genres = [genre.name for genre in venue.genres]
       
       form.name.data = venue.name
       form.genres.data = genres
@@ -461,12 +471,13 @@ def edit_venue_submission(venue_id):
     venue.state = request.form['state']
     venue.phone = request.form['phone']
     venue.address = request.form['address']
-    venue.genres = request.form.getlist("genres")
+    venue.genres = genres_named(request.form.getlist("genres"))
     venue.image_link = request.form['image_link']
     venue.facebook_link = request.form['facebook_link']
     
     db.session.add(venue)
     db.session.commit()
+    invalidate_venue_areas()
   except:
     db.session.rollback()
     flash("Something went wrong. Please try again.")
@@ -498,7 +509,7 @@ def create_artist_submission():
     city = request.form['city']
     state = request.form['state']
     phone = request.form['phone']
-    genres =request.form.getlist("genres")
+    genres =genres_named(request.form.getlist("genres"))
     image_link = request.form['image_link']
     facebook_link = request.form['facebook_link']
     
@@ -523,10 +534,59 @@ def create_artist_submission():
 #  Shows
 #  ----------------------------------------------------------------
 
+# /shows is paged by (start_time, id): ?after=<cursor> continues after the
+# last show of the previous page, so every page is one index range scan
+# however long the show history is. The page streams as it renders.
+SHOWS_PER_PAGE = 30
+
+class ShowPage(object):
+  """The rows of one /shows page, read from the database while the template
+  renders them. next_cursor is set once they have all been read."""
+
+  def __init__(self, query, per_page):
+    self.query = query
+    self.per_page = per_page
+    self.next_cursor = None
+
+  def __iter__(self):
+    last = None
+    for count, info in enumerate(self.query.limit(self.per_page + 1)):
+      if count == self.per_page:
+        self.next_cursor = encode_show_cursor(last)
+        break
+      last = info
+      yield {
+        "show_id": info.id,
+        "start_time": str(info.start_time),
+        "artist_id": info.artist_id,
+        "artist_name": info.artist_name,
+        "artist_image_link": info.artist_image_link,
+        "venue_id": info.venue_id,
+        "venue_name": info.venue_name,
+        }
+
+def encode_show_cursor(show):
+  return "{}_{}".format(show.start_time.isoformat(), show.id)
+
+def decode_show_cursor(cursor):
+  start_time, show_id = cursor.rsplit("_", 1)
+  return datetime.datetime.fromisoformat(start_time), int(show_id)
+
+def stream_template(template_name, **context):
+  app.update_template_context(context)
+  stream = app.jinja_env.get_template(template_name).stream(context)
+  stream.enable_buffering(5)
+  return stream
+
 @app.route('/shows')
 def shows():
-    show_data =[]
-    show_info = db.session.query(
+    filters = {
+      "from": request.args.get("from", ""),
+      "to": request.args.get("to", ""),
+      "venue_id": request.args.get("venue_id", ""),
+      "artist_id": request.args.get("artist_id", ""),
+      }
+    query = db.session.query(
                             Show.id,
                             Show.start_time,
                             Artist.name.label("artist_name"),
@@ -534,20 +594,29 @@ def shows():
                             Artist.id.label("artist_id"),
                             Venue.id.label("venue_id"),
                             Venue.name.label("venue_name")
-                            ).join(Artist).join(Venue).group_by(Show.id, Artist.id,Venue.id,).order_by(Show.id).all()  
-    for info in show_info:
-        show_info ={
-        "Show.id": info.id,
-        "start_time":str(info.start_time),
-        "artist_id" :info.artist_id ,
-        "artist_name" :info.artist_name ,
-        "artist_image_link" :info.artist_image_link ,
-        "venue_id" : info.venue_id ,
-        "venue_name" : info.venue_name ,
-          }
-        show_data.append(show_info)
-    return render_template('pages/shows.html', shows=show_data)
-
+                            ).join(Artist).join(Venue)
+    try:
+      if filters["from"]:
+        query = query.filter(Show.start_time >= datetime.datetime.fromisoformat(filters["from"]))
+      if filters["to"]:
+        # a bare date includes that whole day
+        to = datetime.datetime.fromisoformat(filters["to"])
+        if "T" not in filters["to"] and " " not in filters["to"]:
+          to += datetime.timedelta(days=1)
+        query = query.filter(Show.start_time < to)
+      if filters["venue_id"]:
+        query = query.filter(Show.venue_id == int(filters["venue_id"]))
+      if filters["artist_id"]:
+        query = query.filter(Show.artist_id == int(filters["artist_id"]))
+      if request.args.get("after"):
+        query = query.filter(tuple_(Show.start_time, Show.id) > decode_show_cursor(request.args["after"]))
+    except ValueError:
+      abort(400)
+
+    page = ShowPage(query.order_by(Show.start_time, Show.id), SHOWS_PER_PAGE)
+    filter_args = {name: value for name, value in filters.items() if value}
+    return Response(stream_with_context(
+      stream_template('pages/shows.html', shows=page, filters=filters, filter_args=filter_args)))
 
 
 @app.route('/shows/create')
@@ -560,16 +629,21 @@ def create_shows():
 @app.route('/shows/create', methods=['POST'])
 def create_show_submission():
     error=False
-    artist = request.form['artist_id']
-    venue = request.form['venue_id']
-    show_start_time = request.form['start_time']
-    artist_count = Artist.query.filter(Artist.id == artist).count()
-  
-    if artist_count > 0:
-       venue_count = Venue.query.filter(Venue.id == venue).count()
-       if venue_count > 0:
+    try:
+      artist, venue, show_start_time, duration = scheduling.parse_row(request.form.to_dict())
+    except ValueError as e:
+      flash('Invalid show: {}.'.format(e))
+      return render_template('forms/new_show.html', form=ShowForm())
+    artists, venues = scheduling.existing_ids({artist}, {venue})
+
+    if artist in artists:
+       if venue in venues:
+            clash = scheduling.conflicts(venue, artist, show_start_time, duration)
+            if clash:
+              flash('This slot is not free: {}.'.format(scheduling.describe(clash[0])))
+              return render_template('forms/new_show.html', form=ShowForm())
             try:
-              new_show = Show(artist_id=artist, venue_id=venue, start_time=show_start_time)
+              new_show = Show(artist_id=artist, venue_id=venue, start_time=show_start_time, duration=duration)
               db.session.add(new_show)
               db.session.commit()      
             except:
@@ -592,6 +666,76 @@ def create_show_submission():
 
 
 
+@app.route('/shows/availability')
+def show_availability():
+  """Whether a slot (?start_time=&duration=) is free at ?venue_id= and for
+  ?artist_id= (either may be left out), with the shows in the way."""
+  try:
+    venue_id = request.args.get("venue_id", type=int)
+    artist_id = request.args.get("artist_id", type=int)
+    start_time = scheduling.parse_start_time(request.args.get("start_time"))
+    duration = scheduling.parse_duration(request.args.get("duration"))
+  except ValueError as e:
+    return jsonify({"error": str(e)}), 400
+  if venue_id is None and artist_id is None:
+    return jsonify({"error": "venue_id or artist_id is required"}), 400
+
+  clash = scheduling.conflicts(venue_id, artist_id, start_time, duration)
+  return jsonify({
+    "free": not clash,
+    "conflicts": [{
+      "booked": kind,
+      "show_id": id,
+      "start_time": show_start.isoformat(),
+      "end_time": show_end.isoformat(),
+      } for kind, (source, id), show_start, show_end in clash],
+    })
+
+@app.route('/shows/import', methods=['POST'])
+def schedule_shows():
+  """Bulk scheduling: a CSV, JSON Lines or JSON array of (artist_id,
+  venue_id, start_time[, duration]) rows, uploaded as "file" or sent as the request
+  body. ?format= overrides the format guessed from the file name or
+  Content-Type. Answers with the scheduling.ImportResult report."""
+  upload = request.files.get("file")
+  if upload is not None:
+    stream = upload.stream
+    format = scheduling.guess_format(upload.filename or "", upload.mimetype)
+  else:
+    stream = request.stream
+    format = scheduling.guess_format(content_type=request.content_type)
+  format = request.args.get("format", format)
+
+  try:
+    result = scheduling.import_shows(scheduling.read_rows(stream, format))
+  except scheduling.ShowImportError as e:
+    return jsonify({"error": str(e)}), 400
+  return jsonify(result.report())
+
+@app.cli.command("import-shows")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--format", type=click.Choice(scheduling.FORMATS),
+              help="Input format; guessed from the file extension by default.")
+@click.option("--batch-size", default=scheduling.BATCH_SIZE, show_default=True)
+def import_shows_command(path, format, batch_size):
+  """Schedule the shows of a CSV, JSON Lines or JSON file."""
+  started = time.perf_counter()
+  with open(path, "rb") as stream:
+    try:
+      result = scheduling.import_shows(
+        scheduling.read_rows(stream, format or scheduling.guess_format(path)), batch_size)
+    except scheduling.ShowImportError as e:
+      raise click.ClickException(str(e))
+  seconds = time.perf_counter() - started
+
+  click.echo("Imported {} shows, rejected {} rows in {:.1f}s ({:.0f} shows/s)".format(
+    result.imported, result.rejected, seconds, result.imported / max(seconds, 1e-9)))
+  for rejection in result.rejections:
+    click.echo("  row {row}: {error}".format(**rejection))
+  if result.rejected > len(result.rejections):
+    click.echo("  ... {} more".format(result.rejected - len(result.rejections)))
+
+
 @app.errorhandler(404)
 def not_found_error(error):
     return render_template('errors/404.html'), 404
@@ -0,0 +1,92 @@
+"""move genres to a Genre table and venue / artist join tables
+
+Revision ID: 3698b2cc2a47
+Revises: 7b87cd1b8d11
+Create Date: 2026-10-18 11:40:08.615390
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3698b2cc2a47'
+down_revision = '7b87cd1b8d11'
+branch_labels = None
+depends_on = None
+
+# the forms.Genre choices when this migration was written
+GENRES = ['Alternative', 'Blues', 'Classical', 'Country', 'Electronic', 'Folk',
+          'Funk', 'Hip-Hop', 'Heavy Metal', 'Instrumental', 'Jazz',
+          'Musical Theatre', 'Pop', 'Punk', 'R&B', 'Reggae', 'Rock n Roll',
+          'Soul', 'Other']
+
+OWNERS = (('Venue', 'venue_genres', 'venue_id'),
+          ('Artist', 'artist_genres', 'artist_id'))
+
+
+def parse_genres(value):
+    # the old columns hold Postgres array literals such as {Jazz,"R&B"}
+    if not value:
+        return []
+    names = [name.strip().strip('"\'') for name in value.strip('{}').split(',')]
+    return [name for name in names if name]
+
+
+def upgrade():
+    genre = op.create_table('Genre',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('name', sa.String(length=120), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('name')
+    )
+    for owner, table, column in OWNERS:
+        op.create_table(table,
+        sa.Column('genre_id', sa.Integer(), nullable=False),
+        sa.Column(column, sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['genre_id'], ['Genre.id'], ),
+        sa.ForeignKeyConstraint([column], [owner + '.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('genre_id', column)
+        )
+        op.create_index('ix_{}_{}'.format(table, column), table, [column], unique=False)
+
+    connection = op.get_bind()
+    rows = {}
+    names = set(GENRES)
+    for owner, table, column in OWNERS:
+        rows[owner] = [(row.id, parse_genres(row.genres)) for row in connection.execute(
+            sa.text('SELECT id, genres FROM "{}"'.format(owner)))]
+        for owner_id, owner_genres in rows[owner]:
+            names.update(owner_genres)
+
+    op.bulk_insert(genre, [{'name': name} for name in GENRES] +
+                   [{'name': name} for name in sorted(names - set(GENRES))])
+    genre_ids = dict((row.name, row.id) for row in connection.execute(
+        sa.text('SELECT id, name FROM "Genre"')))
+
+    for owner, table, column in OWNERS:
+        join_table = sa.table(table, sa.column('genre_id'), sa.column(column))
+        op.bulk_insert(join_table, [
+            {'genre_id': genre_ids[name], column: owner_id}
+            for owner_id, owner_genres in rows[owner]
+            for name in set(owner_genres)])
+        op.drop_column(owner, 'genres')
+
+
+def downgrade():
+    connection = op.get_bind()
+    for owner, table, column in OWNERS:
+        op.add_column(owner, sa.Column('genres', sa.String(length=120), nullable=True))
+        genres = {}
+        for row in connection.execute(sa.text(
+                'SELECT j.{0} AS owner_id, g.name FROM {1} j JOIN "Genre" g ON g.id = j.genre_id '
+                'ORDER BY j.{0}, g.name'.format(column, table))):
+            genres.setdefault(row.owner_id, []).append(row.name)
+        for owner_id, names in genres.items():
+            connection.execute(
+                sa.text('UPDATE "{}" SET genres = :genres WHERE id = :id'.format(owner)),
+                genres='{' + ','.join('"{}"'.format(name) for name in names) + '}',
+                id=owner_id)
+        op.drop_index('ix_{}_{}'.format(table, column), table_name=table)
+        op.drop_table(table)
+    op.drop_table('Genre')
@@ -0,0 +1,44 @@
+"""pg_trgm and prefix indexes for venue, artist and location search
+
+Revision ID: 4a4a40624826
+Revises: 3698b2cc2a47
+Create Date: 2026-10-18 13:05:52.381940
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4a4a40624826'
+down_revision = '3698b2cc2a47'
+branch_labels = None
+depends_on = None
+
+OWNERS = ('Venue', 'Artist')
+
+
+def upgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        for owner in OWNERS:
+            op.create_index('ix_{}_name_prefix'.format(owner), owner, [sa.text('lower(name)')])
+        return
+
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for owner in OWNERS:
+        # search.matching(): substring and similarity matches
+        op.execute('CREATE INDEX "ix_{0}_name_trgm" ON "{0}" '
+                   'USING gin (lower(name) gin_trgm_ops)'.format(owner))
+        op.execute('CREATE INDEX "ix_{0}_location_trgm" ON "{0}" '
+                   'USING gin (lower(city || \', \' || state) gin_trgm_ops)'.format(owner))
+        # search.autocomplete(): prefix ranges in byte order
+        op.execute('CREATE INDEX "ix_{0}_name_prefix" ON "{0}" '
+                   '((lower(name) COLLATE "C"))'.format(owner))
+
+
+def downgrade():
+    for owner in OWNERS:
+        op.drop_index('ix_{}_name_prefix'.format(owner), table_name=owner)
+        if op.get_bind().dialect.name == 'postgresql':
+            op.drop_index('ix_{}_location_trgm'.format(owner), table_name=owner)
+            op.drop_index('ix_{}_name_trgm'.format(owner), table_name=owner)
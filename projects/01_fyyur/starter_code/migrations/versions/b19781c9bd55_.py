@@ -0,0 +1,49 @@
+"""show duration and exclusion constraints against double bookings
+
+Revision ID: b19781c9bd55
+Revises: 4a4a40624826
+Create Date: 2026-10-18 18:04:28.519377
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b19781c9bd55'
+down_revision = '4a4a40624826'
+branch_labels = None
+depends_on = None
+
+# models.DEFAULT_SHOW_MINUTES and models.MAX_SHOW_MINUTES
+DEFAULT_SHOW_MINUTES = 120
+MAX_SHOW_MINUTES = 24 * 60
+
+OWNERS = ('venue_id', 'artist_id')
+
+
+def upgrade():
+    op.add_column('Show', sa.Column('duration', sa.Integer(), nullable=False,
+                                    server_default=str(DEFAULT_SHOW_MINUTES)))
+    if op.get_bind().dialect.name != 'postgresql':
+        # scheduling.check_double_bookings() checks the shows instead
+        return
+
+    op.create_check_constraint('ck_Show_duration', 'Show',
+                               'duration BETWEEN 1 AND {}'.format(MAX_SHOW_MINUTES))
+    # btree_gist for the = on the owner ids. Shows already overlapping fail
+    # the upgrade: move or shorten them first.
+    op.execute('CREATE EXTENSION IF NOT EXISTS btree_gist')
+    for owner in OWNERS:
+        op.execute('ALTER TABLE "Show" ADD CONSTRAINT "ex_Show_{0}_overlap" '
+                   'EXCLUDE USING gist ({0} WITH =, '
+                   'tsrange(start_time, start_time + duration * interval \'1 minute\') WITH &&)'
+                   .format(owner))
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        for owner in OWNERS:
+            op.drop_constraint('ex_Show_{}_overlap'.format(owner), 'Show')
+        op.drop_constraint('ck_Show_duration', 'Show', type_='check')
+    op.drop_column('Show', 'duration')
@@ -8,6 +8,27 @@ db = SQLAlchemy()
 migrate = Migrate(app, db)
 
 
+# Genres are normalised: one Genre row per name (seeded with the forms.Genre
+# choices) and a join table per owner. The (genre_id, owner_id) primary keys
+# serve the browse by genre pages, the owner_id indexes the profile pages.
+venue_genres = db.Table('venue_genres',
+  db.Column('genre_id', db.Integer, db.ForeignKey('Genre.id'), primary_key=True),
+  db.Column('venue_id', db.Integer, db.ForeignKey('Venue.id', ondelete="CASCADE"), primary_key=True),
+  db.Index('ix_venue_genres_venue_id', 'venue_id'),
+)
+
+artist_genres = db.Table('artist_genres',
+  db.Column('genre_id', db.Integer, db.ForeignKey('Genre.id'), primary_key=True),
+  db.Column('artist_id', db.Integer, db.ForeignKey('Artist.id', ondelete="CASCADE"), primary_key=True),
+  db.Index('ix_artist_genres_artist_id', 'artist_id'),
+)
+
+# forms.py's Genre enum is star-imported by app.py, hence the model name
+class MusicGenre(db.Model):
+  __tablename__ = 'Genre'
+  id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+  name = db.Column(db.String(120), nullable=False, unique=True)
+
 class Venue(db.Model):
     __tablename__ = 'Venue'
 
@@ -17,12 +38,16 @@ class Venue(db.Model):
     state = db.Column(db.String(120))
     address = db.Column(db.String(120))
     phone = db.Column(db.String(120))
-    genres = db.Column(db.String(120))
+    genres = db.relationship('MusicGenre', secondary=venue_genres, order_by='MusicGenre.name')
     image_link = db.Column(db.String(500))
     facebook_link = db.Column(db.String(120))
     pass
     # TODO: implement any missing fields, as a database migration using Flask-Migrate
 
+# lower(name) index of the search.py autocomplete; on Postgres the search
+# migration builds it collated "C" along with the pg_trgm indexes
+db.Index('ix_Venue_name_prefix', db.func.lower(Venue.name))
+
 class Artist(db.Model):
     __tablename__ = 'Artist'
 
@@ -31,18 +56,42 @@ class Artist(db.Model):
     city = db.Column(db.String(120))
     state = db.Column(db.String(120))
     phone = db.Column(db.String(120))
-    genres = db.Column(db.String(120))
+    genres = db.relationship('MusicGenre', secondary=artist_genres, order_by='MusicGenre.name')
     image_link = db.Column(db.String(500))
     facebook_link = db.Column(db.String(120))
     pass
     # TODO: implement any missing fields, as a database migration using Flask-Migrate
 
+db.Index('ix_Artist_name_prefix', db.func.lower(Artist.name))
+
 # TODO Implement Show and Artist models, and complete all model relationships and properties, as a database migration.
 
+# A show lasts duration minutes, at most MAX_SHOW_MINUTES: the shows that can
+# overlap a slot then all start less than MAX_SHOW_MINUTES before it, a
+# bounded range of the (owner, start_time) indexes (see scheduling.py).
+DEFAULT_SHOW_MINUTES = 120
+MAX_SHOW_MINUTES = 24 * 60
+
+
 class Show(db.Model):
   __tablename__ = 'Show'
+  # (owner, start_time) serves the owner foreign key lookups as well as the
+  # past / upcoming split of the profile pages. On Postgres the migration
+  # also adds the exclusion constraints against double bookings.
+  __table_args__ = (
+    db.Index('ix_Show_venue_id_start_time', 'venue_id', 'start_time'),
+    db.Index('ix_Show_artist_id_start_time', 'artist_id', 'start_time'),
+    db.Index('ix_Show_start_time', 'start_time'),
+    db.CheckConstraint('duration BETWEEN 1 AND {}'.format(MAX_SHOW_MINUTES), name='ck_Show_duration'),
+  )
   id = db.Column(db.Integer, primary_key=True , autoincrement=True)
   artist_id = db.Column(db.Integer, db.ForeignKey('Artist.id'), nullable=False)
   venue_id  = db.Column(db.Integer, db.ForeignKey("Venue.id", ondelete="CASCADE"),  nullable=False)
   start_time = db.Column(db.DateTime, nullable=False, default=datetime.datetime.today())
+  duration = db.Column(db.Integer, nullable=False, default=DEFAULT_SHOW_MINUTES,
+                       server_default=str(DEFAULT_SHOW_MINUTES))
+
+  @property
+  def end_time(self):
+    return self.start_time + datetime.timedelta(minutes=self.duration)
   pass
\ No newline at end of file
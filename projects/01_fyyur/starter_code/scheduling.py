@@ -0,0 +1,332 @@
+"""Bulk show scheduling.
+
+import_shows() reads (artist_id, venue_id, start_time[, duration]) rows
+from CSV (with a header line), JSON Lines or a JSON array, checks them in
+batches and inserts the valid ones. Per batch, the artist and venue ids are
+checked as two sets in one query, the shows already booked around the
+batch are read in one more, and the shows are inserted in one statement,
+so the cost per show stays a few microseconds. Rejected rows are reported
+with their row number (1 = first data row) and the reason.
+
+Double bookings (two overlapping shows at a venue, or for an artist) are
+refused by the exclusion constraints of the migration on Postgres. On other
+databases, check_double_bookings() does the same for shows written through
+the ORM, with the in-memory Bookings index.
+
+Used by POST /shows/import, `flask import-shows FILE`, the show form and
+GET /shows/availability.
+"""
+import bisect
+import codecs
+import csv
+import datetime
+import json
+
+from sqlalchemy import and_, event, literal, select, union_all
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from models import db, Venue, Artist, Show, DEFAULT_SHOW_MINUTES, MAX_SHOW_MINUTES
+
+BATCH_SIZE = 5000
+MAX_REPORTED_REJECTIONS = 100
+FORMATS = ("csv", "json", "jsonl")
+
+
+MAX_SHOW = datetime.timedelta(minutes=MAX_SHOW_MINUTES)
+
+
+class ShowImportError(ValueError):
+  pass
+
+
+class DoubleBookingError(ValueError):
+  pass
+
+
+class ImportResult(object):
+
+  def __init__(self):
+    self.imported = 0
+    self.rejected = 0
+    self.rejections = []
+
+  def reject(self, row_number, reason):
+    self.rejected += 1
+    if len(self.rejections) < MAX_REPORTED_REJECTIONS:
+      self.rejections.append({"row": row_number, "error": reason})
+
+  def report(self):
+    return {
+      "imported": self.imported,
+      "rejected": self.rejected,
+      "rejections": sorted(self.rejections, key=lambda rejection: rejection["row"]),
+      "rejections_truncated": self.rejected > len(self.rejections),
+      }
+
+
+def guess_format(filename="", content_type=""):
+  content_type = (content_type or "").split(";")[0].strip()
+  if content_type in ("text/csv", "application/csv") or filename.endswith(".csv"):
+    return "csv"
+  if content_type in ("application/x-ndjson", "application/jsonl") \
+      or filename.endswith((".jsonl", ".ndjson")):
+    return "jsonl"
+  if content_type == "application/json" or filename.endswith(".json"):
+    return "json"
+  return None
+
+
+def read_rows(stream, format):
+  """The rows of a binary stream as dicts, read lazily for csv and jsonl."""
+  if format is None:
+    raise ShowImportError("unknown input format, expected one of {}".format(", ".join(FORMATS)))
+  if format not in FORMATS:
+    raise ShowImportError("unknown format {!r}, expected one of {}".format(format, ", ".join(FORMATS)))
+  # only needs stream.read(), unlike io.TextIOWrapper
+  text = codecs.getreader("utf-8")(stream)
+  if format == "csv":
+    return csv.DictReader(text)
+  if format == "jsonl":
+    return json_lines(text)
+  try:
+    rows = json.load(text)
+  except ValueError as e:
+    raise ShowImportError("invalid JSON: {}".format(e))
+  if not isinstance(rows, list):
+    raise ShowImportError("a JSON import must be an array of show objects")
+  return rows
+
+
+def json_lines(text):
+  for line in text:
+    if not line.strip():
+      continue
+    try:
+      yield json.loads(line)
+    except ValueError:
+      # rejected by parse_row() like any other row that is not an object
+      yield None
+
+
+def parse_start_time(value):
+  try:
+    start_time = datetime.datetime.fromisoformat(value.strip())
+  except (AttributeError, ValueError):
+    raise ValueError("start_time must be an ISO date and time")
+  if start_time.tzinfo is not None:
+    raise ValueError("start_time must be a local time, without a UTC offset")
+  return start_time
+
+
+def parse_duration(value):
+  """Minutes between 1 and MAX_SHOW_MINUTES, DEFAULT_SHOW_MINUTES if empty."""
+  if value is None or value == "":
+    return DEFAULT_SHOW_MINUTES
+  try:
+    duration = int(value)
+  except (TypeError, ValueError):
+    raise ValueError("duration must be a number of minutes")
+  if not 1 <= duration <= MAX_SHOW_MINUTES:
+    raise ValueError("duration must be between 1 and {} minutes".format(MAX_SHOW_MINUTES))
+  return duration
+
+
+def parse_row(row):
+  """(artist_id, venue_id, start_time, duration) of one input row, or
+  ValueError."""
+  if not isinstance(row, dict):
+    raise ValueError("not a JSON object")
+  try:
+    artist_id = int(row["artist_id"])
+    venue_id = int(row["venue_id"])
+    start_time = row["start_time"]
+  except KeyError as e:
+    raise ValueError("missing {}".format(e.args[0]))
+  except (TypeError, ValueError):
+    raise ValueError("artist_id and venue_id must be integers")
+  return artist_id, venue_id, parse_start_time(start_time), parse_duration(row.get("duration"))
+
+
+def existing_ids(artist_ids, venue_ids):
+  """The ids of artist_ids and venue_ids that exist, in one query."""
+  selects = []
+  if artist_ids:
+    selects.append(select([literal("artist").label("kind"), Artist.id])
+                   .where(Artist.id.in_(artist_ids)))
+  if venue_ids:
+    selects.append(select([literal("venue").label("kind"), Venue.id])
+                   .where(Venue.id.in_(venue_ids)))
+  found = {"artist": set(), "venue": set()}
+  if selects:
+    for kind, id in db.session.execute(union_all(*selects)):
+      found[kind].add(id)
+  return found["artist"], found["venue"]
+
+
+class Bookings(object):
+  """An in-memory interval index of the shows of some venues and artists.
+
+  Per venue and per artist, the shows are kept sorted by start time. As no
+  show lasts more than MAX_SHOW_MINUTES, the shows overlapping [start, end)
+  all start in (start - MAX_SHOW_MINUTES, end): a bisection and a short
+  scan per owner, however many shows the index holds. Shows are labelled
+  ("show", id) or, for rows not inserted yet, ("row", row number).
+  """
+
+  def __init__(self):
+    self.shows = {}
+
+  def add(self, label, venue_id, artist_id, start_time, end_time):
+    for owner in (("venue", venue_id), ("artist", artist_id)):
+      bisect.insort(self.shows.setdefault(owner, []), (start_time, end_time, label))
+
+  def overlapping(self, venue_id, artist_id, start_time, end_time, ignore=None):
+    """[(owner kind, label, start, end)] of the shows overlapping the slot at
+    the venue or for the artist, except the show labelled ignore."""
+    found = []
+    for kind, id in (("venue", venue_id), ("artist", artist_id)):
+      shows = self.shows.get((kind, id), [])
+      for i in range(bisect.bisect_left(shows, (start_time - MAX_SHOW,)), len(shows)):
+        show_start, show_end, label = shows[i]
+        if show_start >= end_time:
+          break
+        if show_end > start_time and label != ignore:
+          found.append((kind, label, show_start, show_end))
+    return found
+
+
+def describe(conflict):
+  kind, (source, id), start_time, end_time = conflict
+  return "the {} is already booked from {:%Y-%m-%d %H:%M} to {:%Y-%m-%d %H:%M} by {} {}".format(
+    kind, start_time, end_time, source, id)
+
+
+def booked(venue_ids, artist_ids, start_time, end_time, session=None):
+  """Bookings of the shows of venue_ids and artist_ids that can overlap
+  [start_time, end_time). Read in one query, as ranges of the (venue_id,
+  start_time) and (artist_id, start_time) indexes bounded by MAX_SHOW, so
+  never the whole history of a venue."""
+  session = session or db.session
+  window = (Show.start_time > start_time - MAX_SHOW, Show.start_time < end_time)
+  selects = [select([Show.id, Show.venue_id, Show.artist_id, Show.start_time, Show.duration])
+             .where(and_(column.in_(ids), *window))
+             for column, ids in ((Show.venue_id, venue_ids), (Show.artist_id, artist_ids)) if ids]
+  bookings = Bookings()
+  seen = set()
+  if selects:
+    for id, venue_id, artist_id, show_start, duration in session.execute(union_all(*selects)):
+      if id not in seen:
+        seen.add(id)
+        bookings.add(("show", id), venue_id, artist_id, show_start,
+                     show_start + datetime.timedelta(minutes=duration))
+  return bookings
+
+
+def conflicts(venue_id, artist_id, start_time, duration, show_id=None):
+  """The shows overlapping a slot at the venue or for the artist (either may
+  be None), except show_id, as for Bookings.overlapping()."""
+  end_time = start_time + datetime.timedelta(minutes=duration)
+  bookings = booked({venue_id} - {None}, {artist_id} - {None}, start_time, end_time)
+  return bookings.overlapping(venue_id, artist_id, start_time, end_time, ignore=("show", show_id))
+
+
+@event.listens_for(Session, "before_flush")
+def check_double_bookings(session, flush_context, instances):
+  """Refuses the new or moved shows of a flush that overlap a booked show
+  or each other. Postgres does it with its exclusion constraints."""
+  shows = [show for show in list(session.new) + list(session.dirty)
+           if isinstance(show, Show) and isinstance(show.start_time, datetime.datetime)]
+  if not shows or session.get_bind().dialect.name == "postgresql":
+    return
+
+  slots = [(show, show.start_time + datetime.timedelta(minutes=show.duration or DEFAULT_SHOW_MINUTES))
+           for show in shows]
+  # their old slots, and those of deleted shows, are free again
+  moved = {("show", show.id) for show in list(session.dirty) + list(session.deleted)
+           if isinstance(show, Show) and show.id is not None}
+  with session.no_autoflush:
+    bookings = booked({show.venue_id for show in shows}, {show.artist_id for show in shows},
+                      min(show.start_time for show in shows), max(end for show, end in slots),
+                      session)
+  for show_list in bookings.shows.values():
+    show_list[:] = [booking for booking in show_list if booking[2] not in moved]
+
+  for number, (show, end_time) in enumerate(slots, 1):
+    label = ("show", show.id) if show.id is not None else ("new show", number)
+    clash = bookings.overlapping(show.venue_id, show.artist_id, show.start_time, end_time)
+    if clash:
+      raise DoubleBookingError(describe(clash[0]))
+    bookings.add(label, show.venue_id, show.artist_id, show.start_time, end_time)
+
+
+def insert_shows(shows):
+  if not shows:
+    return
+  if db.engine.dialect.name == "postgresql":
+    # one multi-row INSERT; psycopg2 runs an executemany row by row
+    db.session.execute(Show.__table__.insert().values(shows))
+  else:
+    db.session.execute(Show.__table__.insert(), shows)
+
+
+def import_batch(batch, result):
+  parsed = []
+  for row_number, row in batch:
+    try:
+      parsed.append((row_number,) + parse_row(row))
+    except ValueError as e:
+      result.reject(row_number, str(e))
+
+  artists, venues = existing_ids({row[1] for row in parsed}, {row[2] for row in parsed})
+  slots = []
+  for row_number, artist_id, venue_id, start_time, duration in parsed:
+    if artist_id not in artists:
+      result.reject(row_number, "unknown artist_id {}".format(artist_id))
+    elif venue_id not in venues:
+      result.reject(row_number, "unknown venue_id {}".format(venue_id))
+    else:
+      slots.append((row_number, artist_id, venue_id, start_time, duration,
+                    start_time + datetime.timedelta(minutes=duration)))
+
+  shows = []
+  if slots:
+    # the shows booked around the batch, then the rows of the batch itself
+    bookings = booked({slot[2] for slot in slots}, {slot[1] for slot in slots},
+                      min(slot[3] for slot in slots), max(slot[5] for slot in slots))
+    for row_number, artist_id, venue_id, start_time, duration, end_time in slots:
+      clash = bookings.overlapping(venue_id, artist_id, start_time, end_time)
+      if clash:
+        result.reject(row_number, describe(clash[0]))
+        continue
+      bookings.add(("row", row_number), venue_id, artist_id, start_time, end_time)
+      shows.append({"artist_id": artist_id, "venue_id": venue_id,
+                    "start_time": start_time, "duration": duration})
+
+  insert_shows(shows)
+  db.session.commit()
+  result.imported += len(shows)
+
+
+def import_shows(rows, batch_size=BATCH_SIZE):
+  """Checks and inserts the shows of an iterable of row dicts, committing
+  each batch. Returns an ImportResult."""
+  result = ImportResult()
+  batch = []
+  try:
+    for row_number, row in enumerate(rows, 1):
+      batch.append((row_number, row))
+      if len(batch) >= batch_size:
+        import_batch(batch, result)
+        batch = []
+    import_batch(batch, result)
+  except (csv.Error, UnicodeDecodeError) as e:
+    db.session.rollback()
+    raise ShowImportError("unreadable input after {} imported shows: {}".format(result.imported, e))
+  except IntegrityError:
+    # a show booked by someone else between the check and the insert of a
+    # batch, refused by the Postgres exclusion constraints
+    db.session.rollback()
+    raise ShowImportError("a concurrent booking clashed with the import after {} imported shows; "
+                          "import the remaining rows again".format(result.imported))
+  return result
@@ -0,0 +1,118 @@
+"""Venue, artist and location search.
+
+On Postgres, names and "city, state" labels are matched by substring or by
+trigram similarity (so "jaz clup" still finds "Jazz Club"), both served by
+the pg_trgm GIN indexes of the search migration. Results are ranked with
+prefix matches first, then by similarity. On SQLite (local runs) the same
+functions fall back to a substring match ranked by prefix and name length.
+
+Autocomplete is a prefix match on lower(name), read as a range of the
+lower(name) index (collated "C" on Postgres), so it costs the same on any
+table size.
+"""
+from sqlalchemy import func, literal, or_, union_all, select, collate
+
+from models import db, Venue, Artist
+
+SEARCH_PER_PAGE = 10
+AUTOCOMPLETE_LIMIT = 8
+MAX_AUTOCOMPLETE_LIMIT = 50
+
+MODELS = {"venues": Venue, "artists": Artist}
+
+
+def postgres():
+  return db.engine.dialect.name == "postgresql"
+
+
+def like_pattern(term, prefix=False):
+  escaped = term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+  return escaped + "%" if prefix else "%" + escaped + "%"
+
+
+def matching(text, term):
+  """The condition and ranking (best first) of a text expression matching a
+  lower-cased search term."""
+  text = func.lower(text)
+  condition = text.like(like_pattern(term), escape="\\")
+  prefix = text.like(like_pattern(term, prefix=True), escape="\\")
+  if postgres():
+    # the pg_trgm similarity operator %, doubled for psycopg2's pyformat
+    # parameters (SQLAlchemy 1.3 does not escape custom operators)
+    condition = or_(condition, text.op("%%")(term))
+    return condition, [prefix.desc(), func.similarity(text, term).desc()]
+  return condition, [prefix.desc(), func.length(text)]
+
+
+def search(kind, term, page=1, per_page=SEARCH_PER_PAGE):
+  """One page of the venues or artists (kind) whose name matches the term,
+  as ([{"id", "name"}], total matches)."""
+  model = MODELS[kind]
+  condition, ranking = matching(model.name, term.strip().lower())
+  rows = db.session.query(model.id, model.name, func.count().over().label("total")) \
+    .filter(condition).order_by(*ranking + [model.name, model.id]) \
+    .limit(per_page).offset((page - 1) * per_page).all()
+  total = rows[0].total if rows else 0
+  return [{"id": row.id, "name": row.name} for row in rows], total
+
+
+def search_locations(term, page=1, per_page=SEARCH_PER_PAGE):
+  """One page of the "city, state" locations of venues and artists matching
+  the term, as ([{"city", "state", "venues", "artists"}], total matches)."""
+  term = term.strip().lower()
+  sides = []
+  for model, venues, artists in ((Venue, 1, 0), (Artist, 0, 1)):
+    condition, _ = matching(model.city + ", " + model.state, term)
+    sides.append(select([model.city.label("city"), model.state.label("state"),
+                         literal(venues).label("venues"), literal(artists).label("artists")])
+                 .where(condition))
+  found = union_all(*sides).alias("found")
+
+  # the rank of the matched label, computed again over the merged rows
+  _, ranking = matching(found.c.city + ", " + found.c.state, term)
+  rows = db.session.query(found.c.city, found.c.state,
+                          func.sum(found.c.venues).label("venues"),
+                          func.sum(found.c.artists).label("artists"),
+                          func.count().over().label("total")) \
+    .group_by(found.c.city, found.c.state) \
+    .order_by(*ranking + [found.c.state, found.c.city]) \
+    .limit(per_page).offset((page - 1) * per_page).all()
+  total = rows[0].total if rows else 0
+  return [{"city": row.city, "state": row.state, "venues": row.venues, "artists": row.artists}
+          for row in rows], total
+
+
+def prefix_range(text, prefix):
+  """text >= prefix AND text < the first string after every string starting
+  with prefix: an index range instead of a LIKE."""
+  upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+  return text >= prefix, text < upper
+
+
+def autocomplete_key(model):
+  """lower(name), in the byte order of the "C" collation on Postgres as in
+  the prefix index of the search migration."""
+  key = func.lower(model.name)
+  if postgres():
+    # quoted by SQLAlchemy: COLLATE "C"
+    key = collate(key, "C")
+  return key
+
+
+def autocomplete(term, limit=AUTOCOMPLETE_LIMIT):
+  """The first venue and artist names (in alphabetical order) starting with
+  the term, as [{"type", "id", "name"}]."""
+  term = term.strip().lower()
+  if not term:
+    return []
+
+  suggestions = []
+  for kind, model in MODELS.items():
+    key = autocomplete_key(model)
+    rows = db.session.query(model.id, model.name, key.label("key")) \
+      .filter(*prefix_range(key, term)).order_by(key, model.id).limit(limit).all()
+    suggestions.extend((row.key, kind[:-1], row.id, row.name) for row in rows)
+
+  suggestions.sort(key=lambda suggestion: suggestion[:3])
+  return [{"type": kind, "id": id, "name": name}
+          for key, kind, id, name in suggestions[:limit]]
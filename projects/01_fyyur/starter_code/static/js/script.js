@@ -2,3 +2,68 @@ window.parseISOString = function parseISOString(s) {
   var b = s.split(/\D+/);
   return new Date(Date.UTC(b[0], --b[1], b[2], b[3], b[4], b[5], b[6]));
 };
+
+// fills the navbar search suggestions from /search/autocomplete as the user
+// types; data-autocomplete="venue" or "artist" keeps one kind of names
+document.addEventListener('DOMContentLoaded', function () {
+  var suggestions = document.getElementById('search-suggestions');
+  var inputs = document.querySelectorAll('input[data-autocomplete]');
+  Array.prototype.forEach.call(inputs, function (input) {
+    var timer = null;
+    input.addEventListener('input', function () {
+      clearTimeout(timer);
+      timer = setTimeout(function () {
+        if (!input.value.trim()) {
+          suggestions.innerHTML = '';
+          return;
+        }
+        fetch('/search/autocomplete?q=' + encodeURIComponent(input.value))
+          .then(function (response) { return response.json(); })
+          .then(function (data) {
+            suggestions.innerHTML = '';
+            data.results.forEach(function (result) {
+              if (input.dataset.autocomplete && result.type !== input.dataset.autocomplete) {
+                return;
+              }
+              var option = document.createElement('option');
+              option.value = result.name;
+              suggestions.appendChild(option);
+            });
+          });
+      }, 150);
+    });
+  });
+});
+
+// tells on the new show form whether the venue and the artist are free for
+// the chosen slot, from /shows/availability
+document.addEventListener('DOMContentLoaded', function () {
+  var status = document.getElementById('slot-status');
+  if (!status) {
+    return;
+  }
+  var form = status.closest('form');
+  var timer = null;
+  form.addEventListener('input', function () {
+    clearTimeout(timer);
+    timer = setTimeout(function () {
+      var params = ['venue_id', 'artist_id', 'start_time', 'duration'].map(function (name) {
+        return name + '=' + encodeURIComponent(form.elements[name].value.trim());
+      });
+      fetch(status.dataset.availability + '?' + params.join('&'))
+        .then(function (response) { return response.json(); })
+        .then(function (data) {
+          if (data.error) {
+            status.textContent = '';
+          } else if (data.free) {
+            status.textContent = 'This slot is free.';
+          } else {
+            status.textContent = 'Already booked: ' + data.conflicts.map(function (show) {
+              return 'the ' + show.booked + ' plays show ' + show.show_id + ' from ' +
+                show.start_time.replace('T', ' ') + ' to ' + show.end_time.replace('T', ' ');
+            }).join('; ') + '.';
+          }
+        });
+    }, 300);
+  });
+});
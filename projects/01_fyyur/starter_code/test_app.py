@@ -0,0 +1,660 @@
+import datetime
+import html
+import importlib.util
+import io
+import json
+import os
+import re
+import tempfile
+import unittest
+from unittest import mock
+
+import config
+# the tests create and drop their own tables: an in-memory SQLite database
+# unless FYYUR_TEST_DATABASE_URL names another one
+config.SQLALCHEMY_DATABASE_URI = os.environ.get('FYYUR_TEST_DATABASE_URL', 'sqlite://')
+config.WTF_CSRF_ENABLED = False
+
+from sqlalchemy.dialects.postgresql import psycopg2
+
+from app import app, profile_shows, invalidate_venue_areas, PAST_SHOWS_PER_PAGE
+from models import db, Venue, Artist, Show, MusicGenre, MAX_SHOW_MINUTES
+import scheduling
+import search
+
+
+class FyyurTestCase(unittest.TestCase):
+  """Runs every test in an app context, on freshly created tables."""
+
+  def setUp(self):
+    self.client = app.test_client
+    self.context = app.app_context()
+    self.context.push()
+    db.create_all(app=app)
+    # the /venues areas of the previous test's tables
+    invalidate_venue_areas()
+
+  def tearDown(self):
+    db.session.remove()
+    db.drop_all(app=app)
+    self.context.pop()
+
+  def add_venue(self, name='The Musical Hop'):
+    venue = Venue(name=name, city='San Francisco', state='CA',
+                  address='1015 Folsom Street', phone='123-123-1234')
+    db.session.add(venue)
+    db.session.commit()
+    return venue.id
+
+  def add_artist(self, name='Guns N Petals'):
+    artist = Artist(name=name, city='San Francisco', state='CA', phone='326-123-5000')
+    db.session.add(artist)
+    db.session.commit()
+    return artist.id
+
+
+class SearchTestCase(FyyurTestCase):
+
+  '''
+  On Postgres, the pg_trgm % operator goes through psycopg2, which
+  interpolates the query parameters with Python's % operator: a bare %
+  in the SQL breaks every search.
+  '''
+
+  def test_trigram_condition_compiles_for_psycopg2(self):
+    with mock.patch('search.postgres', return_value=True):
+      condition, ranking = search.matching(Venue.name, 'jazz')
+    compiled = condition.compile(dialect=psycopg2.dialect())
+    rendered = compiled.string % {name: "'jazz'" for name in compiled.params}
+
+    self.assertIn('lower("Venue".name) % \'jazz\'', rendered)
+
+  '''
+  The Postgres autocomplete key is collated "C", the collation of the
+  prefix index of the search migration.
+  '''
+
+  def test_autocomplete_key_collation(self):
+    with mock.patch('search.postgres', return_value=True):
+      key = search.autocomplete_key(Venue)
+
+    self.assertEqual(str(key.compile(dialect=psycopg2.dialect())),
+                     'lower("Venue".name) COLLATE "C"')
+
+  '''
+  Autocomplete returns the venue and artist names starting with the term,
+  in alphabetical order.
+  '''
+
+  def test_autocomplete(self):
+    self.add_venue('Jazz Club')
+    self.add_venue('The Dueling Pianos Bar')
+    self.add_artist('Jazmin Sullivan')
+
+    response_data = self.client().get('/search/autocomplete?q=JAZ').get_json()
+
+    self.assertEqual([(result['type'], result['name']) for result in response_data['results']],
+                     [('artist', 'Jazmin Sullivan'), ('venue', 'Jazz Club')])
+
+
+class ShowImportTestCase(FyyurTestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.venue_id = self.add_venue()
+    self.artist_id = self.add_artist()
+
+  def import_shows(self, body, content_type='text/csv', query=''):
+    response_object = self.client().post('/shows/import' + query, data=body,
+                                         content_type=content_type)
+    return response_object.status_code, response_object.get_json()
+
+  def show_count(self):
+    return db.session.query(Show).count()
+
+  '''
+  POST /shows/import inserts the valid rows and reports every other one by
+  row number, whatever is wrong with it.
+  '''
+
+  def test_import_shows_reports_malformed_rows(self):
+    body = ('artist_id,venue_id,start_time,duration\n'
+            '{a},{v},2030-01-01T20:00,90\n'
+            'one,{v},2030-01-02T20:00,\n'
+            '{a},{v},not a date,\n'
+            '{a},{v},2030-01-03T20:00,0\n'
+            '{a},{v},2030-01-04T20:00+02:00,\n'
+            '{a},{v},2030-01-05T20:00,\n').format(a=self.artist_id, v=self.venue_id)
+
+    status, report = self.import_shows(body)
+
+    self.assertEqual(status, 200)
+    self.assertEqual(report['imported'], 2)
+    self.assertEqual(report['rejected'], 4)
+    self.assertEqual([rejection['row'] for rejection in report['rejections']], [2, 3, 4, 5])
+    self.assertIn('integers', report['rejections'][0]['error'])
+    self.assertIn('duration', report['rejections'][2]['error'])
+    self.assertEqual(self.show_count(), 2)
+
+  '''
+  Rows naming an artist or a venue that does not exist are rejected.
+  '''
+
+  def test_import_shows_rejects_unknown_ids(self):
+    rows = [{"artist_id": self.artist_id, "venue_id": self.venue_id, "start_time": "2030-01-01T20:00"},
+            {"artist_id": 999, "venue_id": self.venue_id, "start_time": "2030-01-02T20:00"},
+            {"artist_id": self.artist_id, "venue_id": 999, "start_time": "2030-01-03T20:00"}]
+
+    status, report = self.import_shows(json.dumps(rows), 'application/json')
+
+    self.assertEqual(status, 200)
+    self.assertEqual(report['imported'], 1)
+    self.assertEqual([(rejection['row'], rejection['error']) for rejection in report['rejections']],
+                     [(2, 'unknown artist_id 999'), (3, 'unknown venue_id 999')])
+
+  '''
+  Rows of one import that overlap each other are rejected after the first
+  one; back-to-back shows are not an overlap.
+  '''
+
+  def test_import_shows_rejects_conflicts_within_a_batch(self):
+    other_artist_id = self.add_artist('Matt Quevedo')
+    body = "\n".join(json.dumps(row) for row in [
+      {"artist_id": self.artist_id, "venue_id": self.venue_id,
+       "start_time": "2030-01-01T20:00", "duration": 120},
+      # the same venue, during the first show
+      {"artist_id": other_artist_id, "venue_id": self.venue_id,
+       "start_time": "2030-01-01T21:00", "duration": 60},
+      # the same venue, right after it
+      {"artist_id": other_artist_id, "venue_id": self.venue_id,
+       "start_time": "2030-01-01T22:00", "duration": 60},
+    ]) + "\nnot json\n"
+
+    status, report = self.import_shows(body, 'application/x-ndjson')
+
+    self.assertEqual(status, 200)
+    self.assertEqual(report['imported'], 2)
+    self.assertEqual([rejection['row'] for rejection in report['rejections']], [2, 4])
+    self.assertIn('venue is already booked', report['rejections'][0]['error'])
+    self.assertIn('by row 1', report['rejections'][0]['error'])
+    self.assertEqual(report['rejections'][1]['error'], 'not a JSON object')
+
+  '''
+  An upload (multipart "file") is read like a request body; a body whose
+  format cannot be told, or which is not JSON, is refused with 400.
+  '''
+
+  def test_import_shows_upload_and_400(self):
+    upload = 'artist_id,venue_id,start_time\n{},{},2030-01-01T20:00\n'.format(
+      self.artist_id, self.venue_id)
+    response_object = self.client().post('/shows/import', content_type='multipart/form-data',
+                                         data={'file': (io.BytesIO(upload.encode()), 'shows.csv')})
+    self.assertEqual(response_object.get_json()['imported'], 1)
+
+    status, report = self.import_shows('x', 'text/plain')
+    self.assertEqual(status, 400)
+    status, report = self.import_shows('{"artist_id": 1', query='?format=json')
+    self.assertEqual(status, 400)
+    self.assertIn('invalid JSON', report['error'])
+
+  '''
+  `flask import-shows FILE` prints the counts and the rejected rows.
+  '''
+
+  def test_import_shows_command(self):
+    with tempfile.TemporaryDirectory() as directory:
+      path = os.path.join(directory, 'shows.csv')
+      with open(path, 'w') as f:
+        f.write('artist_id,venue_id,start_time\n'
+                '{a},{v},2030-01-01T20:00\n'
+                '{a},999,2030-01-02T20:00\n'.format(a=self.artist_id, v=self.venue_id))
+      result = app.test_cli_runner().invoke(args=['import-shows', path])
+
+    self.assertEqual(result.exit_code, 0)
+    self.assertIn('Imported 1 shows, rejected 1 rows', result.output)
+    self.assertIn('row 2: unknown venue_id 999', result.output)
+    self.assertEqual(self.show_count(), 1)
+
+
+class DoubleBookingTestCase(FyyurTestCase):
+
+  START = datetime.datetime(2030, 1, 1, 20, 0)
+
+  def setUp(self):
+    super().setUp()
+    self.venue_id = self.add_venue()
+    self.artist_id = self.add_artist()
+    self.other_venue_id = self.add_venue('Park Square Live Music & Coffee')
+    self.other_artist_id = self.add_artist('Matt Quevedo')
+
+  def add_show(self, venue_id, artist_id, start_time, duration=120):
+    db.session.add(Show(venue_id=venue_id, artist_id=artist_id,
+                        start_time=start_time, duration=duration))
+    db.session.commit()
+
+  def minutes(self, minutes):
+    return self.START + datetime.timedelta(minutes=minutes)
+
+  '''
+  The in-memory index finds the shows overlapping a slot at the venue or
+  for the artist; a show ending when the slot starts does not overlap.
+  '''
+
+  def test_bookings_overlapping(self):
+    bookings = scheduling.Bookings()
+    bookings.add(("show", 1), 1, 1, self.START, self.minutes(120))
+
+    self.assertEqual(bookings.overlapping(1, 2, self.minutes(120), self.minutes(180)), [])
+    self.assertEqual(bookings.overlapping(2, 2, self.minutes(60), self.minutes(90)), [])
+    self.assertEqual(bookings.overlapping(1, 2, self.minutes(-30), self.minutes(1)),
+                     [("venue", ("show", 1), self.START, self.minutes(120))])
+    self.assertEqual([kind for kind, _, _, _ in bookings.overlapping(2, 1, self.minutes(60), self.minutes(90))],
+                     ["artist"])
+    self.assertEqual(bookings.overlapping(1, 1, self.minutes(60), self.minutes(90), ignore=("show", 1)), [])
+
+  '''
+  A show of the longest duration still overlaps a slot starting a minute
+  before it ends: the index window reaches MAX_SHOW_MINUTES back.
+  '''
+
+  def test_bookings_longest_show(self):
+    bookings = scheduling.Bookings()
+    bookings.add(("show", 1), 1, 1, self.START, self.minutes(MAX_SHOW_MINUTES))
+
+    self.assertEqual(len(bookings.overlapping(1, 2, self.minutes(MAX_SHOW_MINUTES - 1),
+                                              self.minutes(MAX_SHOW_MINUTES + 60))), 1)
+    self.assertEqual(bookings.overlapping(1, 2, self.minutes(MAX_SHOW_MINUTES),
+                                          self.minutes(MAX_SHOW_MINUTES + 60)), [])
+
+  '''
+  Back-to-back shows are accepted; a show overlapping another one at the
+  same venue, or for the same artist, is refused on flush.
+  '''
+
+  def test_flush_refuses_double_bookings(self):
+    self.add_show(self.venue_id, self.artist_id, self.START)
+    self.add_show(self.venue_id, self.other_artist_id, self.minutes(120))
+    self.add_show(self.other_venue_id, self.artist_id, self.minutes(-60), duration=60)
+
+    for venue_id, artist_id in ((self.venue_id, self.other_artist_id),
+                                (self.other_venue_id, self.artist_id)):
+      with self.assertRaises(scheduling.DoubleBookingError):
+        self.add_show(venue_id, artist_id, self.minutes(60), duration=30)
+      db.session.rollback()
+
+    # two new shows of one flush are checked against each other too
+    db.session.add_all([
+      Show(venue_id=self.other_venue_id, artist_id=self.other_artist_id,
+           start_time=self.minutes(600), duration=60),
+      Show(venue_id=self.other_venue_id, artist_id=self.artist_id,
+           start_time=self.minutes(630), duration=60)])
+    with self.assertRaises(scheduling.DoubleBookingError):
+      db.session.commit()
+    db.session.rollback()
+
+    self.assertEqual(db.session.query(Show).count(), 3)
+
+  '''
+  The availability query reads the shows of the longest duration before
+  the slot, no earlier ones.
+  '''
+
+  def test_conflicts_longest_show(self):
+    self.add_show(self.venue_id, self.artist_id, self.START, duration=MAX_SHOW_MINUTES)
+
+    self.assertEqual(len(scheduling.conflicts(
+      self.venue_id, None, self.minutes(MAX_SHOW_MINUTES - 1), 60)), 1)
+    self.assertEqual(scheduling.conflicts(
+      self.venue_id, None, self.minutes(MAX_SHOW_MINUTES), 60), [])
+
+  '''
+  GET /shows/availability tells whether a slot is free, with the shows in
+  the way.
+  '''
+
+  def test_show_availability(self):
+    self.add_show(self.venue_id, self.artist_id, self.START)
+
+    response_data = self.client().get('/shows/availability', query_string={
+      'venue_id': self.venue_id, 'start_time': '2030-01-01 21:00', 'duration': 30}).get_json()
+    self.assertFalse(response_data['free'])
+    self.assertEqual(response_data['conflicts'][0]['booked'], 'venue')
+    self.assertEqual(response_data['conflicts'][0]['end_time'], '2030-01-01T22:00:00')
+
+    response_data = self.client().get('/shows/availability', query_string={
+      'venue_id': self.venue_id, 'artist_id': self.artist_id,
+      'start_time': '2030-01-01 22:00'}).get_json()
+    self.assertTrue(response_data['free'])
+
+    response_object = self.client().get('/shows/availability?start_time=2030-01-01')
+    self.assertEqual(response_object.status_code, 400)
+
+  '''
+  The new show form refuses a slot that is not free and keeps the
+  back-to-back one.
+  '''
+
+  def test_create_show_refuses_double_booking(self):
+    self.add_show(self.venue_id, self.artist_id, self.START)
+
+    response_object = self.client().post('/shows/create', data={
+      'artist_id': self.other_artist_id, 'venue_id': self.venue_id,
+      'start_time': '2030-01-01 21:30:00', 'duration': 60})
+    self.assertIn(b'This slot is not free', response_object.data)
+
+    response_object = self.client().post('/shows/create', data={
+      'artist_id': self.other_artist_id, 'venue_id': self.venue_id,
+      'start_time': '2030-01-01 22:00:00', 'duration': 60})
+    self.assertIn(b'Show was successfully listed!', response_object.data)
+    self.assertEqual(db.session.query(Show).count(), 2)
+
+
+class ShowListTestCase(FyyurTestCase):
+
+  START = datetime.datetime(2030, 1, 1, 20, 0)
+
+  def setUp(self):
+    super().setUp()
+    self.venue_ids = [self.add_venue(), self.add_venue('Park Square Live Music & Coffee')]
+    self.artist_ids = [self.add_artist(), self.add_artist('Matt Quevedo')]
+
+  def add_shows(self, days):
+    # one show per venue a day, both at the same time, so pages also break
+    # between shows of one start_time
+    for day in range(days):
+      for venue_id, artist_id in zip(self.venue_ids, self.artist_ids):
+        db.session.add(Show(venue_id=venue_id, artist_id=artist_id,
+                            start_time=self.START + datetime.timedelta(days=day)))
+    db.session.commit()
+
+  def get_shows(self, path):
+    """The (start time, venue id) of the shows listed at path and the path
+    of the next page, None on the last one."""
+    response_object = self.client().get(path)
+    self.assertEqual(response_object.status_code, 200)
+    page = response_object.get_data(as_text=True)
+    shows = re.findall(r'<h4>(.*?)</h4>.*?href="/venues/(\d+)"', page, re.S)
+    next_link = re.search(r'<li class="next"><a href="([^"]+)"', page)
+    return ([(start_time, int(venue_id)) for start_time, venue_id in shows],
+            next_link and html.unescape(next_link.group(1)))
+
+  def get_all_shows(self, path):
+    listed = []
+    pages = 0
+    while path:
+      shows, path = self.get_shows(path)
+      listed.extend(shows)
+      pages += 1
+    return listed, pages
+
+  '''
+  /shows pages follow each other through the cursor of the last show, in
+  (start_time, id) order: no show is listed twice or skipped, even when a
+  page ends between shows starting at the same time.
+  '''
+
+  def test_shows_pages_follow_the_cursor(self):
+    self.add_shows(4)
+
+    with mock.patch('app.SHOWS_PER_PAGE', 3):
+      listed, pages = self.get_all_shows('/shows')
+
+    self.assertEqual(pages, 3)
+    self.assertEqual(len(listed), 8)
+    self.assertEqual(len(set(listed)), 8)
+    self.assertEqual([venue_id for _, venue_id in listed], self.venue_ids * 4)
+
+  '''
+  The next link only shows when rows are left after the page.
+  '''
+
+  def test_shows_next_link_only_when_more(self):
+    self.add_shows(2)
+
+    with mock.patch('app.SHOWS_PER_PAGE', 4):
+      shows, next_path = self.get_shows('/shows')
+      self.assertEqual(len(shows), 4)
+      self.assertIsNone(next_path)
+
+      db.session.add(Show(venue_id=self.venue_ids[0], artist_id=self.artist_ids[0],
+                          start_time=self.START + datetime.timedelta(days=10)))
+      db.session.commit()
+      shows, next_path = self.get_shows('/shows')
+      self.assertEqual(len(shows), 4)
+      self.assertIsNotNone(next_path)
+      self.assertEqual(len(self.get_shows(next_path)[0]), 1)
+
+  '''
+  from and to bound the start times (a bare "to" date includes that whole
+  day), venue_id and artist_id the owners, and the next links keep the
+  filters.
+  '''
+
+  def test_shows_filters(self):
+    self.add_shows(4)
+
+    def count(query):
+      return len(self.get_all_shows('/shows?' + query)[0])
+
+    with mock.patch('app.SHOWS_PER_PAGE', 3):
+      self.assertEqual(count('from=2030-01-02'), 6)
+      self.assertEqual(count('to=2030-01-02'), 4)
+      self.assertEqual(count('from=2030-01-02&to=2030-01-03T20:00'), 2)
+      self.assertEqual(count('venue_id={}'.format(self.venue_ids[1])), 4)
+      self.assertEqual(count('artist_id={}'.format(self.artist_ids[0])), 4)
+      self.assertEqual(count('venue_id={}&artist_id={}'.format(self.venue_ids[1], self.artist_ids[0])), 0)
+
+      listed, pages = self.get_all_shows('/shows?venue_id={}'.format(self.venue_ids[1]))
+    self.assertEqual(pages, 2)
+    self.assertEqual(set(venue_id for _, venue_id in listed), {self.venue_ids[1]})
+
+  '''
+  A cursor, date or id that cannot be read is refused with 400.
+  '''
+
+  def test_shows_bad_arguments(self):
+    for query in ('after=garbage', 'after=2030-01-01T20:00:00_x', 'after=yesterday_1',
+                  'from=not-a-date', 'to=2030-13-01', 'venue_id=abc', 'artist_id=1.5'):
+      response_object = self.client().get('/shows?' + query)
+      self.assertEqual(response_object.status_code, 400, query)
+
+
+class ProfileShowsTestCase(FyyurTestCase):
+
+  def setUp(self):
+    super().setUp()
+    # the pages split at the real time, profile_shows() is also called at
+    # this one
+    self.now = datetime.datetime.today().replace(second=0, microsecond=0)
+    self.venue_id = self.add_venue()
+    self.artist_id = self.add_artist()
+    # a page and two of past shows, one starting right now and two later
+    for days in list(range(-PAST_SHOWS_PER_PAGE - 2, 0)) + [0, 1, 2]:
+      db.session.add(Show(venue_id=self.venue_id, artist_id=self.artist_id,
+                          start_time=self.now + datetime.timedelta(days=days)))
+    db.session.commit()
+
+  def venue_shows(self, query_string=''):
+    with app.test_request_context('/venues/{}{}'.format(self.venue_id, query_string)), \
+        mock.patch('app.datetime', wraps=datetime) as clock:
+      clock.datetime.today.return_value = self.now
+      shows = profile_shows(Show.venue_id, self.venue_id, Artist, [Artist.name.label("artist_name")])
+    return shows, clock.datetime.today.call_count
+
+  '''
+  The shows are split at a single "now", read once: a show starting at
+  that instant is upcoming, and every show is counted on one side only.
+  '''
+
+  def test_profile_shows_split_at_one_now(self):
+    shows, reads = self.venue_shows()
+
+    self.assertEqual(reads, 1)
+    self.assertEqual(shows["past_shows_count"], PAST_SHOWS_PER_PAGE + 2)
+    self.assertEqual(shows["upcoming_shows_count"], 3)
+    self.assertEqual([show["start_time"] for show in shows["upcoming_shows"]],
+                     [str(self.now + datetime.timedelta(days=days)) for days in (0, 1, 2)])
+    self.assertEqual(shows["past_shows"][0]["start_time"],
+                     str(self.now - datetime.timedelta(days=1)))
+
+  '''
+  Past shows come newest first, PAST_SHOWS_PER_PAGE at a time: ?past_page=2
+  holds the oldest ones, and out of range pages are clamped or empty.
+  '''
+
+  def test_profile_shows_past_pages(self):
+    shows, _ = self.venue_shows()
+    self.assertEqual(len(shows["past_shows"]), PAST_SHOWS_PER_PAGE)
+    self.assertEqual((shows["past_page"], shows["past_pages"]), (1, 2))
+
+    shows, _ = self.venue_shows('?past_page=2')
+    self.assertEqual([show["start_time"] for show in shows["past_shows"]],
+                     [str(self.now + datetime.timedelta(days=days)) for days in (-PAST_SHOWS_PER_PAGE - 1,
+                                                                                 -PAST_SHOWS_PER_PAGE - 2)])
+    self.assertEqual(len(shows["upcoming_shows"]), 3)
+
+    shows, _ = self.venue_shows('?past_page=0')
+    self.assertEqual(shows["past_page"], 1)
+    shows, _ = self.venue_shows('?past_page=3')
+    self.assertEqual(shows["past_shows"], [])
+
+  '''
+  The venue and artist pages render both lists and the past page links.
+  '''
+
+  def test_profile_pages(self):
+    page = self.client().get('/venues/{}?past_page=2'.format(self.venue_id)).get_data(as_text=True)
+    self.assertIn('?past_page=1', page)
+    self.assertNotIn('?past_page=3', page)
+
+    response_object = self.client().get('/artists/{}'.format(self.artist_id))
+    self.assertEqual(response_object.status_code, 200)
+    self.assertIn('?past_page=2', response_object.get_data(as_text=True))
+    self.assertEqual(self.client().get('/venues/999').status_code, 404)
+
+
+def load_migration(revision):
+  path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                      'migrations', 'versions', revision + '_.py')
+  spec = importlib.util.spec_from_file_location('migration_' + revision, path)
+  module = importlib.util.module_from_spec(spec)
+  spec.loader.exec_module(module)
+  return module
+
+
+class GenreTestCase(FyyurTestCase):
+
+  def profile_form(self, name, genres, **fields):
+    form = {'name': name, 'city': 'San Francisco', 'state': 'CA', 'phone': '123-123-1234',
+            'address': '1015 Folsom Street', 'image_link': '', 'facebook_link': '',
+            'genres': genres}
+    form.update(fields)
+    return form
+
+  def genre_names(self, model, name):
+    owner = db.session.query(model).filter_by(name=name).one()
+    return [genre.name for genre in owner.genres]
+
+  '''
+  The genres of a new or edited venue or artist go through the join
+  tables and come back sorted; a genre name is stored once however many
+  profiles use it.
+  '''
+
+  def test_genres_round_trip(self):
+    for kind, model in (('venues', Venue), ('artists', Artist)):
+      self.client().post('/{}/create'.format(kind),
+                         data=self.profile_form('The Jazz Place', ['Jazz', 'Folk']))
+      self.assertEqual(self.genre_names(model, 'The Jazz Place'), ['Folk', 'Jazz'])
+      owner_id = db.session.query(model.id).filter_by(name='The Jazz Place').scalar()
+
+      self.client().post('/{}/{}/edit'.format(kind, owner_id),
+                         data=self.profile_form('The Jazz Place', ['Jazz', 'Rock n Roll', 'R&B']))
+      db.session.expire_all()
+      self.assertEqual(self.genre_names(model, 'The Jazz Place'), ['Jazz', 'R&B', 'Rock n Roll'])
+
+      # the edit form preselects them
+      page = self.client().get('/{}/{}/edit'.format(kind, owner_id)).get_data(as_text=True)
+      genres_select = page.split('id="genres"', 1)[1].split('</select>', 1)[0]
+      self.assertEqual(re.findall(r'<option selected value="([^"]+)"', genres_select),
+                       ['Jazz', 'R&amp;B', 'Rock n Roll'])
+
+    self.assertEqual(sorted(name for name, in db.session.query(MusicGenre.name)),
+                     ['Folk', 'Jazz', 'R&B', 'Rock n Roll'])
+
+  '''
+  The genre pages list the venues (by area) and the artists of the genre
+  only; an unknown genre is a 404.
+  '''
+
+  def test_genre_pages(self):
+    for name, genres in (('Jazz Club', ['Jazz']), ('Folk Barn', ['Folk']),
+                         ('Everything Hall', ['Folk', 'Jazz'])):
+      self.client().post('/venues/create', data=self.profile_form(name, genres))
+      self.client().post('/artists/create', data=self.profile_form(name + ' Band', genres))
+
+    venues_page = self.client().get('/genres/Jazz/venues').get_data(as_text=True)
+    artists_page = self.client().get('/genres/Jazz/artists').get_data(as_text=True)
+
+    self.assertEqual(re.findall(r'<h5>(.*?)</h5>', venues_page), ['Jazz Club', 'Everything Hall'])
+    self.assertIn('San Francisco, CA', venues_page)
+    self.assertEqual(re.findall(r'<h5>(.*?)</h5>', artists_page), ['Everything Hall Band', 'Jazz Club Band'])
+    for kind in ('venues', 'artists'):
+      self.assertEqual(self.client().get('/genres/Polka/' + kind).status_code, 404)
+
+  '''
+  The genre migration reads the old Postgres array literals, quoted or
+  not, including the ones its downgrade writes back.
+  '''
+
+  def test_migration_parse_genres(self):
+    parse_genres = load_migration('3698b2cc2a47').parse_genres
+
+    self.assertEqual(parse_genres('{Jazz,"R&B", \'Rock n Roll\'}'), ['Jazz', 'R&B', 'Rock n Roll'])
+    self.assertEqual(parse_genres('{"Folk","Jazz"}'), ['Folk', 'Jazz'])
+    self.assertEqual(parse_genres('{}'), [])
+    self.assertEqual(parse_genres(None), [])
+
+
+class VenueAreasTestCase(FyyurTestCase):
+
+  def venue_areas_page(self):
+    """{"City, ST": [venue names]} as listed by /venues."""
+    page = self.client().get('/venues').get_data(as_text=True)
+    return {area: re.findall(r'<h5>(.*?)</h5>', venues)
+            for area, venues in re.findall(r'<h3>(.*?)</h3>(.*?)</ul>', page, re.S)}
+
+  def venue_form(self, name, city):
+    return {'name': name, 'city': city, 'state': 'CA', 'phone': '123-123-1234',
+            'address': '1015 Folsom Street', 'image_link': '', 'facebook_link': '',
+            'genres': ['Jazz']}
+
+  '''
+  /venues serves its areas from memory, and creating, editing or deleting
+  a venue through the app rebuilds them.
+  '''
+
+  def test_venue_areas_follow_venue_changes(self):
+    self.add_venue('Jazz Club')
+    self.assertEqual(self.venue_areas_page(), {'San Francisco, CA': ['Jazz Club']})
+
+    # written behind the app's back: the cached areas do not see it
+    self.add_venue('Folk Barn')
+    self.assertEqual(self.venue_areas_page(), {'San Francisco, CA': ['Jazz Club']})
+
+    self.client().post('/venues/create', data=self.venue_form('Dueling Pianos Bar', 'San Francisco'))
+    self.assertEqual(self.venue_areas_page(),
+                     {'San Francisco, CA': ['Jazz Club', 'Folk Barn', 'Dueling Pianos Bar']})
+
+    venue_id = db.session.query(Venue.id).filter_by(name='Folk Barn').scalar()
+    self.client().post('/venues/{}/edit'.format(venue_id), data=self.venue_form('Folk Loft', 'Oakland'))
+    self.assertEqual(self.venue_areas_page(),
+                     {'Oakland, CA': ['Folk Loft'],
+                      'San Francisco, CA': ['Jazz Club', 'Dueling Pianos Bar']})
+
+    self.client().get('/venues/{}/delete'.format(venue_id))
+    self.assertEqual(self.venue_areas_page(), {'San Francisco, CA': ['Jazz Club', 'Dueling Pianos Bar']})
+
+
+if __name__ == "__main__":
+  unittest.main()
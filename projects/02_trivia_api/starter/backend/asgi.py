@@ -0,0 +1,6 @@
+'''
+ASGI entry point: uvicorn asgi:app (see async_app.py).
+'''
+from async_app import create_asgi_app
+
+app = create_asgi_app()
@@ -0,0 +1,312 @@
+'''
+ASGI serving mode.
+
+create_asgi_app() serves the routes of create_app() from an event loop.
+The stateless quiz step (POST /quizzes without a session_id) and the JSON
+search (POST /questions) are coroutines that query the database through an
+async driver and connection pool (asyncpg on Postgres, aiosqlite on SQLite,
+through the databases package), so one worker keeps serving quiz and search
+requests while their queries wait on the database. Every other route, and
+the quiz-session and NDJSON modes that need the in-process session store or
+a server-side cursor, is handed to the Flask app, which runs in a thread
+pool (asgiref's WsgiToAsgi).
+
+The coroutines return the same JSON as the Flask views. They are not
+recorded by the request metrics of GET /metrics.
+
+Run it with an ASGI server (see asgi.py):
+    uvicorn asgi:app --workers 4
+DATABASE_URL is shared with create_app(); the async pool keeps DB_POOL_SIZE
+connections open and grows to DB_POOL_SIZE + DB_MAX_OVERFLOW.
+'''
+import json
+import random
+
+import databases
+from asgiref.wsgi import WsgiToAsgi
+from sqlalchemy import func, select
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.http import parse_accept_header
+
+from flaskr import (create_app, quiz_category_id, quiz_difficulty, quiz_answer,
+                    page_and_limit, NDJSON_MIMETYPE)
+from models import (db, Question, CategoryCount, dumps, setting, probe_rounds,
+                    pick_stats)
+from quiz import next_difficulty, bands_by_distance, band_unseen
+import search
+
+CORS_HEADERS = [
+    (b'access-control-allow-origin', b'*'),
+    (b'access-control-allow-headers', b'Content-Type, Authorizations, True'),
+    (b'access-control-allow-methods', b'GET,POST,PATCH,DELETE,OPTIONS'),
+]
+ERROR_MESSAGES = {400: 'Bad Request', 404: 'Not found', 422: 'unprocessable'}
+
+
+def error(status):
+    return status, {
+        'success': False,
+        'error': status,
+        'message': ERROR_MESSAGES[status],
+    }
+
+
+def async_database_url(url):
+    # the databases package only knows the postgresql:// spelling
+    if url.startswith('postgres://'):
+        return 'postgresql://' + url[len('postgres://'):]
+    return url
+
+
+def format_row(row):
+    return {field: row[field] for field in Question.FIELDS}
+
+
+async def read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body'):
+            return b''.join(chunks)
+
+
+# a receive callable that hands an already read body to the Flask app
+def replay(body):
+    messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+
+    async def receive():
+        if messages:
+            return messages.pop()
+        return {'type': 'http.disconnect'}
+    return receive
+
+
+class TriviaASGI:
+
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+        self.wsgi = WsgiToAsgi(flask_app)
+
+        config = flask_app.config
+        url = config['SQLALCHEMY_DATABASE_URI']
+        options = {}
+        if not url.startswith('sqlite'):
+            pool_size = setting(config, 'DB_POOL_SIZE', 5, int)
+            options['min_size'] = pool_size
+            options['max_size'] = pool_size + setting(
+                config, 'DB_MAX_OVERFLOW', 10, int)
+        self.database = databases.Database(async_database_url(url), **options)
+
+        with flask_app.app_context():
+            self.dialect = db.engine.dialect.name
+
+        self.routes = {
+            ('POST', '/quizzes'): self.play_quiz,
+            ('POST', '/questions'): self.search_questions,
+        }
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+
+        handler = None
+        if scope['type'] == 'http':
+            handler = self.routes.get((scope['method'], scope['path']))
+        if handler is None:
+            await self.wsgi(scope, receive, send)
+            return
+
+        body = await read_body(receive)
+        headers = dict(scope['headers'])
+        response = None
+        content_type = headers.get(b'content-type', b'').split(b';')[0]
+        if content_type.strip() == b'application/json':
+            try:
+                data = json.loads(body)
+            except ValueError:
+                data = None
+            # anything else gets the Flask app's exact error handling
+            if isinstance(data, dict):
+                response = await handler(data, headers)
+
+        if response is None:
+            await self.wsgi(scope, replay(body), send)
+            return
+
+        status, response_object = response
+        payload = dumps(response_object)
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [
+                (b'content-type', b'application/json'),
+                (b'content-length', str(len(payload)).encode()),
+            ] + CORS_HEADERS,
+        })
+        await send({'type': 'http.response.body', 'body': payload})
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                try:
+                    await self.startup()
+                except Exception as e:
+                    await send({'type': 'lifespan.startup.failed',
+                                'message': str(e)})
+                    return
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.database.disconnect()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def startup(self):
+        # the search indexes are DDL, created once through the sync engine
+        with self.flask_app.app_context():
+            search.ensure_search_index(db.engine)
+        await self.database.connect()
+
+    '''
+    quiz_total(category_id) / random_unseen(category, exclude, difficulty, unseen)
+        the async counterparts of the category count lookup and of
+        Question.random_unseen (same random id probes and index walk, same
+        indexes).
+    '''
+    async def quiz_total(self, category_id):
+        counts = CategoryCount.__table__
+        if category_id is None:
+            query = select([func.sum(counts.c.questions)]) \
+                .where(counts.c.questions > 0)
+        else:
+            query = select([counts.c.questions]) \
+                .where(counts.c.category_id == category_id)
+        return await self.database.fetch_val(query) or 0
+
+    async def random_unseen(self, category=None, exclude=(), difficulty=None,
+                            unseen=None):
+        table = Question.__table__
+
+        # fresh bind parameters per use: the SQLite backend binds by name
+        # order and cannot repeat one
+        def filtered(query):
+            if category is not None:
+                query = query.where(table.c.category == category)
+            if difficulty is not None:
+                query = query.where(table.c.difficulty == difficulty)
+            return query
+
+        bounds = await self.database.fetch_one(select([
+            filtered(select([table.c.id])).order_by(table.c.id)
+            .limit(1).as_scalar().label('low'),
+            filtered(select([table.c.id])).order_by(table.c.id.desc())
+            .limit(1).as_scalar().label('high'),
+        ]))
+        candidates = filtered(
+            select([table.c[field] for field in Question.FIELDS]))
+        if bounds['low'] is None:
+            return None
+
+        exclude = set(exclude)
+        if exclude:
+            candidates = candidates.where(~table.c.id.in_(exclude))
+
+        for probes in probe_rounds(bounds['low'], bounds['high'], unseen):
+            rows = await self.database.fetch_all(
+                candidates.where(table.c.id.in_(probes)))
+            if rows:
+                pick_stats['probe'] += 1
+                return format_row(random.choice(rows))
+
+        pick_stats['walk'] += 1
+        pivot = random.randint(bounds['low'], bounds['high'])
+        row = await self.database.fetch_one(
+            candidates.where(table.c.id >= pivot).order_by(table.c.id).limit(1))
+        if row is None:
+            row = await self.database.fetch_one(
+                candidates.where(table.c.id < pivot).order_by(table.c.id).limit(1))
+        return None if row is None else format_row(row)
+
+    async def play_quiz(self, data, headers):
+        if data.get('session_id') is not None:
+            # quiz sessions live in the Flask app's process state
+            return None
+        try:
+            previous_questions = data.get('previous_questions') or []
+            difficulty = None
+            try:
+                category_id = quiz_category_id(data.get('quiz_category'))
+                if data.get('difficulty') is not None:
+                    difficulty = next_difficulty(
+                        quiz_difficulty(data['difficulty']),
+                        quiz_answer(data.get('last_answer_correct')))
+            except (ValueError, TypeError, KeyError):
+                return error(400)
+
+            total = await self.quiz_total(category_id)
+            question = None
+            if total > 0:
+                if difficulty is None:
+                    question = await self.random_unseen(
+                        category_id, previous_questions,
+                        unseen=total - len(set(previous_questions)))
+                else:
+                    unseen = band_unseen(total, set(previous_questions))
+                    for band in bands_by_distance(difficulty):
+                        question = await self.random_unseen(
+                            category_id, previous_questions, band, unseen)
+                        if question is not None:
+                            break
+
+            response_object = {
+                'success': True,
+                'question': question,
+                'total_questions': total,
+            }
+            if difficulty is not None:
+                response_object['difficulty'] = difficulty
+            return 200, response_object
+        except Exception:
+            return error(422)
+
+    async def search_questions(self, data, headers):
+        accept = parse_accept_header(
+            headers.get(b'accept', b'').decode('latin1'), MIMEAccept)
+        if accept.best_match(['application/json', NDJSON_MIMETYPE]) \
+                == NDJSON_MIMETYPE:
+            # streamed from a server-side cursor by the Flask view
+            return None
+        try:
+            search_term = data['searchTerm']
+            try:
+                page, limit = page_and_limit(data)
+            except (ValueError, TypeError):
+                return error(400)
+
+            query = search.search_page(
+                search.search_statement(search_term, self.dialect),
+                page, limit)
+            rows = await self.database.fetch_all(query.statement)
+
+            if len(rows) == 0:
+                return error(404)
+
+            return 200, {
+                'success': True,
+                'questions': [format_row(row) for row in rows],
+                'current_category': None,
+                'total_questions': rows[0]['total'],
+            }
+        except Exception:
+            return error(422)
+
+
+'''
+create_asgi_app(test_config)
+    builds the Flask app with create_app(test_config) and wraps it in the
+    ASGI app.
+'''
+def create_asgi_app(test_config=None):
+    return TriviaASGI(create_app(test_config))
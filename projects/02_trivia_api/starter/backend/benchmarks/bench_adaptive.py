@@ -0,0 +1,78 @@
+'''
+Adaptive quiz benchmark.
+
+Measures the per-step latency of adaptive question selection
+(quiz.pick_adaptive) for growing question banks: each step moves the
+difficulty band after a simulated answer and picks a random unseen question
+of that band through the (category, difficulty, id) index. The walk column
+is the share of picks where every probe round missed and the index walk
+fallback ran (see Question.random_unseen); it should stay near zero.
+
+Usage (from the backend folder):
+    python benchmarks/bench_adaptive.py
+    python benchmarks/bench_adaptive.py --sizes 100000 1000000 --database sqlite:////tmp/bench.db
+'''
+import argparse
+import random
+import time
+
+from common import DEFAULT_DATABASE, make_app, seed
+from models import db, get_category_counts, pick_stats
+from quiz import next_difficulty, pick_adaptive
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def play(category_id, steps, accuracy, rng):
+    counts = get_category_counts()
+    total = sum(counts.values()) if category_id is None \
+        else counts.get(category_id, 0)
+    difficulty = 3
+    played = []
+    samples = []
+    for _ in range(steps):
+        correct = rng.random() < accuracy
+        start = time.perf_counter()
+        difficulty = next_difficulty(difficulty, correct)
+        question = pick_adaptive(category_id, played, difficulty, total)
+        samples.append((time.perf_counter() - start) * 1000)
+        db.session.expunge_all()
+        if question is None:
+            break
+        played.append(question.id)
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[10000, 100000, 1000000])
+    parser.add_argument('--steps', type=int, default=200)
+    parser.add_argument('--accuracy', type=float, default=0.6,
+                        help='share of simulated correct answers')
+    parser.add_argument('--database', default=DEFAULT_DATABASE)
+    args = parser.parse_args()
+
+    app = make_app(args.database)
+    rng = random.Random(0)
+
+    print('{:>8} {:>9} {:>6} {:>10} {:>10} {:>7}'.format(
+        'rows', 'category', 'steps', 'p50 ms', 'p95 ms', 'walk'))
+    with app.app_context():
+        for size in args.sizes:
+            seed(size)
+            for category_id in (1, None):
+                pick_stats.clear()
+                samples = play(category_id, args.steps, args.accuracy, rng)
+                picks = sum(pick_stats.values()) or 1
+                print('{:>8} {:>9} {:>6} {:10.3f} {:10.3f} {:6.1%}'.format(
+                    size, 'all' if category_id is None else category_id,
+                    len(samples), percentile(samples, 0.5),
+                    percentile(samples, 0.95), pick_stats['walk'] / picks))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,180 @@
+'''
+Sync vs async serving benchmark.
+
+Seeds a synthetic question bank, then serves it twice on a local port:
+with gunicorn sync workers (create_app(), one request per worker process at
+a time) and with uvicorn workers running the ASGI app (asgi.py, quiz and
+search requests share each worker's event loop). Both get the same number
+of worker processes. --clients concurrent clients (asyncio, one connection
+per request) send a mix of stateless quiz steps and JSON searches for
+--seconds, and the throughput, latency percentiles (p50/p95/p99) and errors
+(non-200 responses and failed connections) of each mode are printed.
+
+gunicorn and uvicorn must be installed (see requirements.txt). On SQLite
+both modes serialise on the database file; use Postgres for numbers that
+reflect a deployment.
+
+Usage (from the backend folder):
+    python benchmarks/bench_async.py
+    python benchmarks/bench_async.py --clients 500 --workers 4 --seconds 20 \
+        --database postgresql://postgres@localhost:5432/trivia_bench
+'''
+import argparse
+import asyncio
+import json
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+from common import DEFAULT_DATABASE, NUMBER_OF_CATEGORIES, seed
+from flaskr import create_app
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SEARCH_TERMS = ['question', 'Synthetic', '42', '999', 'question 1']
+
+SERVERS = {
+    'sync': ['gunicorn', '--worker-class', 'sync', "flaskr:create_app()"],
+    'async': ['uvicorn', '--no-access-log', 'asgi:app'],
+}
+
+
+def worker_options(mode, workers, port):
+    if mode == 'sync':
+        return ['--workers', str(workers), '--bind', '127.0.0.1:{}'.format(port),
+                '--backlog', '2048', '--log-level', 'warning']
+    return ['--workers', str(workers), '--host', '127.0.0.1',
+            '--port', str(port), '--backlog', '2048', '--log-level', 'warning']
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def quiz_request(rng):
+    previous = [rng.randint(1, 1000) for _ in range(rng.randint(0, 10))]
+    category = rng.choice([0] + list(range(1, NUMBER_OF_CATEGORIES + 1)))
+    return '/quizzes', {'previous_questions': previous,
+                        'quiz_category': {'id': category}}
+
+
+def search_request(rng):
+    return '/questions', {'searchTerm': rng.choice(SEARCH_TERMS)}
+
+
+async def send(port, path, body):
+    payload = json.dumps(body).encode()
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    try:
+        writer.write(
+            'POST {} HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n'
+            'Content-Type: application/json\r\nContent-Length: {}\r\n\r\n'
+            .format(path, len(payload)).encode() + payload)
+        await writer.drain()
+        response = await reader.read()
+    finally:
+        writer.close()
+    return int(response.split(b' ', 2)[1])
+
+
+async def client(port, deadline, rng, samples, errors):
+    while time.perf_counter() < deadline:
+        make = quiz_request if rng.random() < 0.5 else search_request
+        path, body = make(rng)
+        start = time.perf_counter()
+        try:
+            status = await send(port, path, body)
+        except (OSError, IndexError, ValueError):
+            status = None
+        if status in (200, 404):
+            samples.append(time.perf_counter() - start)
+        else:
+            errors.append(status)
+
+
+async def drive(port, clients, seconds):
+    samples, errors = [], []
+    deadline = time.perf_counter() + seconds
+    start = time.perf_counter()
+    await asyncio.gather(*(
+        client(port, deadline, random.Random(i), samples, errors)
+        for i in range(clients)))
+    return samples, errors, time.perf_counter() - start
+
+
+def wait_until_serving(port, process, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError('server exited with {}'.format(process.returncode))
+        try:
+            socket.create_connection(('127.0.0.1', port), 0.2).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError('server did not start on port {}'.format(port))
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def run(mode, args):
+    port = free_port()
+    env = dict(os.environ, DATABASE_URL=args.database, CREATE_SCHEMA='0',
+               REQUEST_METRICS='0')
+    process = subprocess.Popen(
+        SERVERS[mode] + worker_options(mode, args.workers, port),
+        cwd=BACKEND, env=env, start_new_session=True)
+    try:
+        wait_until_serving(port, process)
+        # one short round warms the connection pools
+        asyncio.run(drive(port, min(args.clients, 20), 1))
+        samples, errors, wall = asyncio.run(
+            drive(port, args.clients, args.seconds))
+    finally:
+        # uvicorn's supervisor leaves stopping its workers to the process
+        # group signal a terminal would send
+        os.killpg(process.pid, signal.SIGTERM)
+        process.wait()
+
+    if not samples:
+        return [mode, 0, 0, 0, 0, len(errors)]
+    return [mode, len(samples) / wall,
+            percentile(samples, 0.5) * 1000,
+            percentile(samples, 0.95) * 1000,
+            percentile(samples, 0.99) * 1000,
+            len(errors)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--size', type=int, default=10000)
+    parser.add_argument('--clients', type=int, default=500)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--modes', nargs='+', default=['sync', 'async'],
+                        choices=sorted(SERVERS))
+    parser.add_argument('--database', default=DEFAULT_DATABASE)
+    args = parser.parse_args()
+
+    app = create_app({'SQLALCHEMY_DATABASE_URI': args.database})
+    with app.app_context():
+        seed(args.size)
+
+    print('{:<6} {:>10} {:>9} {:>9} {:>9} {:>8}'.format(
+        'mode', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'errors'))
+    for mode in args.modes:
+        print('{:<6} {:10.1f} {:9.1f} {:9.1f} {:9.1f} {:8d}'.format(
+            *run(mode, args)))
+        sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
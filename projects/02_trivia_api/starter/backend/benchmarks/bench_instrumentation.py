@@ -0,0 +1,120 @@
+'''
+Instrumentation overhead benchmark.
+
+Times the same requests with request metrics switched off and on, on one
+app with the default settings and on one with SLOW_REQUEST_LOG (which also
+captures every statement). Off and on rounds are interleaved on the same
+app and the best round of each is kept, so the difference is the cost of
+the hooks rather than noise between runs. As the hooks cost far less than
+a request, it also times them alone: the request hooks plus three
+statements' cursor listeners, inside a request context, with no I/O. Last,
+it prints the statements per request the instrumentation counted.
+
+Usage (from the backend folder):
+    python benchmarks/bench_instrumentation.py
+    python benchmarks/bench_instrumentation.py --size 100000 --requests 1000
+'''
+import argparse
+import logging
+import re
+import time
+
+from common import DEFAULT_DATABASE, seed
+from flask import Response
+from flaskr import create_app
+from instrumentation import (request_metrics, _before_cursor_execute,
+                             _after_cursor_execute)
+
+PATHS = ('/questions?page=1', '/categories', '/categories/1/questions')
+
+
+def round_ms(client, requests):
+    start = time.perf_counter()
+    for _ in range(requests):
+        for path in PATHS:
+            client.get(path)
+    return (time.perf_counter() - start) / (requests * len(PATHS)) * 1000
+
+
+def compare(app, requests, rounds):
+    client = app.test_client()
+    for path in PATHS:
+        client.get(path)
+
+    best = {False: None, True: None}
+    for _ in range(rounds):
+        for enabled in (False, True):
+            request_metrics.enabled = enabled
+            ms = round_ms(client, requests)
+            if best[enabled] is None or ms < best[enabled]:
+                best[enabled] = ms
+    request_metrics.enabled = True
+    return best[False], best[True]
+
+
+class FakeCursor:
+    rowcount = 10
+
+
+def hooks_us(app, iterations, statements=3):
+    cursor = FakeCursor()
+    best = {}
+    # recorded under /metrics, which the query summary leaves out
+    with app.test_request_context('/metrics'):
+        for enabled in (False, True, False, True):
+            request_metrics.enabled = enabled
+            start = time.perf_counter()
+            for _ in range(iterations):
+                app.preprocess_request()
+                for _ in range(statements):
+                    _before_cursor_execute(None, cursor, 'SELECT 1', (), None,
+                                           False)
+                    _after_cursor_execute(None, cursor, 'SELECT 1', (), None,
+                                          False)
+                app.process_response(Response())
+            us = (time.perf_counter() - start) / iterations * 1e6
+            best[enabled] = min(best.get(enabled, us), us)
+    request_metrics.enabled = True
+    return best[True] - best[False]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--size', type=int, default=10000)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--rounds', type=int, default=7)
+    parser.add_argument('--database', default=DEFAULT_DATABASE)
+    args = parser.parse_args()
+    logging.getLogger('trivia.slow').disabled = True
+
+    print('{:<10} {:>10} {:>10} {:>14}'.format(
+        'app', 'off ms', 'on ms', 'overhead us'))
+    for name, config in (('default', {}), ('slow log', {'SLOW_REQUEST_LOG': 10})):
+        config['SQLALCHEMY_DATABASE_URI'] = args.database
+        app = create_app(config)
+        if name == 'default':
+            with app.app_context():
+                seed(args.size)
+        off, on = compare(app, args.requests, args.rounds)
+        print('{:<10} {:10.3f} {:10.3f} {:14.1f}'.format(
+            name, off, on, (on - off) * 1000))
+        print('{:<10} {:>10} {:>10} {:14.1f}'.format(
+            '  hooks', '', '', hooks_us(app, args.requests * 10)))
+
+    samples = {}
+    for line in request_metrics.prometheus_lines():
+        match = re.match(r'trivia_http_request_queries_(sum|count)'
+                         r'\{method="GET",endpoint="([^"]+)"\} (\S+)', line)
+        if match and match.group(2) != '/metrics':
+            kind, endpoint, value = match.groups()
+            samples.setdefault(endpoint, {})[kind] = float(value)
+
+    print()
+    print('{:<42} {:>16}'.format('endpoint', 'queries/request'))
+    for endpoint, sample in sorted(samples.items()):
+        print('{:<42} {:16.2f}'.format(
+            endpoint, sample['sum'] / sample['count']))
+
+
+if __name__ == '__main__':
+    main()
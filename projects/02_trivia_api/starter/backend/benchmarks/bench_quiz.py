@@ -0,0 +1,79 @@
+'''
+Quiz selection benchmark.
+
+Compares the per-step latency of POST /quizzes question selection before
+(load the candidate rows, filter previous questions in Python) and after
+(Question.random_unseen) for growing question banks and growing
+previous_questions lists.
+
+Usage (from the backend folder):
+    python benchmarks/bench_quiz.py
+    python benchmarks/bench_quiz.py --sizes 10000 100000 --database sqlite:////tmp/bench.db
+'''
+import argparse
+import random
+import time
+
+from common import DEFAULT_DATABASE, make_app, seed
+from models import Question, db
+
+
+def legacy_select(category_id, previous_questions):
+    if category_id is None:
+        questions = Question.query.all()
+    else:
+        questions = Question.query.filter(
+            Question.category == category_id).all()
+    for pre_q in previous_questions:
+        for q in questions:
+            if q.format()['id'] == pre_q:
+                questions.remove(q)
+    if len(questions) == 0:
+        return None
+    return questions[random.randrange(0, len(questions))]
+
+
+def time_per_step(select, category_id, previous_questions, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        select(category_id, previous_questions)
+        db.session.expunge_all()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[1000, 10000, 100000])
+    parser.add_argument('--previous', type=int, nargs='+', default=[0, 20, 200])
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--database', default=DEFAULT_DATABASE)
+    parser.add_argument('--skip-legacy-above', type=int, default=100000,
+                        help='skip the legacy path for larger banks')
+    args = parser.parse_args()
+
+    app = make_app(args.database)
+
+    print('{:>8} {:>9} {:>12} {:>12}'.format(
+        'rows', 'previous', 'legacy ms', 'indexed ms'))
+    with app.app_context():
+        for size in args.sizes:
+            seed(size)
+            ids = [row.id for row in db.session.query(Question.id).filter(
+                Question.category == 1).limit(max(args.previous))]
+            for previous in args.previous:
+                previous_questions = ids[:previous]
+                indexed = time_per_step(
+                    Question.random_unseen, 1, previous_questions, args.repeat)
+                if size <= args.skip_legacy_above:
+                    legacy = '{:12.3f}'.format(time_per_step(
+                        legacy_select, 1, previous_questions,
+                        max(1, args.repeat // 10)))
+                else:
+                    legacy = '{:>12}'.format('-')
+                print('{:>8} {:>9} {} {:12.3f}'.format(
+                    size, previous, legacy, indexed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+'''
+Question serialization benchmark.
+
+Times a category-sized listing through the ORM path (load Question
+instances, call format() per row, json.dumps) against the column
+projection path (query(*Question.columns()), Question.format_rows,
+models.dumps) for 10k and 100k rows.
+
+Usage (from the backend folder):
+    python benchmarks/bench_serialization.py
+    python benchmarks/bench_serialization.py --sizes 10000 100000 --repeat 5
+'''
+import argparse
+import json
+import time
+
+from common import DEFAULT_DATABASE, make_app, seed
+from models import Question, db, dumps, orjson
+
+
+def orm_path():
+    questions = Question.query.order_by(Question.id).all()
+    body = json.dumps({'questions': [q.format() for q in questions]})
+    db.session.expunge_all()
+    return body
+
+
+def projection_path():
+    rows = db.session.query(*Question.columns()).order_by(Question.id).all()
+    return dumps({'questions': Question.format_rows(rows)})
+
+
+def best_of(function, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return min(timings) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--database', default=DEFAULT_DATABASE)
+    args = parser.parse_args()
+
+    app = make_app(args.database)
+
+    print('encoder: {}'.format('orjson' if orjson else 'json'))
+    print('{:>8} {:>10} {:>14} {:>8}'.format(
+        'rows', 'orm ms', 'projection ms', 'speedup'))
+    with app.app_context():
+        for size in args.sizes:
+            seed(size)
+            orm = best_of(orm_path, args.repeat)
+            projection = best_of(projection_path, args.repeat)
+            print('{:>8} {:10.1f} {:14.1f} {:7.1f}x'.format(
+                size, orm, projection, orm / projection))
+
+
+if __name__ == '__main__':
+    main()
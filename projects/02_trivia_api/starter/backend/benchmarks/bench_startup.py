@@ -0,0 +1,84 @@
+'''
+App factory startup benchmark.
+
+Boots --workers fresh Python processes in parallel, the way a pre-forking
+server without --preload does, and times import + create_app() in each,
+once with CREATE_SCHEMA=1 (create_all and index checks on every boot) and
+once with CREATE_SCHEMA=0 (schema created once by `flask init-db`, no
+database work until the first request). The first request is timed
+separately since that is where the deferred connection is now made.
+
+Usage (from the backend folder):
+    python benchmarks/bench_startup.py --workers 8
+    python benchmarks/bench_startup.py --database postgresql://postgres@localhost:5432/trivia
+'''
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+from common import DEFAULT_DATABASE, make_app
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+WORKER = """
+import json, time
+start = time.perf_counter()
+from flaskr import create_app
+imported = time.perf_counter()
+app = create_app()
+booted = time.perf_counter()
+app.test_client().get('/categories')
+served = time.perf_counter()
+print(json.dumps({'import': imported - start, 'factory': booted - imported,
+                  'first_request': served - booted}))
+"""
+
+
+def boot_workers(database, create_schema, workers):
+    env = dict(os.environ,
+               DATABASE_URL=database,
+               CREATE_SCHEMA='1' if create_schema else '0')
+    start = time.perf_counter()
+    processes = [subprocess.Popen([sys.executable, '-c', WORKER], cwd=BACKEND,
+                                  env=env, stdout=subprocess.PIPE)
+                 for _ in range(workers)]
+    results = [json.loads(process.communicate()[0]) for process in processes]
+    wall = time.perf_counter() - start
+
+    def mean_ms(key):
+        return sum(result[key] for result in results) * 1000 / len(results)
+
+    return {
+        'wall_ms': wall * 1000,
+        'import_mean_ms': mean_ms('import'),
+        'factory_mean_ms': mean_ms('factory'),
+        'first_request_mean_ms': mean_ms('first_request'),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--rounds', type=int, default=3)
+    parser.add_argument('--database', default=DEFAULT_DATABASE)
+    args = parser.parse_args()
+
+    # the explicit step: create the schema once, outside the workers
+    make_app(args.database)
+
+    print('{:<12} {:>9} {:>11} {:>15} {:>18}'.format(
+        'mode', 'wall ms', 'import ms', 'create_app ms', 'first request ms'))
+    for label, create_schema in (('create_all', True), ('explicit', False)):
+        runs = [boot_workers(args.database, create_schema, args.workers)
+                for _ in range(args.rounds)]
+        best = min(runs, key=lambda run: run['wall_ms'])
+        print('{:<12} {wall_ms:9.1f} {import_mean_ms:11.1f} '
+              '{factory_mean_ms:15.1f} {first_request_mean_ms:18.1f}'
+              .format(label, **best))
+
+
+if __name__ == '__main__':
+    main()
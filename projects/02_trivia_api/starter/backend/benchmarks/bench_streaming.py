@@ -0,0 +1,75 @@
+'''
+Streaming benchmark.
+
+Compares the peak Python memory of listing a whole category through
+GET /categories/<id>/questions as one JSON page (every row loaded and
+encoded at once) with the NDJSON stream (rows fetched in batches from a
+server-side cursor), for growing question banks.
+
+Usage (from the backend folder):
+    python benchmarks/bench_streaming.py
+    python benchmarks/bench_streaming.py --sizes 100000 1000000 --database sqlite:////tmp/bench.db
+'''
+import argparse
+import time
+import tracemalloc
+
+from common import DEFAULT_DATABASE, seed
+from flaskr import create_app
+from models import Question, db, dumps
+
+
+def whole_page(client, category_id):
+    query = db.session.query(*Question.columns()) \
+        .filter(Question.category == category_id).order_by(Question.id)
+    questions = Question.format_rows(query.all())
+    dumps({"questions": questions})
+    return len(questions)
+
+
+def stream(client, category_id):
+    response = client.get('/categories/{}/questions'.format(category_id),
+                          headers={'Accept': 'application/x-ndjson'},
+                          buffered=False)
+    lines = 0
+    for chunk in response.response:
+        lines += chunk.count(b'\n')
+    response.close()
+    return lines
+
+
+def measure(list_rows, client, category_id):
+    tracemalloc.start()
+    start = time.perf_counter()
+    rows = list_rows(client, category_id)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return rows, elapsed * 1000, peak / 2 ** 20
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[10000, 100000, 1000000])
+    parser.add_argument('--database', default=DEFAULT_DATABASE)
+    args = parser.parse_args()
+
+    app = create_app({'SQLALCHEMY_DATABASE_URI': args.database})
+    client = app.test_client()
+
+    print('{:>8} {:<8} {:>8} {:>10} {:>12}'.format(
+        'rows', 'mode', 'matches', 'ms', 'peak MiB'))
+    with app.app_context():
+        for size in args.sizes:
+            seed(size)
+            db.session.commit()
+            for mode, list_rows in (('all', whole_page), ('ndjson', stream)):
+                rows, ms, peak = measure(list_rows, client, 1)
+                db.session.remove()
+                print('{:>8} {:<8} {:>8} {:10.1f} {:12.2f}'.format(
+                    size, mode, rows, ms, peak))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,43 @@
+'''
+Shared helpers for the benchmark scripts: a bare Flask app bound to a
+throwaway database and a synthetic question bank generator.
+'''
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from models import (setup_db, Question, Category, db, question_fingerprint,
+                    refresh_category_counts)
+
+DEFAULT_DATABASE = 'sqlite:////tmp/trivia_bench.db'
+CATEGORIES = ['Science', 'Art', 'Geography', 'History', 'Entertainment', 'Sports']
+NUMBER_OF_CATEGORIES = len(CATEGORIES)
+SEED_BATCH_SIZE = 10000
+
+
+def make_app(database=DEFAULT_DATABASE):
+    app = Flask(__name__)
+    setup_db(app, database)
+    return app
+
+
+def seed(size):
+    if Category.query.count() == 0:
+        db.session.add_all([Category(type=name) for name in CATEGORIES])
+        db.session.commit()
+
+    db.session.query(Question).delete()
+    for start in range(0, size, SEED_BATCH_SIZE):
+        rows = [{
+            'question': 'Synthetic question {}?'.format(i),
+            'answer': 'Answer {}'.format(i),
+            'category': i % NUMBER_OF_CATEGORIES + 1,
+            'difficulty': i % 5 + 1,
+            'fingerprint': question_fingerprint('Synthetic question {}?'.format(i)),
+        } for i in range(start, min(size, start + SEED_BATCH_SIZE))]
+        db.session.execute(Question.__table__.insert(), rows)
+    db.session.commit()
+    # the rows went in past the counters, and the quiz totals come from them
+    refresh_category_counts()
@@ -0,0 +1,323 @@
+'''
+Trivia API load test.
+
+Seeds a synthetic question bank of the given size, then drives every route
+registered by create_app() with concurrent in-process clients and records,
+per route: latency percentiles (p50/p95/p99), throughput, error count and
+SQL statements per request. The report is written as JSON; passing a
+previous report with --baseline fails the run when a route's p95 latency
+or queries per request regress beyond --tolerance.
+
+Usage (from the backend folder):
+    python benchmarks/load_test.py --size 10000
+    python benchmarks/load_test.py --size 100000 --clients 16 --requests 200 \
+        --report report.json --baseline previous.json
+    python benchmarks/load_test.py --database postgresql://localhost/trivia_bench
+'''
+import argparse
+import itertools
+import json
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import event
+
+from common import DEFAULT_DATABASE, NUMBER_OF_CATEGORIES, seed
+from flaskr import create_app, encode_cursor
+from models import Question, db
+
+SEARCH_TERMS = ['question', 'Synthetic', '42', '999', 'question 1']
+# questions per bulk-update / bulk-delete request
+BULK_SIZE = 50
+
+
+'''
+Scenarios: one per route, each a function (client, state) that sends one
+request and returns the response. state holds the seeded id range, a
+lock-protected iterator of ids for the DELETE scenarios and the quiz
+sessions started by the POST /quizzes/sessions scenario, which the session
+play and DELETE scenarios then use.
+'''
+def list_questions_by_page(client, state):
+    page = random.randint(1, max(1, state['size'] // 10))
+    return client.get('/questions?page={}'.format(page))
+
+
+def list_questions_by_cursor(client, state):
+    after = random.randint(0, max(0, state['max_id'] - 10))
+    return client.get('/questions?after={}'.format(encode_cursor(after)))
+
+
+def list_categories(client, state):
+    return client.get('/categories')
+
+
+def list_category_questions(client, state):
+    category_id = random.randint(1, NUMBER_OF_CATEGORIES)
+    return client.get('/categories/{}/questions'.format(category_id))
+
+
+def search_questions(client, state):
+    return client.post('/questions',
+                       json={'searchTerm': random.choice(SEARCH_TERMS)})
+
+
+def play_quiz(client, state):
+    previous_questions = random.sample(
+        range(state['min_id'], state['max_id'] + 1),
+        min(20, state['size']))
+    category_id = random.randint(-1, NUMBER_OF_CATEGORIES - 1)
+    return client.post('/quizzes', json={
+        'previous_questions': previous_questions,
+        'quiz_category': {'id': category_id},
+    })
+
+
+def start_quiz_session(client, state):
+    response = client.post('/quizzes/sessions', json={
+        'quiz_category': {'id': random.randint(-1, NUMBER_OF_CATEGORIES - 1)},
+    })
+    if response.status_code == 200:
+        with state['lock']:
+            state['sessions'].append(response.get_json()['session_id'])
+    return response
+
+
+def session_id(client, state, remove=False):
+    with state['lock']:
+        if state['sessions']:
+            if remove:
+                return state['sessions'].pop()
+            return random.choice(state['sessions'])
+    # only when the POST /quizzes/sessions scenario did not run first: the
+    # session is started inside the timed request
+    start_quiz_session(client, state)
+    return session_id(client, state, remove)
+
+
+def play_quiz_session(client, state):
+    return client.post('/quizzes', json={
+        'session_id': session_id(client, state),
+        'last_answer_correct': random.random() < 0.5,
+    })
+
+
+def end_quiz_session(client, state):
+    return client.delete(
+        '/quizzes/sessions/{}'.format(session_id(client, state, remove=True)))
+
+
+def post_question(client, state):
+    return client.post('/post/questions', json={
+        'question': 'Load test question {}?'.format(next(state['serial'])),
+        'answer': 'Load test answer',
+        'category': random.randint(0, NUMBER_OF_CATEGORIES - 1),
+        'difficulty': random.randint(1, 5),
+    })
+
+
+def import_questions(client, state):
+    batch = next(state['serial'])
+    body = '\n'.join(json.dumps({
+        'question': 'Imported load test question {}.{}?'.format(batch, i),
+        'answer': 'Answer',
+        'category': random.randint(1, NUMBER_OF_CATEGORIES),
+        'difficulty': random.randint(1, 5),
+    }) for i in range(100))
+    return client.post('/questions/import', data=body,
+                       content_type='application/x-ndjson')
+
+
+def bulk_update_questions(client, state):
+    ids = random.sample(range(state['min_id'], state['max_id'] + 1),
+                        min(BULK_SIZE, state['size']))
+    return client.post('/questions/bulk-update', json={
+        'ids': ids,
+        'set': {'difficulty': random.randint(1, 5)},
+    })
+
+
+def delete_question(client, state):
+    with state['lock']:
+        question_id = next(state['deletable'])
+    return client.delete('/questions/{}'.format(question_id))
+
+
+def bulk_delete_questions(client, state):
+    with state['lock']:
+        ids = list(itertools.islice(state['deletable'], BULK_SIZE))
+    return client.post('/questions/bulk-delete', json={'ids': ids})
+
+
+def read_metrics(client, state):
+    return client.get('/metrics')
+
+
+SCENARIOS = {
+    'GET /questions?page': list_questions_by_page,
+    'GET /questions?after': list_questions_by_cursor,
+    'GET /categories': list_categories,
+    'GET /categories/<id>/questions': list_category_questions,
+    'POST /questions (search)': search_questions,
+    'POST /quizzes': play_quiz,
+    'POST /quizzes/sessions': start_quiz_session,
+    'POST /quizzes (session)': play_quiz_session,
+    'DELETE /quizzes/sessions/<id>': end_quiz_session,
+    'POST /post/questions': post_question,
+    'POST /questions/import': import_questions,
+    'POST /questions/bulk-update': bulk_update_questions,
+    'DELETE /questions/<id>': delete_question,
+    'POST /questions/bulk-delete': bulk_delete_questions,
+    'GET /metrics': read_metrics,
+}
+
+
+class QueryCounter:
+
+    def __init__(self, engine):
+        self._local = threading.local()
+        event.listen(engine, 'before_cursor_execute', self._count)
+
+    def _count(self, *args):
+        self._local.count = getattr(self._local, 'count', 0) + 1
+
+    def reset(self):
+        self._local.count = 0
+
+    @property
+    def count(self):
+        return getattr(self._local, 'count', 0)
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1,
+                max(0, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def run_scenario(app, scenario, state, counter, clients, requests):
+    latencies = []
+    queries = []
+    errors = [0]
+    record = threading.Lock()
+
+    def worker(number_of_requests):
+        client = app.test_client()
+        with app.app_context():
+            for _ in range(number_of_requests):
+                counter.reset()
+                start = time.perf_counter()
+                response = scenario(client, state)
+                elapsed = time.perf_counter() - start
+                with record:
+                    latencies.append(elapsed * 1000)
+                    queries.append(counter.count)
+                    if response.status_code >= 400:
+                        errors[0] += 1
+            db.session.remove()
+
+    share = [requests // clients + (1 if i < requests % clients else 0)
+             for i in range(clients)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        list(pool.map(worker, share))
+    wall = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'errors': errors[0],
+        'throughput_rps': round(len(latencies) / wall, 1),
+        'mean_ms': round(sum(latencies) / len(latencies), 3),
+        'p50_ms': round(percentile(latencies, 0.50), 3),
+        'p95_ms': round(percentile(latencies, 0.95), 3),
+        'p99_ms': round(percentile(latencies, 0.99), 3),
+        'queries_per_request': round(sum(queries) / len(queries), 2),
+    }
+
+
+def find_regressions(report, baseline, tolerance):
+    regressions = []
+    for route, result in report['routes'].items():
+        previous = baseline.get('routes', {}).get(route)
+        if previous is None:
+            continue
+        for metric in ('p95_ms', 'queries_per_request'):
+            if result[metric] > previous[metric] * (1 + tolerance) and \
+                    result[metric] - previous[metric] > 0.5:
+                regressions.append('{} {}: {} -> {}'.format(
+                    route, metric, previous[metric], result[metric]))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--size', type=int, default=10000,
+                        help='number of synthetic questions (e.g. 10000, 100000, 1000000)')
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=200,
+                        help='requests per route')
+    parser.add_argument('--routes', nargs='+', choices=sorted(SCENARIOS),
+                        default=list(SCENARIOS), metavar='ROUTE')
+    parser.add_argument('--database', default=DEFAULT_DATABASE)
+    parser.add_argument('--report', default='load_test_report.json')
+    parser.add_argument('--baseline', help='previous report to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='allowed relative regression (0.2 = 20%%)')
+    args = parser.parse_args()
+
+    app = create_app({'SQLALCHEMY_DATABASE_URI': args.database})
+
+    with app.app_context():
+        seed(args.size)
+        min_id, max_id = db.session.query(
+            db.func.min(Question.id), db.func.max(Question.id)).one()
+        counter = QueryCounter(db.engine)
+
+    state = {
+        'size': args.size,
+        'min_id': min_id,
+        'max_id': max_id,
+        'lock': threading.Lock(),
+        # unique question texts, so the writes are not rejected as duplicates
+        'serial': itertools.count(),
+        'deletable': iter(range(max_id, min_id - 1, -1)),
+        'sessions': [],
+    }
+
+    report = {
+        'size': args.size,
+        'clients': args.clients,
+        'database': app.config['SQLALCHEMY_DATABASE_URI'].split('://')[0],
+        'routes': {},
+    }
+    print('{:<32} {:>8} {:>8} {:>8} {:>9} {:>8} {:>7}'.format(
+        'route', 'p50 ms', 'p95 ms', 'p99 ms', 'req/s', 'queries', 'errors'))
+    for route in args.routes:
+        result = run_scenario(app, SCENARIOS[route], state, counter,
+                              args.clients, args.requests)
+        report['routes'][route] = result
+        print('{:<32} {p50_ms:8.2f} {p95_ms:8.2f} {p99_ms:8.2f} '
+              '{throughput_rps:9.1f} {queries_per_request:8.2f} {errors:7d}'
+              .format(route, **result))
+
+    with open(args.report, 'w') as f:
+        json.dump(report, f, indent=2)
+    print('report written to {}'.format(args.report))
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = find_regressions(report, json.load(f), args.tolerance)
+        for regression in regressions:
+            print('REGRESSION ' + regression)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,199 @@
+'''
+Bulk delete and update of questions.
+
+A batch names its questions by a list of ids, a filter on category and
+difficulty (e.g. {"category": 3, "difficulty": {"lt": 2}}), or both. The
+matching rows are locked and read once (ids and categories only), then
+changed with set-based DELETE / UPDATE ... WHERE id IN (...) statements,
+all in a single transaction. The questions change counter, the category
+counts and the quiz decks are updated once per batch, not once per row.
+'''
+import operator
+from collections import Counter
+
+from models import db, Question, bump_table_version, adjust_category_counts
+from cache import category_cache
+from quiz import queue_deck_changes, MIN_DIFFICULTY, MAX_DIFFICULTY
+
+# stays below the bind parameter limit of every supported database
+ID_CHUNK_SIZE = 500
+COMPARISONS = {
+    'eq': operator.eq,
+    'lt': operator.lt,
+    'lte': operator.le,
+    'gt': operator.gt,
+    'gte': operator.ge,
+}
+UPDATABLE = ('category', 'difficulty')
+
+
+class BulkError(ValueError):
+    pass
+
+
+def _integer(value, name):
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise BulkError('{} must be an integer'.format(name))
+    return value
+
+
+def _conditions(column, name, value):
+    if not isinstance(value, dict):
+        return [column == _integer(value, name)]
+    if not value:
+        raise BulkError('empty comparison for {}'.format(name))
+    conditions = []
+    for op, operand in value.items():
+        if op not in COMPARISONS:
+            raise BulkError('unknown comparison {} for {}'.format(op, name))
+        conditions.append(COMPARISONS[op](column, _integer(operand, name)))
+    return conditions
+
+
+'''
+selection(ids, where)
+    returns (conditions, ids) for a batch: the SQL conditions of where and
+    the sorted, distinct ids, or None when the batch has no id list. The
+    ids are kept out of the conditions so that they can be locked in
+    ID_CHUNK_SIZE chunks. At least one of ids and where is required, so a
+    malformed request can never match the whole table.
+'''
+def selection(ids=None, where=None):
+    conditions = []
+    if ids is not None:
+        if not isinstance(ids, list) or not ids:
+            raise BulkError('ids must be a non-empty list')
+        ids = sorted(set(_integer(question_id, 'id') for question_id in ids))
+    if where is not None:
+        if not isinstance(where, dict) or not where:
+            raise BulkError('where must be a non-empty object')
+        for name, value in where.items():
+            if name not in UPDATABLE:
+                raise BulkError('cannot filter on {}'.format(name))
+            conditions.extend(
+                _conditions(getattr(Question, name), name, value))
+    if not conditions and ids is None:
+        raise BulkError('ids or where is required')
+    return conditions, ids
+
+
+'''
+validate_values(values)
+    returns the column values of a bulk update or raises BulkError.
+'''
+def validate_values(values):
+    if not isinstance(values, dict) or not values:
+        raise BulkError('set must be a non-empty object')
+    for name in values:
+        if name not in UPDATABLE:
+            raise BulkError('cannot update {}'.format(name))
+    if 'category' in values:
+        category = _integer(values['category'], 'category')
+        if category_cache.get_type(category) is None:
+            raise BulkError('unknown category {}'.format(category))
+    if 'difficulty' in values:
+        difficulty = _integer(values['difficulty'], 'difficulty')
+        if not MIN_DIFFICULTY <= difficulty <= MAX_DIFFICULTY:
+            raise BulkError('difficulty must be between {} and {}'.format(
+                MIN_DIFFICULTY, MAX_DIFFICULTY))
+    return dict(values)
+
+
+def _category_of(value):
+    return None if value is None else int(value)
+
+
+def _locked_rows(conditions, ids):
+    if not conditions and ids is None:
+        raise BulkError('ids or conditions are required')
+    query = db.session.query(Question.id, Question.category).filter(*conditions)
+    if ids is None:
+        return query.with_for_update().all()
+    # in id order, as the DELETE / UPDATE chunks
+    rows = []
+    for chunk in _chunks(ids):
+        rows.extend(query.filter(Question.id.in_(chunk))
+                    .order_by(Question.id).with_for_update().all())
+    return rows
+
+
+def _chunks(ids):
+    for start in range(0, len(ids), ID_CHUNK_SIZE):
+        yield ids[start:start + ID_CHUNK_SIZE]
+
+
+def _finish(connection, deltas, deck_changes):
+    bump_table_version(connection, 'questions')
+    adjust_category_counts(connection, deltas)
+    queue_deck_changes(db.session, deck_changes)
+    db.session.commit()
+
+
+'''
+delete_questions(conditions, ids=None)
+    deletes the questions matching the conditions (and, when given, one of
+    the ids) and returns how many were deleted.
+'''
+def delete_questions(conditions, ids=None):
+    try:
+        rows = _locked_rows(conditions, ids)
+        if not rows:
+            db.session.rollback()
+            return 0
+
+        table = Question.__table__
+        connection = db.session.connection()
+        ids = [question_id for question_id, _ in rows]
+        for chunk in _chunks(ids):
+            connection.execute(table.delete().where(table.c.id.in_(chunk)))
+
+        deltas = Counter()
+        deck_changes = []
+        for question_id, category in rows:
+            if category is not None:
+                deltas[_category_of(category)] -= 1
+                deck_changes.append(
+                    (question_id, _category_of(category), None))
+        _finish(connection, deltas, deck_changes)
+        return len(rows)
+    except Exception:
+        db.session.rollback()
+        raise
+
+
+'''
+update_questions(conditions, values, ids=None)
+    sets the validated values on the questions matching the conditions
+    (and, when given, one of the ids) and returns how many were updated.
+'''
+def update_questions(conditions, values, ids=None):
+    try:
+        rows = _locked_rows(conditions, ids)
+        if not rows:
+            db.session.rollback()
+            return 0
+
+        table = Question.__table__
+        connection = db.session.connection()
+        ids = [question_id for question_id, _ in rows]
+        for chunk in _chunks(ids):
+            connection.execute(
+                table.update().where(table.c.id.in_(chunk)).values(values))
+
+        deltas = Counter()
+        deck_changes = []
+        if 'category' in values:
+            new = values['category']
+            for question_id, category in rows:
+                old = _category_of(category)
+                if old == new:
+                    continue
+                if old is not None:
+                    deltas[old] -= 1
+                deltas[new] += 1
+                deck_changes.append((question_id, old, new))
+        _finish(connection, deltas, deck_changes)
+        return len(rows)
+    except Exception:
+        db.session.rollback()
+        raise
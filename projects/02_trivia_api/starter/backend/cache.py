@@ -0,0 +1,103 @@
+'''
+Process-local cache of the categories table.
+
+Categories almost never change, so the listing endpoints read them from
+memory instead of querying the table on every request. The cache carries a
+version that is bumped whenever a session that wrote a Category commits
+(see the listeners at the bottom); the next read after a bump reloads the
+table once. Writes that bypass the ORM (raw SQL, another process) should
+call category_cache.invalidate(). Pointing the app at another database
+(setup_db with a new path) also triggers a reload.
+'''
+import threading
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+
+from models import db, Category
+
+
+class CategoryCache:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = 0
+        self._loaded_version = None
+        self._loaded_engine = None
+        self._categories = []
+        self._types = {}
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def version(self):
+        return self._version
+
+    def invalidate(self):
+        with self._lock:
+            self._version += 1
+
+    def _is_fresh(self, engine):
+        return (self._loaded_version == self._version
+                and self._loaded_engine is engine)
+
+    def _current(self):
+        engine = db.engine
+        if self._is_fresh(engine):
+            self.hits += 1
+            return self._categories, self._types
+
+        with self._lock:
+            if not self._is_fresh(engine):
+                self.misses += 1
+                version = self._version
+                categories = db.session.query(Category.id, Category.type) \
+                    .order_by(Category.id).all()
+                self._categories = [(row.id, row.type) for row in categories]
+                self._types = dict(self._categories)
+                self._loaded_version = version
+                self._loaded_engine = engine
+            else:
+                self.hits += 1
+            return self._categories, self._types
+
+    '''
+    categories()
+        returns the (id, type) pairs of every category ordered by id.
+    '''
+    def categories(self):
+        return self._current()[0]
+
+    '''
+    types()
+        returns the id -> type dict of every category.
+    '''
+    def types(self):
+        return self._current()[1]
+
+    def get_type(self, category_id):
+        return self.types().get(category_id)
+
+
+category_cache = CategoryCache()
+
+
+def _mark_categories_changed(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+        session.info['categories_changed'] = True
+
+
+for _event_name in ('after_insert', 'after_update', 'after_delete'):
+    event.listen(Category, _event_name, _mark_categories_changed)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_on_commit(session):
+    if session.info.pop('categories_changed', False):
+        category_cache.invalidate()
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _forget_on_rollback(session, previous_transaction):
+    session.info.pop('categories_changed', None)
@@ -0,0 +1,49 @@
+'''
+Offline duplicate collapse.
+
+Questions stored before the fingerprint column existed have no
+fingerprint, and banks imported before duplicate detection may hold the
+same question many times. models.backfill_fingerprints() fills the missing
+fingerprints in keyset batches, then collapse_duplicates() keeps the oldest
+question of every fingerprint and deletes the others, a batch of
+fingerprints at a time, through bulk.delete_questions so the change
+counter, category counts and quiz decks are updated once per batch.
+Available as `flask dedup-questions`.
+'''
+from sqlalchemy import func
+
+from models import db, Question
+import bulk
+
+# a collapse batch binds two lists of this size, which keeps it below
+# SQLite's default limit of 999 parameters
+BATCH_SIZE = 250
+
+
+'''
+collapse_duplicates(batch_size, dry_run)
+    deletes every question whose fingerprint an older question already has
+    and returns (duplicate groups, questions deleted). With dry_run nothing
+    is deleted and the second number is how many would be.
+'''
+def collapse_duplicates(batch_size=BATCH_SIZE, dry_run=False):
+    # fingerprint -> id of the question to keep; only duplicated
+    # fingerprints are loaded, in one GROUP BY pass
+    groups = db.session.query(Question.fingerprint, func.min(Question.id)) \
+        .filter(Question.fingerprint.isnot(None)) \
+        .group_by(Question.fingerprint) \
+        .having(func.count(Question.id) > 1) \
+        .all()
+    db.session.commit()
+
+    deleted = 0
+    for start in range(0, len(groups), batch_size):
+        keep = dict(groups[start:start + batch_size])
+        conditions = [Question.fingerprint.in_(list(keep)),
+                      ~Question.id.in_(list(keep.values()))]
+        if dry_run:
+            deleted += db.session.query(func.count(Question.id)) \
+                .filter(*conditions).scalar()
+        else:
+            deleted += bulk.delete_questions(conditions)
+    return len(groups), deleted
@@ -1,19 +1,180 @@
 import os
-from flask import Flask, request, abort, jsonify
+from flask import (Flask, request, abort, jsonify, Response, make_response,
+                   stream_with_context)
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
-import random
-
-from models import setup_db, Question, Category, db
+import base64
+import functools
+import time
+import zlib
+
+from models import (setup_db, create_schema, database_path, Question,
+                    db, get_table_versions, get_category_counts,
+                    refresh_category_counts, dumps, question_fingerprint,
+                    backfill_fingerprints)
+import search
+from cache import category_cache
+from instrumentation import request_metrics
+import importer
+import bulk
+import dedup
+from quiz import (quiz_sessions, next_difficulty, pick_adaptive,
+                  MIN_DIFFICULTY, MAX_DIFFICULTY)
+import click
 
 QUESTIONS_PER_PAGE = 10
+MAX_QUESTIONS_PER_PAGE = 100
+NDJSON_MIMETYPE = 'application/x-ndjson'
+STREAM_BATCH_SIZE = 1000
+
+
+'''
+encode_cursor(question_id) / decode_cursor(token)
+    opaque keyset cursor used by GET /questions?after=<token>.
+    An empty token starts from the first question.
+'''
+def encode_cursor(question_id):
+    raw = "q:{}".format(question_id).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(token):
+    if token == "":
+        return 0
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        raw = base64.urlsafe_b64decode(padded.encode()).decode()
+        prefix, question_id = raw.split(":", 1)
+        question_id = int(question_id)
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError("invalid cursor: {}".format(token))
+    if prefix != "q" or question_id < 0:
+        raise ValueError("invalid cursor: {}".format(token))
+    return question_id
+
+
+'''
+json_response(obj)
+    jsonify() for the large listing responses: encodes with models.dumps
+    (orjson when installed) and skips jsonify's key sorting. The encoding
+    time is recorded in the request metrics.
+'''
+def json_response(obj, status=200):
+    started = time.perf_counter()
+    body = dumps(obj)
+    request_metrics.record_serialization(time.perf_counter() - started)
+    return Response(body, status=status, mimetype='application/json')
+
+
+'''
+page_and_limit(args)
+    reads the page and limit parameters of a listing from a mapping (query
+    string or JSON body). limit defaults to QUESTIONS_PER_PAGE and is capped
+    at MAX_QUESTIONS_PER_PAGE.
+'''
+def page_and_limit(args):
+    page = int(args.get('page', 1))
+    limit = int(args.get('limit', QUESTIONS_PER_PAGE))
+    if page < 1 or not 1 <= limit <= MAX_QUESTIONS_PER_PAGE:
+        raise ValueError("page or limit out of range")
+    return page, limit
+
+
+'''
+wants_ndjson() / ndjson_response(query)
+    a listing asked for with "Accept: application/x-ndjson" is streamed one
+    question per line instead of paginated. Rows are fetched in batches of
+    STREAM_BATCH_SIZE from a server-side cursor (a named cursor on
+    Postgres), so memory use does not grow with the number of matches.
+'''
+def wants_ndjson():
+    best = request.accept_mimetypes.best_match(
+        ['application/json', NDJSON_MIMETYPE])
+    return best == NDJSON_MIMETYPE
+
+
+def ndjson_response(query):
+    rows = query.execution_options(stream_results=True) \
+        .yield_per(STREAM_BATCH_SIZE)
+    fields = Question.FIELDS
+
+    def generate():
+        for row in rows:
+            yield dumps(dict(zip(fields, row))) + b'\n'
+
+    return Response(stream_with_context(generate()), mimetype=NDJSON_MIMETYPE)
+
+
+'''
+quiz_category_id(category) / quiz_difficulty(value) / quiz_answer(value)
+    validate the POST /quizzes fields, raising ValueError (or TypeError /
+    KeyError for malformed objects). quiz_category id -1 means every
+    category; the other ids are 0-based indexes into the category list.
+'''
+def quiz_category_id(category):
+    if category is None or category is {} or category['id'] is None:
+        raise ValueError("missing quiz_category")
+    if int(category['id']) == -1:
+        return None
+    return int(category['id']) + 1
+
+
+def quiz_difficulty(value):
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise ValueError("difficulty must be an integer")
+    if not MIN_DIFFICULTY <= value <= MAX_DIFFICULTY:
+        raise ValueError("difficulty out of range")
+    return value
+
+
+def quiz_answer(value):
+    if value is not None and not isinstance(value, bool):
+        raise ValueError("last_answer_correct must be a boolean")
+    return value
+
+
+'''
+conditional(*tables)
+    decorates a GET view whose response depends only on the request URL and
+    the given tables. The ETag is built from the tables' change counters, so
+    a matching If-None-Match is answered with 304 before the view runs.
+'''
+def conditional(*tables):
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            versions = get_table_versions(tables)
+            etag = "{}-{:08x}".format(
+                ".".join(str(versions[table]) for table in tables),
+                zlib.crc32("{} {}".format(
+                    request.full_path, wants_ndjson()).encode()))
+
+            if request.if_none_match.contains_weak(etag):
+                response = Response(status=304)
+                response.set_etag(etag)
+                return response
+
+            response = make_response(view(*args, **kwargs))
+            if response.status_code == 200:
+                response.set_etag(etag)
+                response.vary.add('Accept')
+            return response
+        return wrapper
+    return decorator
+
 
 def create_app(test_config=None):
     # create and configure the app
     app = Flask(__name__)
-    setup_db(app)
+    if test_config is None:
+        setup_db(app)
+    else:
+        app.config.from_mapping(test_config)
+        setup_db(app, test_config.get(
+            'SQLALCHEMY_DATABASE_URI', database_path))
 
     CORS(app, resources={r'*': {"origins": "*"}})
+    request_metrics.init_app(app)
 
     @app.after_request
     def after_request(response):
@@ -37,41 +198,53 @@ def create_app(test_config=None):
   '''
 
     @app.route('/questions', methods=['GET'])
+    @conditional('questions', 'categories')
     def index():
         try:
-            page = request.args.get('page', 1, type=int)
-            Questionlist = Question.query.paginate(
-                page, QUESTIONS_PER_PAGE, False).items
-            Question_page = Question.query.paginate(
-                page, QUESTIONS_PER_PAGE, False).pages
+            after = request.args.get('after')
+
+            if after is not None:
+                try:
+                    after_id = decode_cursor(after)
+                except ValueError:
+                    return Bad_Request(400)
 
-            listOfQuestions = []
+                listOfQuestions, total, has_more = Question.keyset_page(
+                    after_id, QUESTIONS_PER_PAGE)
 
-            for question in Questionlist:
-                listOfQuestions.append(question.format())
+                if len(listOfQuestions) == 0:
+                    return not_found(404)
+            else:
+                page = request.args.get('page', 1, type=int)
+                Question_page = db.session.query(*Question.columns()) \
+                    .order_by(Question.id) \
+                    .paginate(page, QUESTIONS_PER_PAGE, False)
 
-            total = Question_page * QUESTIONS_PER_PAGE
+                listOfQuestions = Question.format_rows(Question_page.items)
+                total = Question_page.total
+                has_more = Question_page.has_next
 
-            if total == 0:
-                return not_found(404)
+                if total == 0:
+                    return not_found(404)
 
-            if (not (page <= Question_page)):
-                return not_found(404)
+                if (not (page <= Question_page.pages)):
+                    return not_found(404)
 
-            categories_id = {}
-            categories = Category.query.all()
+            next_cursor = None
+            if has_more:
+                next_cursor = encode_cursor(listOfQuestions[-1]['id'])
 
-            for category in categories:
-                categories_id[category.id] = category.type
+            categories_id = category_cache.types()
 
             response_object = {
                 "success": True,
                 "questions": listOfQuestions,
                 "total_questions": total,
+                "next_cursor": next_cursor,
                 "categories": categories_id,
                 "current_category": None
             }
-            return jsonify(response_object)
+            return json_response(response_object)
         except:
             return unprocessable(422)
 
@@ -104,6 +277,41 @@ def create_app(test_config=None):
             db.session.close()
             return unprocessable(422)
 
+    '''
+  POST /questions/bulk-delete and POST /questions/bulk-update change every
+  question named by "ids" and / or matched by "where" in one transaction.
+  '''
+    @app.route('/questions/bulk-delete', methods=['POST'])
+    def bulk_delete_questions():
+        try:
+            request_data = request.get_json()
+            try:
+                conditions, ids = bulk.selection(
+                    request_data.get('ids'), request_data.get('where'))
+            except (bulk.BulkError, AttributeError):
+                return Bad_Request(400)
+
+            deleted = bulk.delete_questions(conditions, ids)
+            return jsonify({"success": True, "deleted": deleted})
+        except:
+            return unprocessable(422)
+
+    @app.route('/questions/bulk-update', methods=['POST'])
+    def bulk_update_questions():
+        try:
+            request_data = request.get_json()
+            try:
+                conditions, ids = bulk.selection(
+                    request_data.get('ids'), request_data.get('where'))
+                values = bulk.validate_values(request_data.get('set'))
+            except (bulk.BulkError, AttributeError):
+                return Bad_Request(400)
+
+            updated = bulk.update_questions(conditions, values, ids)
+            return jsonify({"success": True, "updated": updated})
+        except:
+            return unprocessable(422)
+
     '''
   @TODO: 
   Create an endpoint to POST a new question, 
@@ -115,17 +323,23 @@ def create_app(test_config=None):
   of the questions list in the "List" tab.  
   '''
     @app.route('/categories')
+    @conditional('categories', 'questions')
     def get_categories():
         try:
-            categories = Category.query.order_by(Category.id).all()
+            categories = category_cache.categories()
+            counts = get_category_counts()
 
             categoriesList = [
-                category.type for category in categories]
+                category_type for _, category_type in categories]
+            question_counts = {
+                category_id: counts.get(category_id, 0)
+                for category_id, _ in categories}
 
             response_object = {
                 "success": True,
                 "categories": categoriesList,
-                "number_of_categories": len(categoriesList)
+                "number_of_categories": len(categoriesList),
+                "question_counts": question_counts
             }
             return jsonify(response_object)
         except:
@@ -141,6 +355,17 @@ def create_app(test_config=None):
             category = request_data['category']
             difficulty = request_data['difficulty']
 
+            fingerprint = question_fingerprint(question)
+            duplicate_of = Question.existing_fingerprints(
+                [fingerprint]).get(fingerprint)
+            if duplicate_of is not None:
+                return jsonify({
+                    "success": False,
+                    "error": 409,
+                    "message": "Duplicate question",
+                    "duplicate_of": duplicate_of
+                }), 409
+
             try:
                 question_model = Question(
                     question=question,
@@ -166,6 +391,86 @@ def create_app(test_config=None):
         except:
             return Bad_Request(400)
 
+    '''
+  POST /questions/import streams an NDJSON (default) or CSV (text/csv)
+  request body into the questions table in batches.
+  '''
+    @app.route('/questions/import', methods=['POST'])
+    def import_questions():
+        try:
+            batch_size = request.args.get(
+                'batch_size', importer.BATCH_SIZE, type=int)
+            if batch_size < 1:
+                return Bad_Request(400)
+
+            if request.mimetype == 'text/csv':
+                rows = importer.iter_csv(request.stream)
+            else:
+                rows = importer.iter_ndjson(request.stream)
+
+            result = importer.import_questions(rows, batch_size)
+
+            response_object = {"success": True}
+            response_object.update(result.format())
+            return jsonify(response_object)
+        except:
+            db.session.rollback()
+            return unprocessable(422)
+
+    @app.cli.command('init-db')
+    def init_db_command():
+        """Create the tables, indexes and search index."""
+        create_schema()
+        search.ensure_search_index(db.engine)
+        click.echo("database schema is up to date")
+
+    @app.cli.command('refresh-counts')
+    def refresh_counts_command():
+        """Recompute the per-category question counts from the questions."""
+        refresh_category_counts()
+        click.echo("category counts refreshed")
+
+    @app.cli.command('dedup-questions')
+    @click.option('--batch-size', default=dedup.BATCH_SIZE, show_default=True)
+    @click.option('--dry-run', is_flag=True,
+                  help='Report the duplicates without deleting them.')
+    def dedup_questions_command(batch_size, dry_run):
+        """Fingerprint old questions and delete their duplicates."""
+        filled = backfill_fingerprints(batch_size)
+        groups, deleted = dedup.collapse_duplicates(batch_size, dry_run)
+        click.echo("{} fingerprints filled, {} duplicated questions, "
+                   "{} copies {}".format(filled, groups, deleted,
+                                         "found" if dry_run else "deleted"))
+
+    @app.cli.command('import-questions')
+    @click.argument('path', type=click.Path(exists=True, dir_okay=False))
+    @click.option('--format', 'file_format',
+                  type=click.Choice(['ndjson', 'csv']), default=None,
+                  help='Defaults to csv for .csv files, ndjson otherwise.')
+    @click.option('--batch-size', default=importer.BATCH_SIZE, show_default=True)
+    def import_questions_command(path, file_format, batch_size):
+        """Bulk import questions from an NDJSON or CSV file."""
+        if file_format is None:
+            file_format = 'csv' if path.endswith('.csv') else 'ndjson'
+
+        def report(stats):
+            click.echo("batch: {rows} rows in {seconds}s "
+                       "({rows_per_second} rows/s)".format(**stats))
+
+        with open(path, newline='', encoding='utf-8') as lines:
+            if file_format == 'csv':
+                rows = importer.iter_csv(lines)
+            else:
+                rows = importer.iter_ndjson(lines)
+            result = importer.import_questions(rows, batch_size, report)
+
+        summary = result.format()
+        click.echo("inserted {inserted}, rejected {rejected}, "
+                   "duplicates {duplicates} in {seconds}s "
+                   "({rows_per_second} rows/s)".format(**summary))
+        for error in summary['errors']:
+            click.echo("line {line}: {error}".format(**error), err=True)
+
     '''
   @TODO: 
   Create a POST endpoint to get questions based on a search term. 
@@ -183,25 +488,29 @@ def create_app(test_config=None):
             request_data = request.get_json()
 
             search_term = request_data['searchTerm']
+            try:
+                page, limit = page_and_limit(request_data)
+            except (ValueError, TypeError):
+                return Bad_Request(400)
 
-            search_results = Question.query.filter(
-                Question.question.ilike(f"%{search_term}%")).all()
+            if wants_ndjson():
+                return ndjson_response(search.search_query(search_term))
 
-            if len(search_results) == 0:
-                return not_found(404)
+            listOfResults, total = search.search_questions(
+                search_term, page, limit)
 
-            listOfResults = [question.format()
-                             for question in search_results]
+            if len(listOfResults) == 0:
+                return not_found(404)
 
             response_object = {
                 "success": True,
                 "questions": listOfResults,
                 "current_category": None,
-                "total_questions": len(listOfResults)
+                "total_questions": total
             }
-            return jsonify(response_object)
+            return json_response(response_object)
         except:
-            unprocessable(422)
+            return unprocessable(422)
 
     '''
   @TODO: 
@@ -212,30 +521,42 @@ def create_app(test_config=None):
   category to be shown. 
   '''
     @app.route('/categories/<int:category_id>/questions')
+    @conditional('questions', 'categories')
     def get_questions_by_category(category_id):
         try:
+            page, limit = page_and_limit(request.args)
+        except ValueError:
+            return Bad_Request(400)
 
-            category = Category.query.get(category_id)
+        category_type = category_cache.get_type(category_id)
 
-            if category is None:
-                return not_found(404)
+        if category_type is None:
+            return not_found(404)
 
-            category = category.format()
+        query = db.session.query(*Question.columns()) \
+            .filter(Question.category == category_id) \
+            .order_by(Question.id)
 
-            questions = Question.query.filter(
-                Question.category == category_id).all()
+        # the stream outlives this function: its session is released by
+        # the app context teardown once the last row was sent
+        if wants_ndjson():
+            return ndjson_response(query)
+
+        try:
+            questions = query.limit(limit).offset((page - 1) * limit).all()
+            total = get_category_counts().get(category_id, 0)
 
-            questions_category = [
-                question.format() for question in questions]
+            if len(questions) == 0 and page > 1:
+                return not_found(404)
 
             response_object = {
                 "success": True,
-                "questions": questions_category,
-                "total_questions": len(questions_category),
-                "current_category": category['type']
+                "questions": Question.format_rows(questions),
+                "total_questions": total,
+                "current_category": category_type
             }
 
-            return jsonify(response_object)
+            return json_response(response_object)
 
         except:
             db.session.rollback()
@@ -255,50 +576,145 @@ def create_app(test_config=None):
   one question at a time is displayed, the user is allowed to answer
   and shown whether they were correct or not. 
   '''
+    def quiz_total(category_id):
+        counts = get_category_counts()
+        if category_id is None:
+            return sum(counts.values())
+        return counts.get(category_id, 0)
+
+    def next_quiz_question(category_id, previous_questions, difficulty=None):
+        total = quiz_total(category_id)
+
+        # an empty category: no need to look at the rows. A non-empty one
+        # is always looked up, as previous_questions may hold stale or
+        # foreign ids and the counts can lag behind raw SQL writes
+        next_question = None
+        if total > 0:
+            if difficulty is None:
+                next_question = Question.random_unseen(
+                    category_id, previous_questions,
+                    unseen=total - len(set(previous_questions)))
+            else:
+                next_question = pick_adaptive(
+                    category_id, previous_questions, difficulty, total)
+        return next_question, total
+
     @app.route('/quizzes', methods=['POST'])
     def get_questions_for_quiz():
         try:
-            questions = []
-            next_questions = []
-
             data = request.get_json()
-            previous_questions = data.get('previous_questions')
-            category = data.get('quiz_category')
-
-            if category is None or category is {} or category['id'] is None:
-                return Bad_Request(400)
-
-            if int(category['id']) == -1:
-                questions = Question.query.all()
+            session_id = data.get('session_id')
+
+            if session_id is not None:
+                quiz_session = quiz_sessions.get(session_id)
+                if quiz_session is None:
+                    return not_found(404)
+                try:
+                    answer = quiz_answer(data.get('last_answer_correct'))
+                except ValueError:
+                    return Bad_Request(400)
+                total = quiz_session.total
+                if total is None:
+                    total = quiz_total(quiz_session.category_id)
+                next_question = quiz_session.next_question(answer, total)
             else:
-                category_id = int(category['id']) + 1
-                questions = Question.query.filter(
-                    Question.category == category_id).all()
+                previous_questions = data.get('previous_questions') or []
+                difficulty = None
+                try:
+                    category_id = quiz_category_id(data.get('quiz_category'))
+                    if data.get('difficulty') is not None:
+                        difficulty = next_difficulty(
+                            quiz_difficulty(data['difficulty']),
+                            quiz_answer(data.get('last_answer_correct')))
+                except (ValueError, TypeError, KeyError):
+                    return Bad_Request(400)
+
+                next_question, total = next_quiz_question(
+                    category_id, previous_questions, difficulty)
 
-            if len(previous_questions) > 0:
-                for pre_q in previous_questions:
-                    for q in questions:
+            response_object = {
+                'success': True,
+                'question': None,
+                'total_questions': total,
+            }
+            if session_id is None and difficulty is not None:
+                response_object['difficulty'] = difficulty
+            if next_question is not None:
+                response_object['question'] = next_question.format()
+            if session_id is not None:
+                response_object.update(quiz_session.format())
+            return jsonify(response_object)
 
-                        if q.format()['id'] == pre_q:
-                            questions.remove(q)
+        except:
+            return unprocessable(422)
 
-            if len(questions) != 0:
-                next_question_id = random.randrange(0, len(questions))
-                next_questions = questions[next_question_id]
+    '''
+  POST /quizzes/sessions starts a server-side quiz session; the returned
+  session_id is then sent to POST /quizzes instead of previous_questions.
+  '''
+    @app.route('/quizzes/sessions', methods=['POST'])
+    def start_quiz_session():
+        try:
+            data = request.get_json()
+            try:
+                category_id = quiz_category_id(data.get('quiz_category'))
+            except (ValueError, TypeError, KeyError):
+                return Bad_Request(400)
 
-                return jsonify({
-                    'success': True,
-                    'question': next_questions.format(),
-                })
+            seed = data.get('seed')
+            if seed is not None and not isinstance(seed, (int, str)):
+                return Bad_Request(400)
+
+            if data.get('difficulty') is not None:
+                try:
+                    difficulty = quiz_difficulty(data['difficulty'])
+                except ValueError:
+                    return Bad_Request(400)
+                quiz_session = quiz_sessions.create_adaptive(
+                    category_id, difficulty)
+                total = quiz_total(category_id)
             else:
-                return jsonify({
-                    'success': True,
-                    'question': None,
-                })
+                quiz_session = quiz_sessions.create(category_id, seed)
+                total = quiz_session.total
 
+            response_object = {
+                "success": True,
+                "total_questions": total
+            }
+            response_object.update(quiz_session.format())
+            return jsonify(response_object)
         except:
             return unprocessable(422)
 
+    @app.route('/quizzes/sessions/<session_id>', methods=['DELETE'])
+    def end_quiz_session(session_id):
+        if not quiz_sessions.discard(session_id):
+            return not_found(404)
+        return jsonify({"success": True})
+
+    '''
+  GET /metrics exposes process counters in the Prometheus text format.
+  '''
+    @app.route('/metrics')
+    def metrics():
+        lines = [
+            "# HELP trivia_category_cache_hits_total Category reads served from memory.",
+            "# TYPE trivia_category_cache_hits_total counter",
+            f"trivia_category_cache_hits_total {category_cache.hits}",
+            "# HELP trivia_category_cache_misses_total Category reads that loaded the table.",
+            "# TYPE trivia_category_cache_misses_total counter",
+            f"trivia_category_cache_misses_total {category_cache.misses}",
+            "# HELP trivia_category_cache_version Times the category cache was invalidated.",
+            "# TYPE trivia_category_cache_version gauge",
+            f"trivia_category_cache_version {category_cache.version}",
+            "# HELP trivia_quiz_sessions Live server-side quiz sessions.",
+            "# TYPE trivia_quiz_sessions gauge",
+            f"trivia_quiz_sessions {len(quiz_sessions)}",
+        ]
+        lines.extend(request_metrics.prometheus_lines())
+        return Response("\n".join(lines) + "\n",
+                        mimetype="text/plain; version=0.0.4")
+
     '''
   @TODO: 
   Create error handlers for all expected errors 
@@ -362,6 +778,7 @@ def create_app(test_config=None):
       401: Unauthorized
       404: Not Found
       405: Method Not Allowed
+      409: Conflict
       500: Internal Server Error
   '''
 
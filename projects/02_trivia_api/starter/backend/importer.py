@@ -0,0 +1,220 @@
+'''
+Streaming bulk import of questions.
+
+Rows come from NDJSON (one JSON object per line) or CSV (with a header
+row) with the question, answer, category and difficulty fields. They are
+validated one at a time and inserted in batches of multi-row INSERT
+statements, one transaction per batch, so memory stays bounded by the
+batch size whatever the size of the input. A row that fails validation
+is reported with its line number and skipped; it never aborts the load.
+So is a duplicate: a row whose question fingerprint (see
+models.question_fingerprint) is already stored or appeared earlier in the
+same batch. Each batch checks its fingerprints with a single query.
+'''
+import csv
+import json
+import time
+from collections import Counter
+
+from sqlalchemy.exc import SQLAlchemyError
+
+from models import (db, Question, bump_table_version, adjust_category_counts,
+                    question_fingerprint)
+from cache import category_cache
+
+BATCH_SIZE = 1000
+MAX_REPORTED_ERRORS = 100
+FIELDS = ('question', 'answer', 'category', 'difficulty')
+
+
+class RowError(ValueError):
+    pass
+
+
+def iter_ndjson(lines):
+    for line_number, line in enumerate(lines, start=1):
+        if isinstance(line, bytes):
+            line = line.decode('utf-8')
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield line_number, RowError('invalid JSON: {}'.format(e))
+            continue
+        if not isinstance(row, dict):
+            yield line_number, RowError('expected a JSON object')
+            continue
+        yield line_number, row
+
+
+def iter_csv(lines):
+    lines = (line.decode('utf-8') if isinstance(line, bytes) else line
+             for line in lines)
+    reader = csv.DictReader(lines)
+    for row in reader:
+        # line 1 is the header
+        yield reader.line_num, row
+
+
+'''
+validate_row(row, categories)
+    returns the column values for a Question built from row or raises
+    RowError naming the first invalid field.
+'''
+def validate_row(row, categories):
+    missing = [field for field in FIELDS if row.get(field) in (None, '')]
+    if missing:
+        raise RowError('missing {}'.format(', '.join(missing)))
+
+    question = str(row['question']).strip()
+    answer = str(row['answer']).strip()
+    if not question or not answer:
+        raise RowError('question and answer must not be blank')
+
+    try:
+        category = int(row['category'])
+        difficulty = int(row['difficulty'])
+    except (TypeError, ValueError):
+        raise RowError('category and difficulty must be integers')
+
+    if category not in categories:
+        raise RowError('unknown category {}'.format(category))
+    if not 1 <= difficulty <= 5:
+        raise RowError('difficulty must be between 1 and 5')
+
+    return {
+        'question': question,
+        'answer': answer,
+        'category': category,
+        'difficulty': difficulty,
+        'fingerprint': question_fingerprint(question),
+    }
+
+
+class ImportResult:
+
+    def __init__(self):
+        self.inserted = 0
+        self.rejected = 0
+        self.duplicates = 0
+        self.errors = []
+        self.batches = []
+        self.started = time.perf_counter()
+
+    def _report(self, line_number, message):
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'line': line_number, 'error': message})
+
+    def reject(self, line_number, message):
+        self.rejected += 1
+        self._report(line_number, message)
+
+    def duplicate(self, line_number, message):
+        self.duplicates += 1
+        self._report(line_number, message)
+
+    def format(self):
+        seconds = time.perf_counter() - self.started
+        return {
+            'inserted': self.inserted,
+            'rejected': self.rejected,
+            'duplicates': self.duplicates,
+            'errors': self.errors,
+            'errors_truncated':
+                self.rejected + self.duplicates > len(self.errors),
+            'batches': self.batches,
+            'seconds': round(seconds, 3),
+            'rows_per_second': round(self.inserted / seconds) if seconds else 0,
+        }
+
+
+def _insert(values):
+    db.session.execute(Question.__table__.insert().values(values))
+    connection = db.session.connection()
+    bump_table_version(connection, 'questions')
+    adjust_category_counts(
+        connection, Counter(row['category'] for row in values))
+    db.session.commit()
+
+
+def _drop_duplicates(batch, result):
+    existing = Question.existing_fingerprints(
+        values['fingerprint'] for _, values in batch)
+    seen = {}
+    unique = []
+    for line_number, values in batch:
+        fingerprint = values['fingerprint']
+        if fingerprint in existing:
+            result.duplicate(line_number, 'duplicate of question {}'.format(
+                existing[fingerprint]))
+        elif fingerprint in seen:
+            result.duplicate(line_number, 'duplicate of line {}'.format(
+                seen[fingerprint]))
+        else:
+            seen[fingerprint] = line_number
+            unique.append((line_number, values))
+    return unique
+
+
+def _flush(batch, result, on_batch):
+    started = time.perf_counter()
+    batch = _drop_duplicates(batch, result)
+    if not batch:
+        return
+    try:
+        _insert([values for _, values in batch])
+        inserted = len(batch)
+    except SQLAlchemyError:
+        # isolate the offending rows instead of dropping the whole batch
+        db.session.rollback()
+        inserted = 0
+        for line_number, values in batch:
+            try:
+                _insert([values])
+                inserted += 1
+            except SQLAlchemyError as e:
+                db.session.rollback()
+                result.reject(line_number, str(getattr(e, 'orig', e)))
+
+    seconds = time.perf_counter() - started
+    stats = {
+        'rows': inserted,
+        'seconds': round(seconds, 4),
+        'rows_per_second': round(inserted / seconds) if seconds else 0,
+    }
+    result.inserted += inserted
+    result.batches.append(stats)
+    if on_batch is not None:
+        on_batch(stats)
+
+
+'''
+import_questions(rows, batch_size, on_batch)
+    inserts the (line_number, row) pairs produced by iter_ndjson or
+    iter_csv and returns an ImportResult. on_batch, when given, is called
+    with the throughput stats of every batch as soon as it is committed.
+'''
+def import_questions(rows, batch_size=BATCH_SIZE, on_batch=None):
+    result = ImportResult()
+    categories = category_cache.types()
+    batch = []
+
+    for line_number, row in rows:
+        if isinstance(row, RowError):
+            result.reject(line_number, str(row))
+            continue
+        try:
+            batch.append((line_number, validate_row(row, categories)))
+        except RowError as e:
+            result.reject(line_number, str(e))
+            continue
+
+        if len(batch) >= batch_size:
+            _flush(batch, result, on_batch)
+            batch = []
+
+    if batch:
+        _flush(batch, result, on_batch)
+
+    return result
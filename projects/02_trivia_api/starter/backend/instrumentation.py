@@ -0,0 +1,277 @@
+'''
+Per-request instrumentation.
+
+Flask before / after request hooks time every request, and SQLAlchemy
+cursor events count the statements it runs, the time spent in them and the
+rows the database reported. Responses built by json_response() also record
+their serialisation time. Everything is aggregated per endpoint (the URL
+rule, not the raw path, so the label set stays small) and rendered in the
+Prometheus text format by GET /metrics.
+
+Settings (app.config first, then the environment, as in models.setting):
+
+REQUEST_METRICS    record request metrics (default true)
+SLOW_REQUEST_LOG   keep the N slowest requests with their SQL and log each
+                   one that enters that list on the trivia.slow logger
+                   (default 0: statements are not captured)
+
+Rows are the row counts reported by the database driver: psycopg2 reports
+the rows returned by a SELECT, SQLite only the rows written. Streamed
+(NDJSON) responses are timed until their first byte.
+'''
+import heapq
+import logging
+import threading
+import time
+from collections import defaultdict
+
+from flask import request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from models import setting
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+                   0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 4, 5, 8, 13, 21, 34, 55)
+MAX_STATEMENT_LENGTH = 500
+
+slow_log = logging.getLogger('trivia.slow')
+
+# the stats of the request the current thread serves; a thread-local is a
+# single attribute read for the cursor listeners, unlike flask.g
+_current = threading.local()
+
+
+class Histogram:
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    '''
+    lines(name, labels)
+        the Prometheus _bucket (cumulative), _sum and _count samples.
+    '''
+    def lines(self, name, labels):
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            yield '{}_bucket{{{},le="{}"}} {}'.format(
+                name, labels, bound, cumulative)
+        yield '{}_bucket{{{},le="+Inf"}} {}'.format(name, labels, self.count)
+        yield '{}_sum{{{}}} {}'.format(name, labels, round(self.sum, 6))
+        yield '{}_count{{{}}} {}'.format(name, labels, self.count)
+
+
+class EndpointStats:
+
+    def __init__(self):
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.queries = Histogram(QUERY_BUCKETS)
+        self.statuses = defaultdict(int)
+        self.rows = 0
+        self.sql_seconds = 0.0
+        self.serialization_seconds = 0.0
+
+
+class RequestStats:
+    __slots__ = ('started', 'queries', 'rows', 'sql_seconds',
+                 'serialization_seconds', 'statements', '_statement_started')
+
+    def __init__(self, capture_statements):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.rows = 0
+        self.sql_seconds = 0.0
+        self.serialization_seconds = 0.0
+        self.statements = [] if capture_statements else None
+        self._statement_started = None
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"') \
+        .replace('\n', '\\n')
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    stats = getattr(_current, 'stats', None)
+    if stats is not None:
+        stats.queries += 1
+        stats._statement_started = time.perf_counter()
+        if stats.statements is not None:
+            stats.statements.append(statement[:MAX_STATEMENT_LENGTH])
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    stats = getattr(_current, 'stats', None)
+    if stats is not None and stats._statement_started is not None:
+        stats.sql_seconds += time.perf_counter() - stats._statement_started
+        stats._statement_started = None
+        if cursor.rowcount > 0:
+            stats.rows += cursor.rowcount
+
+
+class RequestMetrics:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints = defaultdict(EndpointStats)
+        self._slowest = []
+        self._listening = False
+        # lets a benchmark switch recording off without rebuilding the app
+        self.enabled = True
+
+    def init_app(self, app):
+        if not setting(app.config, 'REQUEST_METRICS', True, bool):
+            return
+        slow_requests = setting(app.config, 'SLOW_REQUEST_LOG', 0, int)
+
+        with self._lock:
+            if not self._listening:
+                event.listen(Engine, 'before_cursor_execute',
+                             _before_cursor_execute)
+                event.listen(Engine, 'after_cursor_execute',
+                             _after_cursor_execute)
+                self._listening = True
+
+        @app.before_request
+        def start_request_stats():
+            if self.enabled:
+                _current.stats = RequestStats(slow_requests > 0)
+
+        @app.after_request
+        def record_request_stats(response):
+            stats = getattr(_current, 'stats', None)
+            _current.stats = None
+            if stats is not None:
+                self._record(stats, response.status_code, slow_requests)
+            return response
+
+        @app.teardown_request
+        def forget_request_stats(exception):
+            _current.stats = None
+
+    '''
+    record_serialization(seconds)
+        adds response encoding time to the current request.
+    '''
+    def record_serialization(self, seconds):
+        stats = getattr(_current, 'stats', None)
+        if stats is not None:
+            stats.serialization_seconds += seconds
+
+    def _record(self, stats, status, slow_requests):
+        seconds = time.perf_counter() - stats.started
+        rule = request.url_rule.rule if request.url_rule else 'unmatched'
+        key = (request.method, rule)
+
+        with self._lock:
+            endpoint = self._endpoints[key]
+            endpoint.latency.observe(seconds)
+            endpoint.queries.observe(stats.queries)
+            endpoint.statuses[status] += 1
+            endpoint.rows += stats.rows
+            endpoint.sql_seconds += stats.sql_seconds
+            endpoint.serialization_seconds += stats.serialization_seconds
+
+            if slow_requests <= 0:
+                return
+            entry = (seconds, request.method, request.full_path,
+                     stats.statements)
+            if len(self._slowest) < slow_requests:
+                heapq.heappush(self._slowest, entry)
+            elif seconds > self._slowest[0][0]:
+                heapq.heapreplace(self._slowest, entry)
+            else:
+                return
+
+        slow_log.warning('slow request %s %s took %.1f ms, %d queries:\n%s',
+                         request.method, request.full_path, seconds * 1000,
+                         stats.queries, '\n'.join(stats.statements))
+
+    '''
+    slowest()
+        the kept slow requests, slowest first, as dicts.
+    '''
+    def slowest(self):
+        with self._lock:
+            entries = sorted(self._slowest, key=lambda entry: -entry[0])
+        return [{
+            'seconds': round(seconds, 6),
+            'method': method,
+            'path': path,
+            'statements': statements,
+        } for seconds, method, path, statements in entries]
+
+    def reset(self):
+        with self._lock:
+            self._endpoints.clear()
+            self._slowest = []
+
+    '''
+    prometheus_lines()
+        the request metrics in the Prometheus text format.
+    '''
+    def prometheus_lines(self):
+        with self._lock:
+            endpoints = sorted(self._endpoints.items())
+            lines = [
+                "# HELP trivia_http_requests_total Requests by endpoint and status.",
+                "# TYPE trivia_http_requests_total counter",
+            ]
+            for (method, rule), endpoint in endpoints:
+                for status, count in sorted(endpoint.statuses.items()):
+                    lines.append(
+                        'trivia_http_requests_total{{method="{}",endpoint="{}",'
+                        'status="{}"}} {}'.format(
+                            method, _label(rule), status, count))
+
+            histograms = (
+                ('trivia_http_request_duration_seconds', 'latency',
+                 'Request latency in seconds.'),
+                ('trivia_http_request_queries', 'queries',
+                 'SQL statements per request.'),
+            )
+            for name, attribute, description in histograms:
+                lines.append("# HELP {} {}".format(name, description))
+                lines.append("# TYPE {} histogram".format(name))
+                for (method, rule), endpoint in endpoints:
+                    labels = 'method="{}",endpoint="{}"'.format(
+                        method, _label(rule))
+                    lines.extend(
+                        getattr(endpoint, attribute).lines(name, labels))
+
+            counters = (
+                ('trivia_http_request_rows_total', 'rows',
+                 'Rows reported by the database driver.'),
+                ('trivia_http_request_sql_seconds_total', 'sql_seconds',
+                 'Time spent executing SQL statements.'),
+                ('trivia_http_response_serialization_seconds_total',
+                 'serialization_seconds', 'Time spent encoding JSON responses.'),
+            )
+            for name, attribute, description in counters:
+                lines.append("# HELP {} {}".format(name, description))
+                lines.append("# TYPE {} counter".format(name))
+                for (method, rule), endpoint in endpoints:
+                    value = getattr(endpoint, attribute)
+                    if isinstance(value, float):
+                        value = round(value, 6)
+                    lines.append('{}{{method="{}",endpoint="{}"}} {}'.format(
+                        name, method, _label(rule), value))
+        return lines
+
+
+request_metrics = RequestMetrics()
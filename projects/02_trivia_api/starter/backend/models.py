@@ -1,14 +1,60 @@
 import os
-from sqlalchemy import Column, String, Integer, create_engine
+import random
+import hashlib
+import re
+import unicodedata
+from collections import Counter
+from sqlalchemy import Column, String, Integer, Index, create_engine, func, inspect, event, cast, bindparam
+from sqlalchemy.orm import Session, object_session
 from flask_sqlalchemy import SQLAlchemy
 import json
-import psycopg2
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is optional
+    orjson = None
 
 database_name = "trivia"
-database_path = "postgres://postgres:ranim1997@{}/{}".format('localhost:5432', database_name)
+database_path = os.environ.get(
+    'DATABASE_URL',
+    "postgres://postgres:ranim1997@{}/{}".format('localhost:5432', database_name))
 
 db = SQLAlchemy()
 
+'''
+Startup and pool settings. Each one is read from app.config first, then
+from an environment variable of the same name.
+
+CREATE_SCHEMA      run create_schema() inside setup_db (default true). Set it
+                   to false for worker processes and run `flask init-db`
+                   once per deployment instead: setup_db then never touches
+                   the database and the first connection is made by the
+                   first request.
+DB_POOL_SIZE       connections kept open per process (default 5)
+DB_MAX_OVERFLOW    extra connections allowed under load (default 10)
+DB_POOL_PRE_PING   test connections on checkout (default true)
+DB_POOL_RECYCLE    seconds before a connection is replaced (default 1800)
+'''
+def setting(config, name, default, cast=str):
+    value = config.get(name, os.environ.get(name))
+    if value is None:
+        return default
+    if cast is bool and isinstance(value, str):
+        return value.strip().lower() not in ('0', 'false', 'no', 'off', '')
+    return cast(value)
+
+
+def engine_options(database_path, config):
+    options = {
+        'pool_pre_ping': setting(config, 'DB_POOL_PRE_PING', True, bool),
+        'pool_recycle': setting(config, 'DB_POOL_RECYCLE', 1800, int),
+    }
+    # SQLite uses a NullPool / SingletonThreadPool that takes no size options
+    if not database_path.startswith('sqlite'):
+        options['pool_size'] = setting(config, 'DB_POOL_SIZE', 5, int)
+        options['max_overflow'] = setting(config, 'DB_MAX_OVERFLOW', 10, int)
+    return options
+
 '''
 setup_db(app)
     binds a flask application and a SQLAlchemy service
@@ -16,9 +62,117 @@ setup_db(app)
 def setup_db(app, database_path=database_path):
     app.config["SQLALCHEMY_DATABASE_URI"] = database_path
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(
+        database_path, app.config)
     db.app = app
     db.init_app(app)
+    if setting(app.config, 'CREATE_SCHEMA', True, bool):
+        create_schema()
+
+'''
+create_schema()
+    creates the missing tables and indexes, and fills category_counts the
+    first time. Also available as `flask init-db`.
+'''
+def create_schema():
     db.create_all()
+    added = ensure_columns()
+    ensure_indexes()
+    if 'questions.fingerprint' in added:
+        backfill_fingerprints()
+    if db.session.query(CategoryCount).first() is None:
+        refresh_category_counts()
+
+'''
+ensure_columns()
+    create_all() does not alter existing tables either: nullable columns
+    added to a model later (e.g. questions.fingerprint) are added here.
+    Returns the added columns as "table.column" names.
+'''
+def ensure_columns():
+    inspector = inspect(db.engine)
+    added = []
+    for table in db.metadata.sorted_tables:
+        existing = set(column['name'] for column in inspector.get_columns(table.name))
+        for column in table.columns:
+            if column.name not in existing and column.nullable:
+                db.session.execute('ALTER TABLE {} ADD COLUMN {} {}'.format(
+                    table.name, column.name,
+                    column.type.compile(dialect=db.engine.dialect)))
+                added.append('{}.{}'.format(table.name, column.name))
+    db.session.commit()
+    return added
+
+'''
+ensure_indexes()
+    create_all() only creates missing tables, so indexes added to a model
+    after its table exists (e.g. a restored trivia.psql) are created here.
+'''
+def ensure_indexes():
+    inspector = inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        existing = set(index['name'] for index in inspector.get_indexes(table.name))
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(db.engine)
+
+'''
+dumps(obj)
+    encodes obj to JSON bytes with orjson when it is installed, falling
+    back to the standard library encoder.
+'''
+def dumps(obj):
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, separators=(',', ':')).encode()
+
+'''
+question_fingerprint(text)
+    the duplicate-detection key of a question: the SHA-1 of its text
+    lowercased, without accents or punctuation and with whitespace collapsed,
+    so "What's the capital of France?" and "whats the  capital of FRANCE"
+    share one fingerprint.
+'''
+_NOT_WORD = re.compile(r'[\W_]+', re.UNICODE)
+
+def question_fingerprint(text):
+  if text is None:
+    return None
+  decomposed = unicodedata.normalize('NFKD', text.casefold())
+  stripped = ''.join(c for c in decomposed if not unicodedata.combining(c))
+  normalized = ' '.join(_NOT_WORD.sub(' ', stripped.replace("'", '')).split())
+  return hashlib.sha1(normalized.encode('utf-8')).hexdigest()
+
+'''
+probe_rounds(low, high, unseen=None)
+    the random id probes of Question.random_unseen: lists of distinct
+    random ids in [low, high]. The first round is sized so that about
+    PROBE_HITS of its ids are unseen questions when their number (unseen) is
+    known (and positive), RANDOM_PROBES otherwise; each further round is PROBE_GROWTH times
+    larger, up to MAX_RANDOM_PROBES, and none follows a round covering the
+    whole range.
+'''
+RANDOM_PROBES = 16
+MAX_RANDOM_PROBES = 1024
+PROBE_HITS = 4
+PROBE_GROWTH = 4
+PROBE_ROUNDS = 3
+
+def probe_rounds(low, high, unseen=None):
+  span = high - low + 1
+  size = RANDOM_PROBES
+  if unseen is not None and unseen > 0:
+    size = max(size, -(-PROBE_HITS * span // unseen))
+  for _ in range(PROBE_ROUNDS):
+    size = min(size, MAX_RANDOM_PROBES, span)
+    yield random.sample(range(low, high + 1), size)
+    if size == span:
+      return
+    size *= PROBE_GROWTH
+
+# how Question.random_unseen and its async copy found their question:
+# 'probe' or 'walk' (see benchmarks/bench_adaptive.py)
+pick_stats = Counter()
 
 '''
 Question
@@ -26,18 +180,27 @@ Question
 '''
 class Question(db.Model):  
   __tablename__ = 'questions'
+  __table_args__ = (
+    Index('ix_questions_category_id', 'category', 'id'),
+    Index('ix_questions_category_difficulty_id', 'category', 'difficulty', 'id'),
+    Index('ix_questions_difficulty_id', 'difficulty', 'id'),
+    # equality lookups only, so a hash index on Postgres
+    Index('ix_questions_fingerprint', 'fingerprint', postgresql_using='hash'),
+  )
 
   id = Column(Integer, primary_key=True)
   question = Column(String)
   answer = Column(String)
   category = Column(String)
   difficulty = Column(Integer)
+  fingerprint = Column(String(40))
 
   def __init__(self, question, answer, category, difficulty):
     self.question = question
     self.answer = answer
     self.category = category
     self.difficulty = difficulty
+    self.fingerprint = question_fingerprint(question)
 
   def insert(self):
     db.session.add(self)
@@ -59,6 +222,145 @@ class Question(db.Model):
       'difficulty': self.difficulty
     }
 
+  '''
+  Column projection read path: query(*Question.columns()) returns plain
+  tuples instead of ORM instances (no identity map, no per-row object
+  construction) and format_rows() turns them into the same dicts format()
+  builds, ready for dumps().
+  '''
+  FIELDS = ('id', 'question', 'answer', 'category', 'difficulty')
+
+  @classmethod
+  def columns(cls):
+    return [getattr(cls, field) for field in cls.FIELDS]
+
+  @classmethod
+  def format_rows(cls, rows):
+    fields = cls.FIELDS
+    return [dict(zip(fields, row)) for row in rows]
+
+  '''
+  keyset_page(after_id, limit)
+      returns (formatted questions, total, has_more) for the questions with
+      an id greater than after_id. The exact table total rides along as a
+      scalar subquery so a page costs a single round trip, and the id index
+      keeps deep pages as cheap as the first one.
+  '''
+  @classmethod
+  def keyset_page(cls, after_id, limit):
+    total = db.session.query(func.count(cls.id)).as_scalar()
+    rows = db.session.query(*cls.columns(), total.label('total')) \
+      .filter(cls.id > after_id) \
+      .order_by(cls.id) \
+      .limit(limit + 1) \
+      .all()
+
+    if len(rows) == 0:
+      return [], 0, False
+
+    questions = cls.format_rows(row[:-1] for row in rows[:limit])
+    return questions, rows[0].total, len(rows) > limit
+
+  '''
+  random_unseen(category=None, exclude=(), difficulty=None, unseen=None)
+      returns a random question (optionally within a category and / or a
+      difficulty) whose id is not in exclude, or None when every candidate
+      has been seen. unseen is the caller's estimate of how many candidates
+      are left (e.g. the category count less the played ids), if any.
+      Rounds of random ids between the smallest and largest candidate id
+      (see probe_rounds) are looked up together until one of them hits
+      unseen questions, and one of those is taken. Every unseen question is
+      as likely to be hit by a probe, so the pick is uniform whatever the
+      gaps left by deleted or played ids, and each step is a few index
+      lookups instead of loading the whole table: (category, id),
+      (category, difficulty, id) or (difficulty, id) depending on the
+      filters. When every round misses, the first unseen question at or
+      after a random id is taken (wrapping around to the smallest one), one
+      more index walk; that pick favours questions after a long run of
+      played or missing ids.
+  '''
+  @classmethod
+  def random_unseen(cls, category=None, exclude=(), difficulty=None,
+                    unseen=None):
+    candidates = db.session.query(cls)
+    if category is not None:
+      candidates = candidates.filter(cls.category == category)
+    if difficulty is not None:
+      candidates = candidates.filter(cls.difficulty == difficulty)
+
+    # min and max as separate subqueries so each one is a single index probe
+    ids = candidates.with_entities(cls.id)
+    low, high = db.session.query(
+      ids.order_by(cls.id).limit(1).as_scalar(),
+      ids.order_by(cls.id.desc()).limit(1).as_scalar()).one()
+    if low is None:
+      return None
+
+    exclude = set(exclude)
+    if exclude:
+      candidates = candidates.filter(~cls.id.in_(exclude))
+
+    for probes in probe_rounds(low, high, unseen):
+      found = candidates.filter(cls.id.in_(probes)).all()
+      if found:
+        pick_stats['probe'] += 1
+        return random.choice(found)
+
+    pick_stats['walk'] += 1
+    pivot = random.randint(low, high)
+    return candidates.filter(cls.id >= pivot).order_by(cls.id).first() \
+      or candidates.filter(cls.id < pivot).order_by(cls.id).first()
+
+  '''
+  existing_fingerprints(fingerprints)
+      returns {fingerprint: id of the oldest question with it} for the
+      given fingerprints that are already stored: one index lookup per
+      fingerprint, in a single query.
+  '''
+  @classmethod
+  def existing_fingerprints(cls, fingerprints):
+    fingerprints = set(fingerprints)
+    if not fingerprints:
+      return {}
+    rows = db.session.query(cls.fingerprint, func.min(cls.id)) \
+      .filter(cls.fingerprint.in_(fingerprints)) \
+      .group_by(cls.fingerprint).all()
+    return dict(rows)
+
+'''
+backfill_fingerprints(batch_size)
+    sets the fingerprint of every question that has none (rows stored
+    before the column existed) and returns how many were set. Each batch is
+    one keyset read and one executemany UPDATE. Runs once when
+    create_schema() adds the column, and from `flask dedup-questions`.
+'''
+def backfill_fingerprints(batch_size=1000):
+  table = Question.__table__
+  update = table.update() \
+    .where(table.c.id == bindparam('question_id')) \
+    .values(fingerprint=bindparam('question_fingerprint'))
+
+  after_id = 0
+  filled = 0
+  while True:
+    rows = db.session.query(Question.id, Question.question) \
+      .filter(Question.fingerprint.is_(None), Question.id > after_id) \
+      .order_by(Question.id) \
+      .limit(batch_size) \
+      .all()
+    if not rows:
+      db.session.commit()
+      return filled
+
+    after_id = rows[-1].id
+    values = [{'question_id': question_id,
+               'question_fingerprint': question_fingerprint(question)}
+              for question_id, question in rows if question is not None]
+    if values:
+      db.session.execute(update, values)
+      db.session.commit()
+    filled += len(values)
+
 '''
 Category
 
@@ -76,4 +378,170 @@ class Category(db.Model):
     return {
       'id': self.id,
       'type': self.type
-    }
\ No newline at end of file
+    }
+
+'''
+TableVersion
+    one change counter per table. Every committed write to a versioned
+    table bumps its counter in the same transaction, so readers can tell
+    whether anything changed (e.g. for ETags) with a primary key lookup.
+'''
+class TableVersion(db.Model):
+  __tablename__ = 'table_versions'
+
+  name = Column(String, primary_key=True)
+  version = Column(Integer, nullable=False, default=0)
+
+
+VERSIONED_TABLES = ('questions', 'categories')
+
+'''
+bump_table_version(connection, name)
+    increments the counter of a table. ORM writes to questions and
+    categories are counted automatically (see the listeners below); writes
+    that bypass the ORM must call this inside their transaction.
+'''
+def bump_table_version(connection, name):
+  table = TableVersion.__table__
+  result = connection.execute(
+    table.update()
+    .where(table.c.name == name)
+    .values(version=table.c.version + 1))
+  if result.rowcount == 0:
+    connection.execute(table.insert().values(name=name, version=1))
+
+
+'''
+get_table_versions(names)
+    returns {name: version} for the given tables in a single query.
+'''
+def get_table_versions(names):
+  rows = db.session.query(TableVersion.name, TableVersion.version) \
+    .filter(TableVersion.name.in_(names)).all()
+  versions = dict.fromkeys(names, 0)
+  versions.update(rows)
+  return versions
+
+
+def _mark_table_changed(mapper, connection, target):
+  session = object_session(target)
+  if session is not None:
+    session.info.setdefault('changed_tables', set()).add(mapper.local_table.name)
+
+
+for _model in (Question, Category):
+  for _event_name in ('after_insert', 'after_update', 'after_delete'):
+    event.listen(_model, _event_name, _mark_table_changed)
+
+
+@event.listens_for(Session, 'after_flush')
+def _bump_changed_tables(session, flush_context):
+  for name in sorted(session.info.pop('changed_tables', ())):
+    bump_table_version(session.connection(), name)
+
+
+'''
+CategoryCount
+    number of questions per category, kept current by every write so the
+    count is a primary key lookup instead of a scan of questions. ORM
+    inserts, deletes and category changes of a Question are applied at
+    flush time (see the listeners below); writes that bypass the ORM must
+    call adjust_category_counts() inside their transaction.
+'''
+class CategoryCount(db.Model):
+  __tablename__ = 'category_counts'
+
+  category_id = Column(Integer, primary_key=True)
+  questions = Column(Integer, nullable=False, default=0)
+
+
+def adjust_category_counts(connection, deltas):
+  table = CategoryCount.__table__
+  for category_id, delta in sorted(deltas.items()):
+    if delta == 0:
+      continue
+    result = connection.execute(
+      table.update()
+      .where(table.c.category_id == category_id)
+      .values(questions=table.c.questions + delta))
+    if result.rowcount == 0:
+      connection.execute(
+        table.insert().values(category_id=category_id, questions=delta))
+
+
+'''
+refresh_category_counts()
+    recomputes every count from the questions table (one GROUP BY scan).
+    Also available as `flask refresh-counts`.
+'''
+def refresh_category_counts():
+  category = cast(Question.category, Integer)
+  counts = [
+    {'category_id': category_id, 'questions': questions}
+    for category_id, questions in db.session.query(
+      category, func.count(Question.id)).group_by(category)
+    if category_id is not None
+  ]
+  db.session.query(CategoryCount).delete()
+  if counts:
+    db.session.execute(CategoryCount.__table__.insert(), counts)
+  db.session.commit()
+
+
+'''
+get_category_counts()
+    returns {category_id: number of questions}; categories without
+    questions are missing.
+'''
+def get_category_counts():
+  rows = db.session.query(CategoryCount.category_id, CategoryCount.questions) \
+    .filter(CategoryCount.questions > 0).all()
+  return dict(rows)
+
+
+def _category_deltas(session):
+  return session.info.setdefault('category_deltas', Counter())
+
+
+def _count_inserted_question(mapper, connection, target):
+  session = object_session(target)
+  if session is not None and target.category is not None:
+    _category_deltas(session)[int(target.category)] += 1
+
+
+def _count_deleted_question(mapper, connection, target):
+  session = object_session(target)
+  if session is not None and target.category is not None:
+    _category_deltas(session)[int(target.category)] -= 1
+
+
+def _count_moved_question(mapper, connection, target):
+  session = object_session(target)
+  history = inspect(target).attrs.category.history
+  if session is None or not history.has_changes():
+    return
+  deltas = _category_deltas(session)
+  for category_id in history.deleted:
+    if category_id is not None:
+      deltas[int(category_id)] -= 1
+  for category_id in history.added:
+    if category_id is not None:
+      deltas[int(category_id)] += 1
+
+
+def _refresh_fingerprint(mapper, connection, target):
+  if inspect(target).attrs.question.history.has_changes():
+    target.fingerprint = question_fingerprint(target.question)
+
+
+event.listen(Question, 'before_update', _refresh_fingerprint)
+event.listen(Question, 'after_insert', _count_inserted_question)
+event.listen(Question, 'after_delete', _count_deleted_question)
+event.listen(Question, 'after_update', _count_moved_question)
+
+
+@event.listens_for(Session, 'after_flush')
+def _apply_category_deltas(session, flush_context):
+  deltas = session.info.pop('category_deltas', None)
+  if deltas:
+    adjust_category_counts(session.connection(), deltas)
@@ -0,0 +1,482 @@
+'''
+Server-side quiz sessions.
+
+Starting a session loads the sorted ids of the category's questions into a
+typed array of ints (4 bytes per question) that is shared by every session
+of that category, and gives the session a seeded permutation of its
+positions (see IndexPermutation), computed one step at a time: a session
+costs a few integers whatever the size of the category, and starting one
+does not shuffle anything. Every step serves the id at the next permuted
+position, so clients send only the session id instead of the whole,
+growing previous_questions list. Passing a seed makes the order
+reproducible.
+
+Committed ORM inserts, deletes and category changes of questions patch live
+sessions: new questions are mixed into the part of the deck not played
+yet, deleted ones are skipped if their turn has not come. Shared decks keep
+the changes committed since they were loaded, which sessions started from
+them copy, and are reloaded once MAX_DECK_CHANGES piled up. Rows that
+disappear behind the ORM's back are skipped when their turn comes; bulk
+imports are picked up by sessions started afterwards.
+
+Adaptive sessions have no deck: they track a target difficulty band that
+moves up after a correct answer and down after a wrong one, and pick a
+random unseen question of that band (or the nearest band that still has
+one) through the (category, difficulty, id) index, with the probes sized
+from the category count spread over the bands.
+
+Sessions live in this process: each access refreshes a sliding TTL and
+expired or surplus sessions are evicted least recently used first, so
+deployments with several workers need sticky routing for session clients.
+'''
+import random
+import secrets
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict, defaultdict
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, object_session
+
+from models import db, Question
+
+QUIZ_SESSION_TTL = 30 * 60
+MAX_QUIZ_SESSIONS = 10000
+MAX_DECK_CHANGES = 1000
+MIN_DIFFICULTY = 1
+MAX_DIFFICULTY = 5
+BANDS = MAX_DIFFICULTY - MIN_DIFFICULTY + 1
+
+
+'''
+load_deck(category_id)
+    returns a Deck of the ids of a category's questions (all questions when
+    category_id is None) using a single ids-only query.
+'''
+def load_deck(category_id):
+    query = db.session.query(Question.id)
+    if category_id is not None:
+        query = query.filter(Question.category == category_id)
+    return Deck(array('i', (row[0] for row in query.order_by(Question.id))))
+
+
+class Deck:
+    '''
+    The sorted question ids sessions are started from, never modified once
+    loaded, and the ids added to and removed from the category since then.
+    '''
+    __slots__ = ('ids', 'added', 'removed')
+
+    def __init__(self, ids):
+        self.ids = ids
+        self.added = []
+        self.removed = set()
+
+    @property
+    def changes(self):
+        return len(self.added) + len(self.removed)
+
+    def position(self, question_id):
+        i = bisect_left(self.ids, question_id)
+        if i < len(self.ids) and self.ids[i] == question_id:
+            return i
+        return None
+
+    def add(self, question_id):
+        if question_id in self.removed:
+            self.removed.discard(question_id)
+        else:
+            self.added.append(question_id)
+
+    def remove(self, question_id):
+        if question_id in self.added:
+            self.added.remove(question_id)
+        elif self.position(question_id) is not None:
+            self.removed.add(question_id)
+
+
+class IndexPermutation:
+    '''
+    A seeded pseudo-random permutation of range(n) computed one index at a
+    time: a four round Feistel network over the smallest even number of
+    bits covering n, walking the values it maps past n along their cycle
+    back into range. perm[k] is the index served at step k and
+    perm.index(i) the step serving index i.
+    '''
+    __slots__ = ('n', 'bits', 'mask', 'keys')
+
+    ROUNDS = 4
+
+    def __init__(self, n, rng):
+        self.n = n
+        self.bits = max(1, ((n - 1).bit_length() + 1) // 2)
+        self.mask = (1 << self.bits) - 1
+        self.keys = [rng.getrandbits(32) for _ in range(self.ROUNDS)]
+
+    def _mix(self, value, key):
+        value = (value ^ key) * 0x45D9F3B & 0xFFFFFFFF
+        value = (value ^ value >> 16) * 0x45D9F3B & 0xFFFFFFFF
+        return (value ^ value >> 16) & self.mask
+
+    def _forward(self, value):
+        left, right = value >> self.bits, value & self.mask
+        for key in self.keys:
+            left, right = right, left ^ self._mix(right, key)
+        return left << self.bits | right
+
+    def _backward(self, value):
+        left, right = value >> self.bits, value & self.mask
+        for key in reversed(self.keys):
+            left, right = right ^ self._mix(left, key), left
+        return left << self.bits | right
+
+    def __getitem__(self, step):
+        value = self._forward(step)
+        while value >= self.n:
+            value = self._forward(value)
+        return value
+
+    def index(self, i):
+        value = self._backward(i)
+        while value >= self.n:
+            value = self._backward(value)
+        return value
+
+
+def next_difficulty(difficulty, last_answer_correct):
+    if last_answer_correct is None:
+        return difficulty
+    step = 1 if last_answer_correct else -1
+    return min(MAX_DIFFICULTY, max(MIN_DIFFICULTY, difficulty + step))
+
+
+def bands_by_distance(difficulty):
+    yield difficulty
+    for distance in range(1, MAX_DIFFICULTY - MIN_DIFFICULTY + 1):
+        for band in (difficulty + distance, difficulty - distance):
+            if MIN_DIFFICULTY <= band <= MAX_DIFFICULTY:
+                yield band
+
+
+'''
+band_unseen(total, exclude)
+    the unseen hint of Question.random_unseen for one difficulty band: the
+    category count less the played ids, spread evenly over the bands, or
+    None when the count is not known.
+'''
+def band_unseen(total, exclude):
+    if total is None:
+        return None
+    return (total - len(exclude)) // BANDS
+
+
+'''
+pick_adaptive(category_id, exclude, difficulty, total=None)
+    returns a random unseen question of the difficulty band, falling back
+    to the nearest bands (harder first), or None when all were seen. total
+    is the number of questions in the category, if known.
+'''
+def pick_adaptive(category_id, exclude, difficulty, total=None):
+    exclude = set(exclude)
+    unseen = band_unseen(total, exclude)
+    for band in bands_by_distance(difficulty):
+        question = Question.random_unseen(category_id, exclude, band, unseen)
+        if question is not None:
+            return question
+    return None
+
+
+class QuizSession:
+    __slots__ = ('id', 'category_id', 'ids', 'order', 'position', 'pending',
+                 'removed', 'size', 'cursor', 'rng', 'expires')
+
+    def __init__(self, session_id, category_id, deck, rng, expires):
+        self.id = session_id
+        self.category_id = category_id
+        self.cursor = 0
+        self.rng = rng
+        self.expires = expires
+        if deck is not None:
+            self.ids = deck.ids
+            self.order = IndexPermutation(len(deck.ids), rng)
+            self.position = 0
+            # added ids not served yet, and removed ids of self.ids whose
+            # turn has not come
+            self.pending = list(deck.added)
+            self.removed = set(deck.removed)
+            self.size = len(deck.ids) + len(self.pending) - len(self.removed)
+
+    @property
+    def total(self):
+        return self.size
+
+    def _draw(self):
+        unplayed = len(self.ids) - self.position - len(self.removed)
+        if self.pending:
+            pick = self.rng.randrange(unplayed + len(self.pending))
+            if pick < len(self.pending):
+                return self.pending.pop(pick)
+        while self.position < len(self.ids):
+            question_id = self.ids[self.order[self.position]]
+            self.position += 1
+            if question_id in self.removed:
+                self.removed.discard(question_id)
+                continue
+            return question_id
+        return None
+
+    '''
+    next_question(last_answer_correct=None, total=None)
+        returns the next question of the deck, or None once it is played
+        through. Deck sessions ignore the answers and the category count
+        (total) adaptive sessions size their probes with.
+    '''
+    def next_question(self, last_answer_correct=None, total=None):
+        while True:
+            question_id = self._draw()
+            if question_id is None:
+                return None
+            self.cursor += 1
+            question = Question.query.get(question_id)
+            if question is not None:
+                return question
+
+    def add(self, question_id):
+        if question_id in self.removed:
+            self.removed.discard(question_id)
+        else:
+            self.pending.append(question_id)
+        self.size += 1
+
+    def remove(self, question_id):
+        if question_id in self.pending:
+            self.pending.remove(question_id)
+        else:
+            i = bisect_left(self.ids, question_id)
+            if i == len(self.ids) or self.ids[i] != question_id \
+                    or question_id in self.removed \
+                    or self.order.index(i) < self.position:
+                return
+            self.removed.add(question_id)
+        self.size -= 1
+
+    def format(self):
+        return {
+            'session_id': self.id,
+            'played': self.cursor,
+        }
+
+
+class AdaptiveQuizSession(QuizSession):
+    __slots__ = ('difficulty', 'played')
+
+    def __init__(self, session_id, category_id, difficulty, expires):
+        super().__init__(session_id, category_id, None, None, expires)
+        self.difficulty = difficulty
+        self.played = array('i')
+
+    @property
+    def total(self):
+        return None
+
+    def next_question(self, last_answer_correct=None, total=None):
+        self.difficulty = next_difficulty(self.difficulty, last_answer_correct)
+        question = pick_adaptive(self.category_id, self.played,
+                                 self.difficulty, total)
+        if question is not None:
+            self.played.append(question.id)
+            self.cursor += 1
+        return question
+
+    def format(self):
+        response_object = super().format()
+        response_object['difficulty'] = self.difficulty
+        return response_object
+
+
+class QuizSessionStore:
+
+    def __init__(self, ttl=QUIZ_SESSION_TTL, max_sessions=MAX_QUIZ_SESSIONS,
+                 clock=time.monotonic):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._sessions = OrderedDict()
+        self._by_category = defaultdict(set)
+        # category_id -> the Deck new sessions of that category start from
+        self._decks = {}
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def _evict(self, now):
+        # least recently used first, so expired sessions sit at the front
+        while self._sessions:
+            oldest = next(iter(self._sessions.values()))
+            if oldest.expires > now and len(self._sessions) <= self.max_sessions:
+                break
+            self._drop(oldest.id)
+
+    def _drop(self, session_id):
+        session = self._sessions.pop(session_id, None)
+        if session is not None:
+            self._by_category[session.category_id].discard(session_id)
+        return session
+
+    '''
+    create(category_id, seed=None, deck=None)
+        starts a session for a category (None for all categories) from its
+        shared deck, loaded on first use, in a random order reproducible
+        when seed is given. deck, sorted question ids, replaces the
+        category's.
+    '''
+    def create(self, category_id, seed=None, deck=None):
+        rng = random.Random(seed)
+        if deck is not None:
+            deck = Deck(deck)
+        else:
+            with self._lock:
+                deck = self._decks.get(category_id)
+            if deck is None:
+                loaded = load_deck(category_id)
+                with self._lock:
+                    deck = self._decks.setdefault(category_id, loaded)
+        now = self._clock()
+        with self._lock:
+            session = QuizSession(secrets.token_urlsafe(16), category_id,
+                                  deck, rng, now + self.ttl)
+            self._sessions[session.id] = session
+            self._by_category[category_id].add(session.id)
+            self._evict(now)
+        return session
+
+    '''
+    create_adaptive(category_id, difficulty)
+        starts an adaptive session at the given difficulty band. Its
+        questions come straight from the database, so it needs no deck
+        patching.
+    '''
+    def create_adaptive(self, category_id, difficulty):
+        now = self._clock()
+        session = AdaptiveQuizSession(secrets.token_urlsafe(16), category_id,
+                                      difficulty, now + self.ttl)
+        with self._lock:
+            self._sessions[session.id] = session
+            self._evict(now)
+        return session
+
+    '''
+    get(session_id)
+        returns the live session and extends its TTL, or None when the
+        session is unknown or expired.
+    '''
+    def get(self, session_id):
+        now = self._clock()
+        with self._lock:
+            self._evict(now)
+            session = self._sessions.get(session_id)
+            if session is not None:
+                session.expires = now + self.ttl
+                self._sessions.move_to_end(session_id)
+            return session
+
+    def discard(self, session_id):
+        with self._lock:
+            return self._drop(session_id) is not None
+
+    def _decks_for(self, category_id):
+        for key in (category_id, None):
+            deck = self._decks.get(key)
+            if deck is not None:
+                yield key, deck
+            for session_id in self._by_category.get(key, ()):
+                yield key, self._sessions[session_id]
+
+    '''
+    apply(changes)
+        patches the live sessions and the shared decks with (question_id,
+        old_category, new_category) changes; a category of None means the
+        question did not exist before (insert) or no longer exists
+        (delete). Decks with more than MAX_DECK_CHANGES changes are dropped,
+        to be reloaded by the next session.
+    '''
+    def apply(self, changes):
+        with self._lock:
+            for question_id, old_category, new_category in changes:
+                if old_category is not None:
+                    for key, deck in self._decks_for(old_category):
+                        if new_category is None or key is not None:
+                            deck.remove(question_id)
+                if new_category is not None:
+                    for key, deck in self._decks_for(new_category):
+                        if old_category is None or key is not None:
+                            deck.add(question_id)
+            for key, deck in list(self._decks.items()):
+                if deck.changes > MAX_DECK_CHANGES:
+                    del self._decks[key]
+
+
+quiz_sessions = QuizSessionStore()
+
+
+def _deck_changes(session):
+    return session.info.setdefault('quiz_deck_changes', [])
+
+
+'''
+queue_deck_changes(session, changes)
+    records (question_id, old_category, new_category) changes made outside
+    the ORM so the decks are patched when the session commits.
+'''
+def queue_deck_changes(session, changes):
+    _deck_changes(session).extend(changes)
+
+
+def _category_of(value):
+    return None if value is None else int(value)
+
+
+def _question_inserted(mapper, connection, target):
+    session = object_session(target)
+    if session is not None and target.category is not None:
+        _deck_changes(session).append(
+            (target.id, None, _category_of(target.category)))
+
+
+def _question_deleted(mapper, connection, target):
+    session = object_session(target)
+    if session is not None and target.category is not None:
+        _deck_changes(session).append(
+            (target.id, _category_of(target.category), None))
+
+
+def _question_updated(mapper, connection, target):
+    session = object_session(target)
+    history = inspect(target).attrs.category.history
+    if session is None or not history.has_changes():
+        return
+    old = history.deleted[0] if history.deleted else None
+    new = history.added[0] if history.added else None
+    if old is not None and new is not None:
+        _deck_changes(session).append(
+            (target.id, _category_of(old), _category_of(new)))
+
+
+event.listen(Question, 'after_insert', _question_inserted)
+event.listen(Question, 'after_delete', _question_deleted)
+event.listen(Question, 'after_update', _question_updated)
+
+
+@event.listens_for(Session, 'after_commit')
+def _patch_decks_on_commit(session):
+    changes = session.info.pop('quiz_deck_changes', None)
+    if changes:
+        quiz_sessions.apply(changes)
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _forget_deck_changes(session, previous_transaction):
+    session.info.pop('quiz_deck_changes', None)
@@ -0,0 +1,164 @@
+'''
+Question search.
+
+Postgres: the questions table gets a GIN index on the english tsvector of
+the question text (word / stem matches, ranked with ts_rank) and a pg_trgm
+GIN index that serves the substring ILIKE matches the API always supported.
+
+SQLite: an external-content FTS5 table using the trigram tokenizer mirrors
+questions.question. Insert/update/delete triggers keep it in sync with every
+write, including post_question and delete_question, and bm25 gives the rank.
+
+The indexes are created lazily, once per engine, on the first search.
+'''
+
+import weakref
+
+from sqlalchemy import Table, MetaData, Column, Integer, String, Float, func, or_, text, literal_column
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Query
+
+from models import db, Question
+
+
+TS_CONFIG = 'english'
+TRIGRAM_LENGTH = 3
+
+fts_metadata = MetaData()
+questions_fts = Table('questions_fts', fts_metadata,
+                      Column('rowid', Integer),
+                      Column('question', String),
+                      Column('rank', Float))
+
+POSTGRES_DDL = [
+    "CREATE INDEX IF NOT EXISTS ix_questions_question_tsv ON questions "
+    "USING gin (to_tsvector('english', coalesce(question, '')))",
+]
+
+POSTGRES_TRIGRAM_DDL = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS ix_questions_question_trgm ON questions "
+    "USING gin (question gin_trgm_ops)",
+]
+
+SQLITE_DDL = [
+    "CREATE VIRTUAL TABLE questions_fts USING fts5("
+    "question, content='questions', content_rowid='id', tokenize='trigram')",
+    "CREATE TRIGGER IF NOT EXISTS questions_fts_insert AFTER INSERT ON questions "
+    "BEGIN INSERT INTO questions_fts(rowid, question) "
+    "VALUES (new.id, new.question); END",
+    "CREATE TRIGGER IF NOT EXISTS questions_fts_delete AFTER DELETE ON questions "
+    "BEGIN INSERT INTO questions_fts(questions_fts, rowid, question) "
+    "VALUES ('delete', old.id, old.question); END",
+    "CREATE TRIGGER IF NOT EXISTS questions_fts_update AFTER UPDATE OF question ON questions "
+    "BEGIN INSERT INTO questions_fts(questions_fts, rowid, question) "
+    "VALUES ('delete', old.id, old.question); "
+    "INSERT INTO questions_fts(rowid, question) VALUES (new.id, new.question); END",
+    "INSERT INTO questions_fts(questions_fts) VALUES ('rebuild')",
+]
+
+_indexed_engines = weakref.WeakSet()
+
+
+'''
+ensure_search_index(engine)
+    creates the search indexes (and on SQLite the FTS table and its sync
+    triggers) if the database does not have them yet. On SQLite the new
+    FTS table is rebuilt from the questions already stored.
+'''
+def ensure_search_index(engine):
+    if engine in _indexed_engines:
+        return
+
+    if engine.dialect.name == 'postgresql':
+        with engine.begin() as connection:
+            for statement in POSTGRES_DDL:
+                connection.execute(text(statement))
+        try:
+            with engine.begin() as connection:
+                for statement in POSTGRES_TRIGRAM_DDL:
+                    connection.execute(text(statement))
+        except SQLAlchemyError:
+            # pg_trgm needs CREATE privileges; substring matches still
+            # work without it, they are just not index-assisted.
+            pass
+    elif engine.dialect.name == 'sqlite':
+        if not engine.has_table('questions_fts'):
+            with engine.begin() as connection:
+                for statement in SQLITE_DDL:
+                    connection.execute(text(statement))
+
+    _indexed_engines.add(engine)
+
+
+def like_pattern(search_term):
+    escaped = search_term.replace('\\', '\\\\') \
+        .replace('%', '\\%').replace('_', '\\_')
+    return '%{}%'.format(escaped)
+
+
+'''
+search_statement(search_term, dialect)
+    returns the unbound query (no session) of the questions matching the
+    search term as column tuples, best matches first, for the given dialect
+    name. The ASGI mode executes its .statement on the async driver.
+'''
+def search_statement(search_term, dialect):
+    query = Query(Question.columns())
+
+    if dialect == 'postgresql':
+        document = func.to_tsvector(
+            TS_CONFIG, func.coalesce(Question.question, ''))
+        tsquery = func.plainto_tsquery(TS_CONFIG, search_term)
+        return query \
+            .filter(or_(document.op('@@')(tsquery),
+                        Question.question.ilike(like_pattern(search_term),
+                                                escape='\\'))) \
+            .order_by(func.ts_rank(document, tsquery).desc(), Question.id)
+    elif dialect == 'sqlite' and len(search_term) >= TRIGRAM_LENGTH:
+        phrase = '"{}"'.format(search_term.replace('"', '""'))
+        return query \
+            .join(questions_fts, questions_fts.c.rowid == Question.id) \
+            .filter(literal_column('questions_fts').op('MATCH')(phrase)) \
+            .order_by(questions_fts.c.rank, Question.id)
+    else:
+        return query \
+            .filter(Question.question.ilike(like_pattern(search_term),
+                                            escape='\\')) \
+            .order_by(Question.id)
+
+
+'''
+search_query(search_term)
+    search_statement() bound to the app's session, creating the search
+    indexes first if needed.
+'''
+def search_query(search_term):
+    ensure_search_index(db.engine)
+    return search_statement(search_term, db.engine.dialect.name) \
+        .with_session(db.session())
+
+
+'''
+search_page(query, page, per_page)
+    one page of a search query, with the total number of matches riding
+    along as a window count so a page is a single query.
+'''
+def search_page(query, page, per_page):
+    total = func.count().over().label('total')
+    return query.add_columns(total) \
+        .limit(per_page).offset((page - 1) * per_page)
+
+
+'''
+search_questions(search_term, page, per_page)
+    returns (formatted questions, total) for one page of the questions
+    matching the search term, best matches first.
+'''
+def search_questions(search_term, page=1, per_page=10):
+    rows = search_page(search_query(search_term), page, per_page).all()
+
+    if len(rows) == 0:
+        return [], 0
+
+    return Question.format_rows(row[:-1] for row in rows), rows[0].total
@@ -1,10 +1,22 @@
+import asyncio
 import os
+import random
 import unittest
+from unittest import mock
 import json
+from array import array
 from flask_sqlalchemy import SQLAlchemy
 
 from flaskr import create_app
-from models import setup_db, Question, Category
+from async_app import create_asgi_app
+from sqlalchemy import func
+
+from models import (setup_db, Question, Category, db, backfill_fingerprints,
+                    probe_rounds,
+                    refresh_category_counts)
+from quiz import QuizSessionStore, band_unseen, IndexPermutation
+import dedup
+import bulk
 
 class TriviaTestCase(unittest.TestCase):
     """This class represents the trivia test case"""
@@ -24,10 +36,16 @@ class TriviaTestCase(unittest.TestCase):
             self.db.init_app(self.app)
             # create all tables
             self.db.create_all()
+            # the questions a test adds get ids past this one
+            self.last_question_id = db.session.query(
+                func.max(Question.id)).scalar() or 0
 
     def tearDown(self):
         """Executed after reach test"""
-        pass
+        # removes the questions the test added, so that posting the same
+        # texts again on the next run is not a duplicate
+        with self.app.app_context():
+            bulk.delete_questions([Question.id > self.last_question_id])
 
     """
     TODO
@@ -62,6 +80,62 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(response_data['error'], 404)
         self.assertEqual(response_data['message'], "Not found")
 
+    '''
+    A GET request to /questions with an "after" cursor walks the questions
+    in id order and returns an exact total and a cursor for the next page.
+    '''
+
+    def test_200_get_questions_by_cursor(self):
+        first_page = json.loads(
+            self.client().get('/questions?after=').get_data())
+        self.assertEqual(first_page['success'], True)
+        self.assertTrue(first_page['next_cursor'])
+
+        response_object = self.client().get(
+            '/questions?after=' + first_page['next_cursor'])
+        response_data = json.loads(response_object.get_data())
+
+        self.assertEqual(response_object.status_code, 200)
+        self.assertEqual(response_data['total_questions'],
+                         first_page['total_questions'])
+        self.assertTrue(response_data['questions'][0]['id'] >
+                        first_page['questions'][-1]['id'])
+
+    '''
+    A request with a malformed cursor should return 400 status code.
+    '''
+
+    def test_400_get_questions_by_invalid_cursor(self):
+        response_object = self.client().get('/questions?after=not-a-cursor')
+        response_data = json.loads(response_object.get_data())
+
+        self.assertEqual(response_object.status_code, 400)
+        self.assertEqual(response_data['success'], False)
+        self.assertEqual(response_data['message'], 'Bad Request')
+
+    '''
+    A GET request to /questions with the ETag of the previous response in
+    If-None-Match should return 304, until a question is added.
+    '''
+
+    def test_304_get_questions_not_modified(self):
+        etag = self.client().get('/questions').headers['ETag']
+
+        response_object = self.client().get(
+            '/questions', headers={'If-None-Match': etag})
+        self.assertEqual(response_object.status_code, 304)
+        self.assertEqual(response_object.get_data(), b'')
+
+        self.client().post('/post/questions',
+                           json={"question": "Is this new?",
+                                 "answer": "Yes",
+                                 "category": 0,
+                                 "difficulty": 1})
+        response_object = self.client().get(
+            '/questions', headers={'If-None-Match': etag})
+        self.assertEqual(response_object.status_code, 200)
+        self.assertNotEqual(response_object.headers['ETag'], etag)
+
     '''
     A GET request to /categories endpoint should return 
     a list of categories and number of categories.
@@ -76,6 +150,51 @@ class TriviaTestCase(unittest.TestCase):
         self.assertTrue(response_data['categories'])
         self.assertTrue(response_data['number_of_categories'])
 
+    '''
+    Categories are served from the in-process cache: after the first read
+    the listing endpoints only count cache hits, and a committed Category
+    write is visible on the next request.
+    '''
+
+    def test_200_categories_served_from_cache(self):
+        self.client().get('/categories')
+        metrics = self.client().get('/metrics').get_data(as_text=True)
+        self.assertIn('trivia_category_cache_hits_total', metrics)
+
+        with self.app.app_context():
+            category = Category(type="Cached")
+            db.session.add(category)
+            db.session.commit()
+            try:
+                response_data = json.loads(
+                    self.client().get('/categories').get_data())
+                self.assertIn("Cached", response_data['categories'])
+            finally:
+                db.session.delete(category)
+                db.session.commit()
+
+        response_data = json.loads(self.client().get('/categories').get_data())
+        self.assertNotIn("Cached", response_data['categories'])
+
+    '''
+    /categories returns the number of questions of every category, and
+    the count follows new questions.
+    '''
+
+    def test_200_get_categories_with_question_counts(self):
+        before = json.loads(self.client().get('/categories').get_data())
+        self.client().post('/post/questions',
+                           json={"question": "Counted?",
+                                 "answer": "Yes",
+                                 "category": 0,
+                                 "difficulty": 1})
+        after = json.loads(self.client().get('/categories').get_data())
+
+        self.assertEqual(after['question_counts']['1'],
+                         before['question_counts']['1'] + 1)
+        self.assertEqual(after['question_counts']['2'],
+                         before['question_counts']['2'])
+
     '''
     A GET request to /categories/id/questions endpoint should return 
     a list of questions within specific category, total questions, and current category.
@@ -134,6 +253,104 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(response_data['error'], 404)
         self.assertEqual(response_data['message'], "Not found")
 
+    '''
+    Search results are paginated: every page reports the total number of
+    matches and pages do not overlap.
+    '''
+
+    def test_200_get_questions_by_searchterm_paginated(self):
+        for i in range(11):
+            self.client().post('/post/questions',
+                               json={"question": "Paginated quokka {}?".format(i),
+                                     "answer": "Quokka",
+                                     "category": 0,
+                                     "difficulty": 1})
+        first_page = json.loads(self.client().post(
+            "/questions", json={"searchTerm": "quokka"}).get_data())
+        response_object = self.client().post(
+            "/questions", json={"searchTerm": "quokka", "page": 2})
+        response_data = json.loads(response_object.get_data())
+
+        self.assertEqual(response_object.status_code, 200)
+        self.assertEqual(len(first_page['questions']), 10)
+        self.assertEqual(len(response_data['questions']), 1)
+        self.assertEqual(response_data['total_questions'], 11)
+        self.assertEqual(first_page['total_questions'], 11)
+        first_ids = [question['id'] for question in first_page['questions']]
+        for question in response_data['questions']:
+            self.assertNotIn(question['id'], first_ids)
+
+    '''
+    The limit parameter sets the page size of search results and of the
+    category listing, and is capped.
+    '''
+
+    def test_200_get_questions_with_limit(self):
+        response_data = json.loads(self.client().post(
+            "/questions", json={"searchTerm": "the", "limit": 3}).get_data())
+        self.assertEqual(len(response_data['questions']), 3)
+
+        everything = json.loads(self.client().get(
+            '/categories/1/questions?limit=100').get_data())
+        response_object = self.client().get(
+            '/categories/1/questions?page=2&limit=1')
+        response_data = json.loads(response_object.get_data())
+
+        self.assertEqual(response_object.status_code, 200)
+        self.assertEqual(response_data['questions'],
+                         everything['questions'][1:2])
+        self.assertEqual(response_data['total_questions'],
+                         len(everything['questions']))
+
+        response_object = self.client().get(
+            '/categories/1/questions?limit=1000')
+        self.assertEqual(response_object.status_code, 400)
+
+    '''
+    With "Accept: application/x-ndjson" every match is streamed, one
+    question per line.
+    '''
+
+    def test_200_stream_questions_as_ndjson(self):
+        headers = {"Accept": "application/x-ndjson"}
+        paged = json.loads(self.client().get(
+            '/categories/1/questions?limit=100').get_data())
+        response_object = self.client().get(
+            '/categories/1/questions', headers=headers)
+
+        self.assertEqual(response_object.status_code, 200)
+        self.assertEqual(response_object.mimetype, 'application/x-ndjson')
+        streamed = [json.loads(line) for line in
+                    response_object.get_data().splitlines()]
+        self.assertEqual(streamed, paged['questions'])
+
+        paged = json.loads(self.client().post(
+            "/questions", json={"searchTerm": "the"}).get_data())
+        response_object = self.client().post(
+            "/questions", json={"searchTerm": "the"}, headers=headers)
+        streamed = [json.loads(line) for line in
+                    response_object.get_data().splitlines()]
+        self.assertEqual(len(streamed), paged['total_questions'])
+        self.assertEqual(streamed[:10], paged['questions'])
+
+    '''
+    A newly posted question can be found by search right away.
+    '''
+
+    def test_200_search_finds_new_question(self):
+        self.client().post('/post/questions',
+                           json={"question": "Which planet is xylophonic?",
+                                 "answer": "None",
+                                 "category": 0,
+                                 "difficulty": 1})
+        response_object = self.client().post(
+            "/questions", json={"searchTerm": "XYLOPHONIC"})
+        response_data = json.loads(response_object.get_data())
+
+        self.assertEqual(response_object.status_code, 200)
+        self.assertEqual(response_data['questions'][0]['question'],
+                         "Which planet is xylophonic?")
+
     '''
     A POST request to /post/questions endpoint should return 
     a status code 200.
@@ -151,6 +368,27 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(response_data['success'], True)
         self.assertTrue(response_data['message'])
     '''
+    A question whose text only differs by case, punctuation or spacing from
+    a stored one is rejected with 409 and the id of the stored question.
+    '''
+
+    def test_409_post_duplicate_question(self):
+        payload = {"question": "Is duplicate detection on?",
+                   "answer": "Yes",
+                   "category": 0,
+                   "difficulty": 1}
+        self.client().post('/post/questions', json=payload)
+        payload['question'] = "  is Duplicate detection ON "
+        response_object = self.client().post('/post/questions', json=payload)
+        response_data = json.loads(response_object.get_data())
+
+        self.assertEqual(response_object.status_code, 409)
+        self.assertEqual(response_data['success'], False)
+        with self.app.app_context():
+            original = Question.query.get(response_data['duplicate_of'])
+            self.assertEqual(original.question, "Is duplicate detection on?")
+
+    '''
     A POST request to /post/questions endpoint with missing required parameters
     should return a status code 400.
     '''
@@ -166,6 +404,97 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(response_data['success'], False)
         self.assertEqual(response_data['message'], 'Bad Request')
 
+    '''
+    A POST request to /questions/import inserts the valid NDJSON rows and
+    reports the invalid ones by line number without aborting the load.
+    '''
+
+    def test_200_bulk_import_questions(self):
+        body = "\n".join([
+            json.dumps({"question": "Imported one?", "answer": "One",
+                        "category": 1, "difficulty": 1}),
+            "not json",
+            json.dumps({"question": "Imported two?", "answer": "Two",
+                        "category": 1, "difficulty": 9}),
+            json.dumps({"question": "Imported three?", "answer": "Three",
+                        "category": 2, "difficulty": 3}),
+        ])
+        response_object = self.client().post(
+            '/questions/import?batch_size=1', data=body,
+            content_type='application/x-ndjson')
+        response_data = json.loads(response_object.get_data())
+
+        self.assertEqual(response_object.status_code, 200)
+        self.assertEqual(response_data['success'], True)
+        self.assertEqual(response_data['inserted'], 2)
+        self.assertEqual(response_data['rejected'], 2)
+        self.assertEqual([error['line'] for error in response_data['errors']],
+                         [2, 3])
+        self.assertEqual(len(response_data['batches']), 2)
+
+    '''
+    Imports skip rows that repeat a stored question or an earlier row.
+    '''
+
+    def test_200_bulk_import_skips_duplicates(self):
+        body = "\n".join(json.dumps(row) for row in [
+            {"question": "Whose autobiography is entitled 'I Know Why the "
+                         "Caged Bird Sings'?", "answer": "Maya Angelou",
+             "category": 4, "difficulty": 2},
+            {"question": "Imported once?", "answer": "Once",
+             "category": 1, "difficulty": 1},
+            {"question": "IMPORTED ONCE", "answer": "Twice",
+             "category": 1, "difficulty": 1},
+        ])
+        response_object = self.client().post(
+            '/questions/import', data=body,
+            content_type='application/x-ndjson')
+        response_data = json.loads(response_object.get_data())
+
+        self.assertEqual(response_data['inserted'], 1)
+        self.assertEqual(response_data['duplicates'], 2)
+        self.assertEqual(response_data['rejected'], 0)
+        self.assertEqual(response_data['errors'][1]['error'],
+                         'duplicate of line 2')
+
+    '''
+    The offline dedup pass keeps the oldest copy of every question.
+    '''
+
+    def test_collapse_duplicate_questions(self):
+        with self.app.app_context():
+            # written past the duplicate check, without fingerprints
+            db.session.execute(Question.__table__.insert(), [
+                {"question": "Stored twice?", "answer": "Yes",
+                 "category": 1, "difficulty": 1}] * 3)
+            db.session.commit()
+            # and past the category counters
+            refresh_category_counts()
+            oldest = db.session.query(func.min(Question.id)).filter(
+                Question.question == "Stored twice?").scalar()
+
+            self.assertEqual(backfill_fingerprints(), 3)
+            self.assertEqual(dedup.collapse_duplicates(dry_run=True), (1, 2))
+            self.assertEqual(dedup.collapse_duplicates(), (1, 2))
+            remaining = [question.id for question in Question.query.filter(
+                Question.question == "Stored twice?")]
+            self.assertEqual(remaining, [oldest])
+
+    '''
+    CSV imports read the header row for the column names.
+    '''
+
+    def test_200_bulk_import_questions_csv(self):
+        body = ("question,answer,category,difficulty\n"
+                "Imported from CSV?,Yes,3,2\n")
+        response_object = self.client().post(
+            '/questions/import', data=body, content_type='text/csv')
+        response_data = json.loads(response_object.get_data())
+
+        self.assertEqual(response_object.status_code, 200)
+        self.assertEqual(response_data['inserted'], 1)
+        self.assertEqual(response_data['rejected'], 0)
+
     '''
     A DELETE request to /questions/id with given question ID should return a 200
     status code and delete the question from the database.
@@ -191,6 +520,84 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(response_data['success'], False)
         self.assertEqual(response_data['message'], 'Bad Request')
 
+    '''
+    Bulk delete and update change every selected question in one call,
+    return the affected count and keep the category counts current.
+    '''
+
+    def post_bulk_questions(self, count):
+        for i in range(count):
+            self.client().post('/post/questions',
+                               json={"question": "Bulk question {}?".format(i),
+                                     "answer": "Bulk",
+                                     "category": 0,
+                                     "difficulty": 1})
+        with self.app.app_context():
+            return [question.id for question in Question.query.filter(
+                Question.answer == "Bulk").all()]
+
+    def test_200_bulk_delete_questions(self):
+        ids = self.post_bulk_questions(3)
+        before = json.loads(self.client().get('/categories').get_data())
+
+        response_object = self.client().post(
+            '/questions/bulk-delete', json={"ids": ids})
+        response_data = json.loads(response_object.get_data())
+
+        self.assertEqual(response_object.status_code, 200)
+        self.assertEqual(response_data['deleted'], len(ids))
+        after = json.loads(self.client().get('/categories').get_data())
+        self.assertEqual(after['question_counts'].get('1', 0),
+                         before['question_counts']['1'] - len(ids))
+
+        response_data = json.loads(self.client().post(
+            '/questions/bulk-delete', json={"ids": ids}).get_data())
+        self.assertEqual(response_data['deleted'], 0)
+
+    def test_200_bulk_update_questions_by_filter(self):
+        ids = self.post_bulk_questions(2)
+        before = json.loads(self.client().get('/categories').get_data())
+
+        response_object = self.client().post('/questions/bulk-update', json={
+            "ids": ids,
+            "where": {"category": 1, "difficulty": {"lt": 2}},
+            "set": {"category": 2, "difficulty": 4}})
+        response_data = json.loads(response_object.get_data())
+
+        self.assertEqual(response_object.status_code, 200)
+        self.assertEqual(response_data['updated'], len(ids))
+        after = json.loads(self.client().get('/categories').get_data())
+        self.assertEqual(after['question_counts']['2'],
+                         before['question_counts']['2'] + len(ids))
+
+        response_data = json.loads(self.client().post(
+            '/questions/bulk-delete',
+            json={"where": {"category": 2, "difficulty": {"gte": 4}},
+                  "ids": ids}).get_data())
+        self.assertEqual(response_data['deleted'], len(ids))
+
+    def test_200_bulk_delete_more_ids_than_a_chunk(self):
+        ids = self.post_bulk_questions(3)
+        # unknown ids are skipped; the list is locked and deleted in chunks
+        padding = list(range(10 ** 6, 10 ** 6 + 3 * bulk.ID_CHUNK_SIZE))
+
+        response_object = self.client().post(
+            '/questions/bulk-delete', json={"ids": padding + ids})
+        response_data = json.loads(response_object.get_data())
+
+        self.assertEqual(response_object.status_code, 200)
+        self.assertEqual(response_data['deleted'], len(ids))
+
+    def test_400_bulk_questions(self):
+        for path, payload in (
+                ('/questions/bulk-delete', {}),
+                ('/questions/bulk-delete', {"ids": []}),
+                ('/questions/bulk-delete', {"where": {"difficulty": {"like": 1}}}),
+                ('/questions/bulk-update', {"ids": [1], "set": {"answer": "x"}}),
+                ('/questions/bulk-update', {"ids": [1], "set": {"difficulty": 9}})):
+            response_object = self.client().post(path, json=payload)
+            self.assertEqual(response_object.status_code, 400)
+
     '''
     A POST request to /quizzes get the next question of the quiz should return a random question
     within the given category, which is not included in the list of previous questions.
@@ -206,6 +613,317 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(response_object.status_code, 200)
         question_from_endpoint = response_data['question']
 
+    '''
+    A POST request to /quizzes never returns one of the previous questions,
+    and returns no question once every question in the category was played.
+    '''
+
+    def test_200_play_quiz_skips_previous_questions(self):
+        previous_questions = []
+        while True:
+            payload = {"previous_questions": previous_questions,
+                       "quiz_category": {"id": 2}}
+            response_object = self.client().post('/quizzes', json=payload)
+            response_data = json.loads(response_object.get_data())
+
+            self.assertEqual(response_object.status_code, 200)
+            question = response_data['question']
+            if question is None:
+                break
+            self.assertNotIn(question['id'], previous_questions)
+            previous_questions.append(question['id'])
+
+        self.assertTrue(previous_questions)
+
+    '''
+    Every unplayed question is as likely to be picked, whatever the gaps
+    left by the played ids before it.
+    '''
+
+    def test_random_unseen_is_uniform(self):
+        with self.app.app_context():
+            ids = [question_id for question_id, in db.session.query(
+                Question.id).order_by(Question.id)]
+            # the second id follows one played id, the last one many
+            unplayed = [ids[1], ids[-1]]
+            played = [i for i in ids if i not in unplayed]
+            picks = [Question.random_unseen(None, played).id
+                     for _ in range(400)]
+
+        for question_id in unplayed:
+            self.assertGreater(picks.count(question_id), 100)
+
+    '''
+    The probes are sized so a few of them hit an unseen question, grow
+    when a round misses and stop once a round covers every id.
+    '''
+
+    def test_probe_rounds_sized_by_density(self):
+        rounds = list(probe_rounds(1, 1000, unseen=10))
+        self.assertEqual([len(probes) for probes in rounds], [400, 1000])
+        self.assertEqual(sorted(rounds[-1]), list(range(1, 1001)))
+
+        rounds = list(probe_rounds(1, 100000))
+        self.assertEqual([len(probes) for probes in rounds], [16, 64, 256])
+        for probes in rounds:
+            self.assertEqual(len(set(probes)), len(probes))
+            self.assertTrue(all(1 <= i <= 100000 for i in probes))
+
+    '''
+    When every probe misses, random_unseen walks the index from a random
+    id: it still returns only unseen questions of the filters, and None
+    once they were all played.
+    '''
+
+    def test_random_unseen_walks_when_probes_miss(self):
+        with self.app.app_context(), \
+                mock.patch('models.probe_rounds', return_value=[]):
+            ids = [question_id for question_id, in db.session.query(
+                Question.id).filter(Question.category == '1')]
+            played = ids[:-2]
+            picks = set(Question.random_unseen(1, played).id
+                        for _ in range(50))
+            exhausted = Question.random_unseen(1, ids)
+
+        self.assertEqual(picks, set(ids[-2:]))
+        self.assertIsNone(exhausted)
+
+    '''
+    Once every question of the category was played, /quizzes returns no
+    question and the category count.
+    '''
+
+    def test_200_play_quiz_exhausted(self):
+        category = json.loads(self.client().get(
+            '/categories/3/questions').get_data())
+        played = [question['id'] for question in category['questions']]
+
+        response_object = self.client().post('/quizzes', json={
+            "previous_questions": played,
+            "quiz_category": {"id": 2}})
+        response_data = json.loads(response_object.get_data())
+
+        self.assertEqual(response_object.status_code, 200)
+        self.assertEqual(response_data['question'], None)
+        self.assertEqual(response_data['total_questions'], len(played))
+
+    '''
+    Previous question ids of other categories or of deleted questions do
+    not end the quiz while questions of the category are left.
+    '''
+
+    def test_200_play_quiz_with_foreign_previous_questions(self):
+        response_object = self.client().post('/quizzes', json={
+            "previous_questions": list(range(100000, 100050)),
+            "quiz_category": {"id": 2}})
+        response_data = json.loads(response_object.get_data())
+
+        self.assertEqual(response_object.status_code, 200)
+        self.assertNotEqual(response_data['question'], None)
+
+    '''
+    A quiz session remembers the questions it served: POST /quizzes with
+    only the session id never repeats a question.
+    '''
+
+    def test_200_play_quiz_with_session(self):
+        response_object = self.client().post(
+            '/quizzes/sessions', json={"quiz_category": {"id": 2}})
+        session_id = json.loads(response_object.get_data())['session_id']
+
+        served = []
+        while True:
+            response_data = json.loads(self.client().post(
+                '/quizzes', json={"session_id": session_id}).get_data())
+            if response_data['question'] is None:
+                break
+            self.assertNotIn(response_data['question']['id'], served)
+            served.append(response_data['question']['id'])
+
+        self.assertEqual(len(served), response_data['total_questions'])
+        self.assertEqual(response_data['played'], len(served))
+
+        response_object = self.client().delete(
+            '/quizzes/sessions/' + session_id)
+        self.assertEqual(response_object.status_code, 200)
+
+    '''
+    A seeded quiz session plays its deck in the same order every time, and
+    a question added during the quiz is shuffled into the unplayed part.
+    '''
+
+    def play_quiz_session(self, seed, before_each_step=None):
+        response_data = json.loads(self.client().post(
+            '/quizzes/sessions',
+            json={"quiz_category": {"id": 0}, "seed": seed}).get_data())
+        session_id = response_data['session_id']
+        served = []
+        while True:
+            if before_each_step is not None:
+                before_each_step(len(served))
+            response_data = json.loads(self.client().post(
+                '/quizzes', json={"session_id": session_id}).get_data())
+            if response_data['question'] is None:
+                return served
+            served.append(response_data['question']['question'])
+
+    def test_200_play_quiz_session_seeded_deck(self):
+        self.assertEqual(self.play_quiz_session(42),
+                         self.play_quiz_session(42))
+
+        def add_question_after_first_step(step):
+            if step == 1:
+                self.client().post('/post/questions',
+                                   json={"question": "Added mid-quiz?",
+                                         "answer": "Yes",
+                                         "category": 0,
+                                         "difficulty": 1})
+
+        served = self.play_quiz_session(42, add_question_after_first_step)
+        self.assertIn("Added mid-quiz?", served[1:])
+
+    '''
+    Sessions of a category share one deck of ids and each plays it in its
+    own order; a question deleted before its turn is skipped and no longer
+    counted, one deleted after it was played still is.
+    '''
+
+    def test_quiz_sessions_share_the_deck(self):
+        for n in (1, 2, 7, 64, 1000):
+            order = IndexPermutation(n, random.Random(n))
+            steps = [order[k] for k in range(n)]
+            self.assertEqual(sorted(steps), list(range(n)))
+            self.assertEqual([order.index(i) for i in steps], list(range(n)))
+
+        store = QuizSessionStore()
+        with self.app.app_context():
+            first = store.create(2, seed=1)
+            second = store.create(2, seed=2)
+            self.assertIs(first.ids, second.ids)
+            total = first.total
+
+            played = first.next_question().id
+            unplayed = next(i for i in first.ids if i != played)
+            store.apply([(played, 2, None), (unplayed, 2, None)])
+            self.assertEqual(first.total, total - 1)
+            self.assertEqual(second.total, total - 2)
+
+            served = [played]
+            while True:
+                question = first.next_question()
+                if question is None:
+                    break
+                served.append(question.id)
+
+            third = store.create(2, seed=3)
+
+        self.assertNotIn(unplayed, served)
+        self.assertEqual(sorted(served), sorted(set(first.ids) - {unplayed}))
+        self.assertEqual(third.total, total - 2)
+
+    '''
+    An unknown or ended quiz session should return 404 status code.
+    '''
+
+    def test_404_play_quiz_with_unknown_session(self):
+        response_object = self.client().post(
+            '/quizzes', json={"session_id": "no-such-session"})
+        response_data = json.loads(response_object.get_data())
+
+        self.assertEqual(response_object.status_code, 404)
+        self.assertEqual(response_data['success'], False)
+
+    '''
+    Quiz sessions expire after their TTL without access, oldest first.
+    '''
+
+    def test_quiz_sessions_expire(self):
+        now = [0]
+        store = QuizSessionStore(ttl=10, max_sessions=2,
+                                 clock=lambda: now[0])
+        first = store.create(None, deck=array('i'))
+        second = store.create(1, deck=array('i'))
+
+        now[0] = 5
+        self.assertIs(store.get(first.id), first)
+        now[0] = 8
+        third = store.create(2, deck=array('i'))
+        self.assertIsNone(store.get(second.id))
+
+        now[0] = 16
+        self.assertIsNone(store.get(first.id))
+        self.assertIs(store.get(third.id), third)
+
+    '''
+    In adaptive mode the difficulty band moves up after a correct answer and
+    down after a wrong one, staying within 1..5.
+    '''
+
+    def test_200_play_adaptive_quiz(self):
+        payload = {"previous_questions": [],
+                   "quiz_category": {"id": -1},
+                   "difficulty": 5,
+                   "last_answer_correct": True}
+        response_data = json.loads(self.client().post(
+            '/quizzes', json=payload).get_data())
+        self.assertEqual(response_data['difficulty'], 5)
+        self.assertIsNotNone(response_data['question'])
+
+        payload.update(difficulty=3, last_answer_correct=False)
+        response_data = json.loads(self.client().post(
+            '/quizzes', json=payload).get_data())
+        self.assertEqual(response_data['difficulty'], 2)
+
+    def test_200_play_adaptive_quiz_session(self):
+        response_data = json.loads(self.client().post(
+            '/quizzes/sessions',
+            json={"quiz_category": {"id": -1}, "difficulty": 1}).get_data())
+        session_id = response_data['session_id']
+        self.assertEqual(response_data['difficulty'], 1)
+
+        served = []
+        while True:
+            response_data = json.loads(self.client().post(
+                '/quizzes', json={"session_id": session_id,
+                                  "last_answer_correct": True}).get_data())
+            if response_data['question'] is None:
+                break
+            self.assertNotIn(response_data['question']['id'], served)
+            served.append(response_data['question']['id'])
+
+        self.assertEqual(response_data['difficulty'], 5)
+        self.assertEqual(len(served), response_data['total_questions'])
+
+    '''
+    Adaptive picks size their probes from the category count less the
+    played ids, spread over the five bands.
+    '''
+
+    def test_adaptive_probes_sized_from_category_count(self):
+        self.assertEqual(band_unseen(100, set(range(10))), 18)
+        self.assertIsNone(band_unseen(None, set()))
+
+        with mock.patch('quiz.Question.random_unseen',
+                        return_value=None) as random_unseen:
+            self.client().post('/quizzes', json={
+                "previous_questions": [1, 2],
+                "quiz_category": {"id": 1},
+                "difficulty": 3})
+
+        with self.app.app_context():
+            total = Question.query.filter(Question.category == '1').count()
+        self.assertEqual(random_unseen.call_count, 5)
+        for call in random_unseen.call_args_list:
+            self.assertEqual(call[0][3], (total - 2) // 5)
+
+    def test_400_play_adaptive_quiz_bad_difficulty(self):
+        for difficulty in (0, 6, "3", True):
+            response_object = self.client().post('/quizzes', json={
+                "previous_questions": [],
+                "quiz_category": {"id": -1},
+                "difficulty": difficulty})
+            self.assertEqual(response_object.status_code, 400)
+
     '''
     A POST request to /quizzes without specifying the quiz category correctly
     should return 400 status code.
@@ -223,6 +941,102 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(response_data['success'], False)
         self.assertEqual(response_data['message'], 'Bad Request')
 
+    '''
+    The ASGI app answers quiz steps and searches from its async pool with
+    the Flask views' responses, and hands every other request to the Flask
+    app.
+    '''
+
+    def test_asgi_app(self):
+        asgi_app = create_asgi_app(
+            {'SQLALCHEMY_DATABASE_URI': self.database_path})
+
+        async def call(method, path, payload=None):
+            body = json.dumps(payload).encode() if payload is not None else b''
+            scope = {'type': 'http', 'http_version': '1.1', 'method': method,
+                     'scheme': 'http', 'path': path, 'query_string': b'',
+                     'server': ('localhost', 80),
+                     'headers': [(b'content-type', b'application/json'),
+                                 (b'content-length', str(len(body)).encode())]}
+            requests = [{'type': 'http.request', 'body': body}]
+            messages = []
+
+            async def receive():
+                return requests.pop() if requests else {'type': 'http.disconnect'}
+
+            async def send(message):
+                messages.append(message)
+
+            await asgi_app(scope, receive, send)
+            return messages[0]['status'], json.loads(
+                b''.join(message.get('body', b'') for message in messages[1:]))
+
+        async def play():
+            await asgi_app.startup()
+            try:
+                return [
+                    await call('POST', '/quizzes', {'previous_questions': [],
+                                                    'quiz_category': {'id': 1}}),
+                    await call('POST', '/quizzes', {'quiz_category': {'id': None}}),
+                    await call('POST', '/questions', {'searchTerm': 'title'}),
+                    await call('GET', '/categories'),
+                ]
+            finally:
+                await asgi_app.database.disconnect()
+
+        quiz, bad_quiz, search, categories = asyncio.run(play())
+
+        flask_quiz = json.loads(self.client().post('/quizzes', json={
+            'previous_questions': [], 'quiz_category': {'id': 1}}).get_data())
+        self.assertEqual(quiz[0], 200)
+        self.assertTrue(quiz[1]['question'])
+        self.assertEqual(quiz[1]['total_questions'],
+                         flask_quiz['total_questions'])
+        self.assertEqual(bad_quiz[0], 400)
+        self.assertEqual(search, (200, json.loads(self.client().post(
+            '/questions', json={'searchTerm': 'title'}).get_data())))
+        self.assertEqual(categories[0], 200)
+        self.assertTrue(categories[1]['categories'])
+
+    '''
+    GET /metrics reports per-endpoint latency and query count histograms,
+    and SLOW_REQUEST_LOG logs the slowest requests with their SQL.
+    '''
+
+    def test_200_request_metrics(self):
+        self.client().get('/questions?page=1')
+        response_object = self.client().get('/metrics')
+        metrics = response_object.get_data(as_text=True)
+
+        self.assertEqual(response_object.status_code, 200)
+        self.assertIn('trivia_http_requests_total{method="GET",'
+                      'endpoint="/questions",status="200"}', metrics)
+        self.assertIn('trivia_http_request_duration_seconds_count{method="GET",'
+                      'endpoint="/questions"}', metrics)
+        self.assertIn('trivia_http_request_queries_bucket{method="GET",'
+                      'endpoint="/questions",le="+Inf"}', metrics)
+
+    def test_slow_request_log(self):
+        app = create_app({'SQLALCHEMY_DATABASE_URI': self.database_path,
+                          'SLOW_REQUEST_LOG': 1})
+        with self.assertLogs('trivia.slow', level='WARNING') as logs:
+            app.test_client().get('/categories/1/questions')
+        self.assertIn('/categories/1/questions', logs.output[0])
+        self.assertIn('SELECT', logs.output[0])
+
+    '''
+    The column projection read path builds the same dicts as format().
+    '''
+
+    def test_format_rows_matches_format(self):
+        with self.app.app_context():
+            questions = Question.query.order_by(Question.id).all()
+            rows = db.session.query(*Question.columns()) \
+                .order_by(Question.id).all()
+
+            self.assertEqual(Question.format_rows(rows),
+                             [question.format() for question in questions])
+
 # Make the tests conveniently executable
 if __name__ == "__main__":
     unittest.main()
@@ -14,6 +14,8 @@ class QuestionView extends Component {
       totalQuestions: 0,
       categories: {},
       currentCategory: null,
+      // what the pages walk through: every question, a category or a search
+      listing: {type: 'all'},
     }
   }
 
@@ -40,8 +42,23 @@ class QuestionView extends Component {
     })
   }
 
+  showAll = () => {
+    this.setState({page: 1, listing: {type: 'all'}}, () => this.getQuestions());
+  }
+
+  loadPage = () => {
+    const {listing, page} = this.state;
+    if (listing.type === 'category') {
+      this.getByCategory(listing.categoryId, page);
+    } else if (listing.type === 'search') {
+      this.submitSearch(listing.searchTerm, page);
+    } else {
+      this.getQuestions();
+    }
+  }
+
   selectPage(num) {
-    this.setState({page: num}, () => this.getQuestions());
+    this.setState({page: num}, () => this.loadPage());
   }
 
   createPagination(){
@@ -58,15 +75,17 @@ class QuestionView extends Component {
     return pageNumbers;
   }
 
-  getByCategory= (id) => {
+  getByCategory= (id, page = 1) => {
     $.ajax({
-      url: `/categories/${id}/questions`, //TODO: update request URL
+      url: `/categories/${id}/questions?page=${page}`, //TODO: update request URL
       type: "GET",
       success: (result) => {
         this.setState({
           questions: result.questions,
           totalQuestions: result.total_questions,
-          currentCategory: result.current_category })
+          currentCategory: result.current_category,
+          page: page,
+          listing: {type: 'category', categoryId: id} })
         return;
       },
       error: (error) => {
@@ -76,13 +95,13 @@ class QuestionView extends Component {
     })
   }
 
-  submitSearch = (searchTerm) => {
+  submitSearch = (searchTerm, page = 1) => {
     $.ajax({
       url: `/questions`, //TODO: update request URL
       type: "POST",
       dataType: 'json',
       contentType: 'application/json',
-      data: JSON.stringify({searchTerm: searchTerm}),
+      data: JSON.stringify({searchTerm: searchTerm, page: page}),
       xhrFields: {
         withCredentials: true
       },
@@ -91,7 +110,9 @@ class QuestionView extends Component {
         this.setState({
           questions: result.questions,
           totalQuestions: result.total_questions,
-          currentCategory: result.current_category })
+          currentCategory: result.current_category,
+          page: page,
+          listing: {type: 'search', searchTerm: searchTerm} })
         return;
       },
       error: (error) => {
@@ -109,7 +130,7 @@ class QuestionView extends Component {
           type: "DELETE",
           success: (result) => {
             alert(result.message)
-            this.getQuestions();
+            this.loadPage();
           },
           error: (error) => {
             alert('Unable to load questions. Please try your request again')
@@ -124,7 +145,7 @@ class QuestionView extends Component {
     return (
       <div className="question-view">
         <div className="categories-list">
-          <h2 onClick={() => {this.getQuestions()}}>Categories</h2>
+          <h2 onClick={() => {this.showAll()}}>Categories</h2>
           <ul>
             {Object.keys(this.state.categories).map((id, ) => (
               <li key={id} onClick={() => {this.getByCategory(id)}}>